@@ -0,0 +1,61 @@
+# Content-addressed cache of whole analysis results.
+#
+# Each result is stored under the hash of everything it depends on: the content of the input files
+# (gene sets database, expression set or ranked list, phenotype labels, chip) and the analysis
+# parameters (remap mode, permutations, gene set sizes, seed, engine...). The analyses are seeded, so
+# running again the same analysis gives the same result, which is then read from the cache at once.
+#
+# The results are kept in the result store format (see result_store.py), one sub-directory per hash,
+# and the least recently used ones are evicted when the cache exceeds its size cap.
+import os
+import os.path
+import json
+import hashlib
+
+from input_readers import file_hash
+from result_store import STORE_VERSION, StoredResult, write_result, evict_results
+
+# Directory in which the analysis results are cached, one sub-directory per hash
+ANALYSIS_CACHE_DIR = os.path.join(os.path.expanduser("~"), "gseacompass_cache", "analyses")
+
+# Maximum disk space used by the cached results (MB), it can be set through the environment (0 disables the cache)
+ANALYSIS_CACHE_MB = int(os.environ.get("GSEACOMPASS_ANALYSIS_CACHE_MB", 2048))
+
+# Return the cache key of an analysis of the given type, input files (name -> path, None if not used)
+# and parameters (JSON-serializable dict), None if any of the files can't be read
+def analysis_key(analysis_type, files, parameters):
+    key = {"type": analysis_type, "version": STORE_VERSION, "parameters": parameters}
+    digest = hashlib.sha256(json.dumps(key, sort_keys=True).encode())
+
+    try:
+        for name, path in sorted(files.items()):
+            if path is not None:
+                digest.update((name + ":" + file_hash(path)).encode())
+    except OSError:
+        return None
+
+    return digest.hexdigest()
+
+# Return the cached result of the given key, None if it isn't cached
+def load_cached(key):
+    if key is None or ANALYSIS_CACHE_MB <= 0:
+        return None
+    try:
+        return StoredResult(os.path.join(ANALYSIS_CACHE_DIR, key))
+    except (OSError, ValueError, KeyError):
+        return None
+
+# Cache the given result object under the given key and return the cached result
+# The result is returned as it is if the cache is disabled or it can't be written
+def store_cached(res, key):
+    if key is None or ANALYSIS_CACHE_MB <= 0:
+        return res
+
+    cache_dir = os.path.join(ANALYSIS_CACHE_DIR, key)
+    try:
+        os.makedirs(ANALYSIS_CACHE_DIR, exist_ok=True)
+        write_result(res, cache_dir)
+        evict_results(ANALYSIS_CACHE_DIR, ANALYSIS_CACHE_MB, keep=(key,))
+        return StoredResult(cache_dir)
+    except OSError:
+        return res
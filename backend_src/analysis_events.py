@@ -0,0 +1,60 @@
+# Line-delimited events written by the analysis scripts while they run.
+#
+# Each event is a JSON object written on its own line:
+#   {"event": "phase", "phase": <"reading-inputs" | "computing" | "writing-results">}
+#   {"event": "progress", "done": <permutations done>, "total": <permutations requested>}
+#   {"event": "result", "final": <bool>, "row": <results table row>}
+#   {"event": "summary", "gene_sets": <int>, "significant": <gene sets with FDR < 25%>, "seconds": <float>}
+# A "result" event with final false carries the provisional estimates of a gene set (adaptive mode),
+# it's later replaced by the final one of the same Term.
+#
+# The events are written on stdout by default, the backend worker replaces the sink to forward them
+# to the main process as soon as they are emitted.
+import sys
+import json
+import math
+
+# Function called with each event (dict), None to discard the events
+def stdout_sink(event):
+    sys.stdout.write(json.dumps(event) + "\n")
+    sys.stdout.flush()
+
+sink = stdout_sink
+
+# Set the function called with each event and return the previous one
+def set_sink(new_sink):
+    global sink
+    old_sink = sink
+    sink = new_sink
+    return old_sink
+
+# Utility function to replace NaN/infinite floats (not valid JSON) with None
+def json_safe(value):
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
+
+# Emit an event of the given type with the given fields
+def emit(event_type, **fields):
+    if sink is not None:
+        event = {"event": event_type}
+        event.update({k: json_safe(v) for k, v in fields.items()})
+        sink(event)
+
+def phase(name):
+    emit("phase", phase=name)
+
+def progress(done, total):
+    emit("progress", done=done, total=total)
+
+def result(row, final=True):
+    emit("result", final=final, row={k: json_safe(v) for k, v in row.items()})
+
+# Emit a final result event for each row of the results table
+def results_table(res2d):
+    for row in json.loads(res2d.to_json(orient="records")):
+        result(row)
+
+def summary(res2d, seconds):
+    significant = int((res2d["FDR q-val"].astype(float) < 0.25).sum())
+    emit("summary", gene_sets=len(res2d), significant=significant, seconds=round(seconds, 3))
@@ -0,0 +1,21 @@
+# Optional "key=value" arguments of the backend scripts.
+#
+# The analysis scripts accept, after their positional arguments, any number of "key=value"
+# options (e.g. engine=gseapy). Unknown keys are ignored, missing ones take the default value.
+
+# Return True if the given argument is an option
+def is_option(arg):
+    return "=" in arg
+
+# Parse the options among the given arguments into a dictionary
+def parse_options(args):
+    options = {}
+    for arg in args:
+        if is_option(arg):
+            key, _, value = arg.partition("=")
+            options[key.strip()] = value.strip()
+    return options
+
+# Return the positional arguments among the given ones (i.e. the ones that aren't options)
+def positional_args(args):
+    return [arg for arg in args if not is_option(arg)]
@@ -0,0 +1,236 @@
+# Long-lived backend worker, it loads the python libraries just once and serves the analysis,
+# plot and gene set info commands sent by the Electron main process.
+#
+# Protocol: one JSON request per line on stdin, one JSON message per line on stdout
+#   request:  {"id": <int>, "command": <str>, "args": [<str>, ...]}
+#   event:    {"id": <int>, "event": <event>}, zero or more while the request is served (see analysis_events.py)
+#   response: {"id": <int>, "code": <int>, "stdout": <str>, "stderr": <str>}, once the request is completed
+# The args of each command are the same of the corresponding script call, while code, stdout and
+# stderr are the ones the script would have produced, so that callers can handle both the same way.
+# The analyses and the bulk exports (see CHILD_COMMANDS) run in child processes, so the worker keeps serving
+# the plots and the gene set info while they run, and their responses may come out of the requests order.
+# The analysis commands take the run ID right after the positional arguments (followed by any
+# "key=value" option), the plot command as first argument. The plot-export command takes the extension to
+# export followed by the arguments of the plot command. The enrichment-plots-export and leading-edge commands take the run ID as
+# first argument too. The set-profile command takes the destination of the profiling records (see
+# profiling.py, empty to disable the profiling) and applies it to the following requests.
+import sys
+import os
+
+# The plots are saved to files, matplotlib is set to its non-interactive backend before any script imports it
+os.environ["MPLBACKEND"] = "Agg"
+
+import json
+import traceback
+import threading
+import multiprocessing
+from collections import OrderedDict
+from io import StringIO
+from contextlib import redirect_stdout, redirect_stderr
+
+import gsea
+import gsea_preranked
+import gsea_plot
+import enrichment_export
+import leading_edge
+import gene_set_info
+import msigdb_search
+import analysis_events as events
+import profiling
+from result_store import save_result, load_result
+
+# Maximum number of analysis results kept in memory
+MAX_RESULTS_IN_MEMORY = 4
+
+# Commands run in a child process of their own, by position of their run ID in the args (None if they store no result)
+CHILD_COMMANDS = {"gsea": 8, "gsea-preranked": 7, "enrichment-plots-export": None}
+
+# Maximum number of child commands running at once, the following ones wait for one of them to end
+# (each analysis already spreads its permutations over all the cores)
+MAX_CHILD_COMMANDS = 2
+
+# Child processes are started fresh (not forked), since the worker runs threads
+child_context = multiprocessing.get_context("spawn")
+child_slots = threading.BoundedSemaphore(MAX_CHILD_COMMANDS)
+# Child processes running, with the connection telling them the worker is alive (see exit_with_worker())
+children = {}
+
+# Lock of the protocol channel, written by the threads forwarding the messages of the child commands too
+send_lock = threading.Lock()
+# Lock of the results kept in memory, a child command ending drops the stale result of its run
+results_lock = threading.Lock()
+
+# Results of the last analyses by run ID (most recently used last), kept in memory to serve
+# the following plot requests. They are stored on disk too, to survive a worker restart
+results = OrderedDict()
+
+# Keep the given result in memory, dropping the least recently used ones
+def remember_result(run_id, res):
+    with results_lock:
+        results[run_id] = res
+        results.move_to_end(run_id)
+        while len(results) > MAX_RESULTS_IN_MEMORY:
+            results.popitem(last=False)
+
+# Drop the result of the given run from memory, so it's read again from the result store
+def forget_result(run_id):
+    with results_lock:
+        results.pop(run_id, None)
+
+# Return the result of the given run, from memory or from the result store
+def get_result(run_id):
+    with results_lock:
+        res = results.get(run_id)
+        if res is not None:
+            results.move_to_end(run_id)
+            return res
+
+    with profiling.stage("load-result"):
+        try:
+            res = load_result(run_id)
+        except (FileNotFoundError, ValueError):
+            print("The results of the requested analysis are not available anymore, run the analysis again.")
+            exit(1)
+    remember_result(run_id, res)
+    return res
+
+# Run the requested command, everything printed by it is captured by the caller
+def handle_command(command, args):
+    match command:
+        case "gsea":
+            res = gsea.run_gsea(args)
+            with profiling.stage("save-result", rows=len(res.res2d)):
+                save_result(res, args[8])
+            remember_result(args[8], res)
+        case "gsea-preranked":
+            res = gsea_preranked.run_gsea_preranked(args)
+            with profiling.stage("save-result", rows=len(res.res2d)):
+                save_result(res, args[7])
+            remember_result(args[7], res)
+        case "plot":
+            # Just the preview is rendered, the other extensions when the plot is exported
+            gsea_plot.run_plot(get_result(args[0]), args[1:], run_id=args[0], extensions=gsea_plot.PREVIEW_EXTENSIONS)
+        case "plot-export":
+            gsea_plot.export_plot(get_result(args[1]), args[2:], args[1], args[0])
+        case "enrichment-plots-export":
+            enrichment_export.run_enrichment_export(args)
+        case "leading-edge":
+            leading_edge.run_leading_edge(get_result(args[0]), args[1:], run_id=args[0])
+        case "gene-set-info":
+            gene_set_info.run_gene_set_info(args)
+        case "gene-sets-info":
+            gene_set_info.run_gene_sets_info(args)
+        case "search-gene-sets":
+            msigdb_search.run_search_gene_sets(args)
+        case "set-profile":
+            profiling.set_destination(args[0] if args else "")
+        case _:
+            print("The requested command doesn't exist")
+            exit(1)
+
+# Write a message on the protocol channel (the original stdout, the scripts output is captured)
+def send_message(message):
+    with send_lock:
+        sys.__stdout__.write(json.dumps(message) + "\n")
+        sys.__stdout__.flush()
+
+# Serve a single request, returning the response to be sent back
+# The events of the request are passed to the given function as messages of the protocol
+def serve_request(request, send=send_message):
+    output = StringIO()
+    errors = StringIO()
+    code = 0
+
+    # Forward the events of the request as soon as they are emitted
+    events.set_sink(lambda event: send({"id": request["id"], "event": event}))
+    # The profiling records of the request are labelled with its command
+    profiling.set_command(request["command"])
+
+    try:
+        with redirect_stdout(output), redirect_stderr(errors), profiling.stage("request"):
+            handle_command(request["command"], request["args"])
+    # Raised by the scripts errorAndExit(), the error message is already in the captured output
+    except SystemExit as e:
+        code = e.code if isinstance(e.code, int) else 1
+    except Exception:
+        code = 1
+        errors.write(traceback.format_exc())
+
+    return {"id": request["id"], "code": code, "stdout": output.getvalue(), "stderr": errors.getvalue()}
+
+# Exit as soon as the worker ends (even if killed), reading the given connection that just the worker writes,
+# terminating the processes started by the command first (e.g. the permutations pool)
+def exit_with_worker(worker_alive):
+    try:
+        worker_alive.recv()
+    except (EOFError, OSError):
+        pass
+    for process in multiprocessing.active_children():
+        process.terminate()
+    os._exit(1)
+
+# Entry point of a child process: serve the given request, sending its events and its response through the
+# given connection, with the given profiling destination (see profiling.py)
+def serve_child_request(request, connection, worker_alive, profile_destination):
+    threading.Thread(target=exit_with_worker, args=(worker_alive,), daemon=True).start()
+    profiling.set_destination(profile_destination or "")
+    connection.send(serve_request(request, connection.send))
+    connection.close()
+
+# Serve the given request in a child process, forwarding its events and its response
+def serve_in_child(request):
+    with child_slots:
+        receiver, sender = child_context.Pipe(duplex=False)
+        worker_alive, worker_alive_sender = child_context.Pipe(duplex=False)
+        child = child_context.Process(target=serve_child_request, args=(request, sender, worker_alive, profiling.destination))
+        child.start()
+        children[child] = worker_alive_sender
+        # Just the child writes its end of the pipe, so a child ending without response is noticed
+        sender.close()
+        worker_alive.close()
+
+        response = None
+        try:
+            while response is None:
+                message = receiver.recv()
+                if "event" in message:
+                    send_message(message)
+                else:
+                    response = message
+        except EOFError:
+            response = {"id": request["id"], "code": 1, "stdout": "",
+                        "stderr": "The backend process of the request stopped unexpectedly."}
+
+        child.join()
+        children.pop(child, None)
+        receiver.close()
+        worker_alive_sender.close()
+
+    # The result of the run was written again by the child, the one in memory (if any) is stale
+    run_id_position = CHILD_COMMANDS[request["command"]]
+    if run_id_position is not None and len(request["args"]) > run_id_position:
+        forget_result(request["args"][run_id_position])
+
+    send_message(response)
+
+if __name__ == "__main__":
+    # Needed by the process pool in the packaged (frozen) executable
+    multiprocessing.freeze_support()
+
+    # The exit() called by the scripts closes sys.stdin, so requests are read from a private handle
+    requests = sys.stdin
+    sys.stdin = open(os.devnull)
+
+    for line in requests:
+        if not line.strip():
+            continue
+
+        request = json.loads(line)
+        if request["command"] in CHILD_COMMANDS:
+            threading.Thread(target=serve_in_child, args=(request,), daemon=True).start()
+        else:
+            send_message(serve_request(request))
+
+    # The main process closed the channel, the commands still running are of no use anymore
+    for worker_alive_sender in list(children.values()):
+        worker_alive_sender.close()
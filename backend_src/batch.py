@@ -0,0 +1,247 @@
+# Headless batch mode: run many GSEA/GSEA preranked analyses described in a manifest.
+#
+# Usage: python batch.py <manifest> <output directory> [processes=<n>]
+#
+# The manifest has one JSON job per line (empty lines and lines starting with # are skipped):
+#   {"name": "treated_vs_control", "type": "gsea", "gmt": "c2.gmt", "expression": "expr.gct", "cls": "labels.cls",
+#    "chip": "platform.chip", "permutations": 1000, "min_size": 15, "max_size": 500, "engine": "native", "adaptive": false, "memmap": false}
+#   {"name": "module_brown", "type": "gsea-preranked", "gmt": "c8.gmt", "rnk": "brown.rnk"}
+# "chip" is optional (remap to gene symbols when given), the other parameters take the defaults shown
+# above and the name defaults to job<line number>. Relative paths are relative to the manifest.
+#
+# Each job writes, inside <output directory>/<name>/:
+#   results.tsv -> the results table
+#   log.txt     -> the analysis script output
+#   job.json    -> the job, the hash of its inputs and its running time, written last
+# A job whose job.json has the same inputs hash (job parameters and content of its files) is skipped, so
+# a stopped batch can be run again to complete just the missing or changed jobs.
+#
+# The jobs are spread over the processes, each one computing its jobs one at a time. With fewer jobs
+# than processes, the jobs are run one at a time, each one using all the processes for its permutations.
+# Each gene sets database is parsed once (see gmt_cache.py) and each process parses each chip once.
+
+# Utility function to exit on error
+def errorAndExit(errorString):
+    print(errorString)
+    exit(1)
+
+try:
+    import sys
+    import os
+    import os.path
+    import re
+    import json
+    import time
+    import shutil
+    import hashlib
+    import multiprocessing
+    from io import StringIO
+    from contextlib import redirect_stdout, redirect_stderr
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    import gsea
+    import gsea_preranked
+    import gmt_cache
+    import scheduler
+    import analysis_events as events
+    from input_readers import file_hash
+    from backend_options import parse_options
+except Exception as e:
+    errorAndExit('Some python libraries weren\'t found.\n' + str(e))
+
+# Default parameters of the jobs
+JOB_DEFAULTS = {
+    "permutations": 1000,
+    "min_size": 15,
+    "max_size": 500,
+    "engine": "native",
+    "adaptive": False,
+    "memmap": False,
+}
+
+# Files of each job type
+JOB_FILES = {
+    "gsea": ["gmt", "expression", "cls", "chip"],
+    "gsea-preranked": ["gmt", "rnk", "chip"],
+}
+
+# Parse the manifest, returning the list of jobs with their defaults and absolute paths
+def read_manifest(manifest_path):
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    jobs = []
+
+    with open(manifest_path, "r") as manifest_file:
+        for line_number, line in enumerate(manifest_file, start=1):
+            if not line.strip() or line.lstrip().startswith("#"):
+                continue
+
+            try:
+                job = dict(JOB_DEFAULTS, **json.loads(line))
+            except (ValueError, TypeError):
+                errorAndExit("Line %d of the manifest isn't a valid JSON job." % line_number)
+
+            job.setdefault("name", "job%d" % line_number)
+            if not re.fullmatch(r"[A-Za-z0-9_.-]+", str(job["name"])):
+                errorAndExit("The job name at line %d must contain just letters, digits, '_', '-' and '.'." % line_number)
+
+            if job.get("type") not in JOB_FILES:
+                errorAndExit("The job type at line %d must be \"gsea\" or \"gsea-preranked\"." % line_number)
+
+            for key in JOB_FILES[job["type"]]:
+                if key in job:
+                    job[key] = os.path.join(base_dir, job[key])
+                elif key != "chip":
+                    errorAndExit("The job at line %d has no \"%s\" file." % (line_number, key))
+
+            jobs.append(job)
+
+    if len({job["name"] for job in jobs}) != len(jobs):
+        errorAndExit("The job names of the manifest must be unique.")
+
+    return jobs
+
+# Hash of the inputs of a job: its parameters and the content of its files
+def job_hash(job):
+    parameters = {k: v for k, v in job.items() if k != "name" and k not in JOB_FILES[job["type"]]}
+    digest = hashlib.sha256(json.dumps(parameters, sort_keys=True).encode())
+    for key in JOB_FILES[job["type"]]:
+        if key in job:
+            digest.update((key + ":" + file_hash(job[key])).encode())
+    return digest.hexdigest()
+
+# Return True if the outputs of the given job are already there for the same inputs
+def is_done(job_dir, inputs_hash):
+    try:
+        with open(os.path.join(job_dir, "job.json"), "r") as job_file:
+            return json.load(job_file)["inputs_hash"] == inputs_hash
+    except (OSError, ValueError, KeyError):
+        return False
+
+# Return the arguments of the analysis script of the given job (same order as the script call ones)
+def job_args(job, threads):
+    remap = "remap" if "chip" in job else "none"
+    options = ["engine=" + job["engine"], "threads=%d" % threads]
+
+    if job["type"] == "gsea":
+        if job["adaptive"]:
+            options.append("adaptive=true")
+        if job["memmap"]:
+            options.append("memmap=true")
+        return [job["gmt"], str(job["permutations"]), str(job["min_size"]), str(job["max_size"]),
+                job["expression"], job["cls"], remap, job.get("chip", "null")] + options
+
+    return [job["gmt"], str(job["permutations"]), str(job["min_size"]), str(job["max_size"]),
+            job["rnk"], remap, job.get("chip", "null")] + options
+
+# Run a single job, writing its outputs in its directory
+# Return (name, exit code, seconds)
+def run_job(job, job_dir, inputs_hash, threads):
+    start_time = time.perf_counter()
+    output = StringIO()
+    code = 0
+
+    # The events of the analyses aren't needed in batch mode
+    events.set_sink(None)
+
+    try:
+        with redirect_stdout(output), redirect_stderr(output):
+            if job["type"] == "gsea":
+                res = gsea.run_gsea(job_args(job, threads))
+            else:
+                res = gsea_preranked.run_gsea_preranked(job_args(job, threads))
+    # Raised by the scripts errorAndExit(), the error message is already in the captured output
+    except SystemExit as e:
+        code = e.code if isinstance(e.code, int) else 1
+    except Exception as e:
+        code = 1
+        output.write(str(e) + "\n")
+
+    seconds = time.perf_counter() - start_time
+
+    # Write everything in a temporary directory first, so that job.json is there just for complete outputs
+    tmp_dir = job_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    with open(os.path.join(tmp_dir, "log.txt"), "w") as log_file:
+        log_file.write(output.getvalue())
+
+    if code == 0:
+        res.res2d.to_csv(os.path.join(tmp_dir, "results.tsv"), sep="\t", index=False)
+        with open(os.path.join(tmp_dir, "job.json"), "w") as job_file:
+            json.dump({"job": job, "inputs_hash": inputs_hash, "seconds": round(seconds, 3)}, job_file, indent=2)
+
+    shutil.rmtree(job_dir, ignore_errors=True)
+    os.replace(tmp_dir, job_dir)
+
+    return job["name"], code, seconds
+
+# Run the jobs of the given manifest, writing their outputs in the given directory
+def run_batch(args):
+    manifest_path = args[0]
+    output_dir = args[1]
+    options = parse_options(args[2:])
+
+    # Try to parse the number of processes
+    try:
+        processes = scheduler.num_processes(int(options.get("processes", "0")))
+    except ValueError:
+        errorAndExit("The number of processes must be an integer.")
+
+    try:
+        jobs = read_manifest(manifest_path)
+    except OSError:
+        errorAndExit("The manifest file cannot be read.")
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    # Skip the jobs already done with the same inputs
+    pending = []
+    for job in jobs:
+        try:
+            inputs_hash = job_hash(job)
+        except OSError:
+            errorAndExit("Some input files of the job " + job["name"] + " cannot be read.")
+
+        job_dir = os.path.join(output_dir, job["name"])
+        if is_done(job_dir, inputs_hash):
+            print("Skipping " + job["name"] + ", already done", file=sys.stderr)
+        else:
+            pending.append((job, job_dir, inputs_hash))
+
+    # Parse each gene sets database once, before the jobs using it are spread over the processes
+    for gmt_path in sorted({job["gmt"] for job, _, _ in pending}):
+        try:
+            gmt_cache.load_gmt(gmt_path)
+        except Exception:
+            pass
+
+    # Report each completed job
+    failed = []
+    done_count = len(jobs) - len(pending)
+    def job_done(name, code, seconds):
+        nonlocal done_count
+        done_count += 1
+        print("[%d/%d] %s %s in %.1f s" % (done_count, len(jobs), name, "done" if code == 0 else "failed", seconds), file=sys.stderr)
+        if code != 0:
+            failed.append(name)
+
+    if len(pending) < processes:
+        for job, job_dir, inputs_hash in pending:
+            job_done(*run_job(job, job_dir, inputs_hash, processes))
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            futures = [pool.submit(run_job, job, job_dir, inputs_hash, 1) for job, job_dir, inputs_hash in pending]
+            for future in as_completed(futures):
+                job_done(*future.result())
+
+    if failed:
+        errorAndExit("Some jobs failed (see their log.txt): " + ", ".join(failed))
+
+if __name__ == "__main__":
+    # Needed by the process pool in the packaged (frozen) executable
+    multiprocessing.freeze_support()
+
+    if len(sys.argv) < 3:
+        errorAndExit("Usage: python batch.py <manifest> <output directory> [processes=<n>]")
+
+    run_batch(sys.argv[1:])
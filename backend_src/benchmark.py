@@ -0,0 +1,476 @@
+# Benchmark of the backend scripts on synthetic inputs of configurable size.
+#
+# Usage: python benchmark.py <output .jsonl> [genes=<n>] [samples=<n>] [sets=<n>] [set_min=<n>] [set_max=<n>]
+#                            [probes_per_gene=<n>] [permutations=<n>] [threads=<n>] [repeat=<n>] [seed=<n>]
+#                            [keep=true|false]
+#
+# The inputs are generated in a temporary directory (see the generators below):
+#   expression.gct  -> genes x samples expression set, the genes of the first gene sets higher in the first class
+#   probes.gct      -> the same expression set by probe, probes_per_gene probes per gene, with probes.chip
+#   labels.cls      -> two classes, half of the samples each
+#   ranked.rnk      -> ranked list of the genes, the genes of the first gene sets at the top
+#   gene_sets.gmt   -> gene sets of sizes between set_min and set_max, named after a few words (for the wordclouds)
+#   msigdb.db       -> MSigDB-like SQLite database of the gene sets, with details, publications and authors
+#
+# Each group of stages runs in a new process, with its home directory (result store and caches) in the
+# temporary directory and the analysis cache disabled, and its inputs prepared before the timing starts:
+#   import-*                 -> import of each backend script, one process each
+#   import-plot-*            -> import of the libraries of each plot type (see gsea_plot.PLOT_MODULES), one process each
+#   parse-*, validate-*      -> parsing of each input file (the .gmt one into its binary cache, see gmt_cache.py)
+#                               and the missing/non-numeric values scans done while parsing
+#   parse-chip, remap        -> parsing of the chip and remap of the probes expression set to gene symbols
+#   gsea, gsea-preranked     -> analyses (permutations included), then serialize-* -> storage of their results
+#   load-*                   -> load of a stored result, reading all its terms
+#   index-*                  -> leading-edge index and word counts of a stored result (see leading_edge.py,
+#                               term_tokens.py), built by their first plot
+#   plot-*                   -> each plot type, drawn as a preview (.png) from the GSEA result
+#   gene-sets-info, msigdb-* -> MSigDB lookups of all the gene sets, search index build and searches
+# The repeat option runs all the groups again, each time in new processes with a new home directory
+# (so with the caches and indexes to build again).
+#
+# Each stage appends a JSON record to the output file, so the results of different versions can be
+# collected in the same file and compared:
+#   {"version": <app version>, "commit": <git commit or null>, "python": ..., "platform": ..., "params": {...},
+#    "repeat": <n>, "stage": <name>, "seconds": <float>, "rows": <items processed or null>,
+#    "peak_rss_mb": <peak resident memory of the process so far, null if not available>, "time": <ISO date>}
+# A summary table (median seconds and maximum peak memory of each stage) is printed on stderr.
+
+# Utility function to exit on error
+def errorAndExit(errorString):
+    print(errorString)
+    exit(1)
+
+try:
+    import sys
+    import os
+    import os.path
+    import json
+    import time
+    import shutil
+    import sqlite3
+    import tempfile
+    import platform
+    import importlib
+    import subprocess
+    import statistics
+    from datetime import datetime, timezone
+    import numpy as np
+    from backend_options import parse_options
+    from profiling import peak_rss_mb
+except Exception as e:
+    errorAndExit('Some python libraries weren\'t found.\n' + str(e))
+
+# Directory of the backend scripts and of the app
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.dirname(BACKEND_DIR)
+
+# Default size of the synthetic inputs and parameters of the benchmark
+BENCHMARK_DEFAULTS = {
+    "genes": 10000,
+    "samples": 40,
+    "sets": 500,
+    "set_min": 15,
+    "set_max": 200,
+    "probes_per_gene": 2,
+    "permutations": 1000,
+    "threads": 0,
+    "repeat": 1,
+    "seed": 1,
+}
+
+# Words the gene set names are made of
+SET_WORDS = ["RESPONSE", "SIGNALING", "PATHWAY", "IMMUNE", "CELL", "CYCLE", "METABOLISM", "DNA", "REPAIR",
+             "STRESS", "APOPTOSIS", "TRANSPORT", "DIFFERENTIATION", "INFLAMMATORY", "HYPOXIA", "MITOTIC"]
+
+# Fraction of the gene sets (the first ones) enriched in the first class and at the top of the ranked list
+ENRICHED_SETS = 0.1
+
+# Run IDs of the stored results of the benchmark analyses
+GSEA_RUN_ID = "benchmark_gsea"
+PRERANKED_RUN_ID = "benchmark_preranked"
+
+# Terms drawn by the plots with many terms, spread over the results table
+PLOT_TERMS = 5
+
+# Backend scripts whose import is timed
+IMPORTED_SCRIPTS = ["gsea", "gsea_preranked", "gsea_plot", "gene_set_info"]
+
+# Plot types whose libraries import is timed
+IMPORTED_PLOTS = ["enrichment-plot", "dotplot", "heatmap", "intersection-over-union", "wordcloud"]
+
+# Groups of stages, each one run in its own process, in order
+STAGE_GROUPS = ["import-" + script for script in IMPORTED_SCRIPTS] + ["import-plot-" + plot for plot in IMPORTED_PLOTS] + [
+    "parse", "remap", "gsea", "gsea-preranked", "load", "index",
+    "plot-enrichment", "plot-enrichment-multi", "plot-dotplot", "plot-heatmap", "plot-leading-edge-heatmap",
+    "plot-iou", "plot-wordcloud", "msigdb"]
+
+# Generators of the synthetic inputs
+
+# Return the names of the given number of genes
+def gene_names(genes):
+    return ["GENE%05d" % i for i in range(genes)]
+
+# Return the gene sets (name -> gene positions), the first ENRICHED_SETS of them sharing their genes
+# with the first ones of the expression set and the ranked list
+def generate_gene_sets(rng, params):
+    genes = params["genes"]
+    num_enriched = max(1, int(params["sets"] * ENRICHED_SETS))
+    enriched_genes = max(params["set_max"], genes // 20)
+
+    gene_sets = {}
+    for i in range(params["sets"]):
+        size = int(rng.integers(params["set_min"], params["set_max"] + 1))
+        pool = enriched_genes if i < num_enriched else genes
+        positions = rng.choice(pool, size=min(size, pool), replace=False)
+        words = rng.choice(SET_WORDS, size=3, replace=False)
+        gene_sets["SYNTHETIC_%s_%d" % ("_".join(words), i)] = np.sort(positions)
+    return gene_sets, enriched_genes
+
+def write_gmt(path, gene_sets, names):
+    with open(path, "w") as gmt_file:
+        for name, positions in gene_sets.items():
+            gmt_file.write("\t".join([name, "Synthetic gene set"] + [names[p] for p in positions]) + "\n")
+
+# Return the expression values (genes x samples), the enriched genes higher in the first half of the samples
+def generate_expression(rng, params, enriched_genes):
+    values = rng.normal(8.0, 1.0, size=(params["genes"], params["samples"]))
+    values[:enriched_genes, :params["samples"] // 2] += 1.0
+    return values
+
+def write_gct(path, names, values):
+    samples = ["S%03d" % i for i in range(values.shape[1])]
+    with open(path, "w") as gct_file:
+        gct_file.write("#1.2\n%d\t%d\n" % values.shape)
+        gct_file.write("\t".join(["NAME", "Description"] + samples) + "\n")
+        for name, row in zip(names, values):
+            gct_file.write(name + "\tna\t" + "\t".join("%.4f" % v for v in row) + "\n")
+
+def write_cls(path, samples):
+    labels = ["A"] * (samples // 2) + ["B"] * (samples - samples // 2)
+    with open(path, "w") as cls_file:
+        cls_file.write("%d 2 1\n# A B\n%s\n" % (samples, " ".join(labels)))
+
+def write_rnk(path, rng, names, enriched_genes):
+    metric = rng.normal(0.0, 1.0, size=len(names))
+    metric[:enriched_genes] += 1.0
+    with open(path, "w") as rnk_file:
+        for name, value in zip(names, metric):
+            rnk_file.write("%s\t%.6f\n" % (name, value))
+
+# Write the probes expression set (each gene's values plus noise for each of its probes) and its chip
+def write_probes(gct_path, chip_path, rng, names, values, probes_per_gene):
+    probe_values = np.repeat(values, probes_per_gene, axis=0) + rng.normal(0.0, 0.2, size=(len(names) * probes_per_gene, values.shape[1]))
+    probe_names = ["PROBE%07d" % i for i in range(len(probe_values))]
+    write_gct(gct_path, probe_names, probe_values)
+
+    with open(chip_path, "w") as chip_file:
+        chip_file.write("Probe Set ID\tGene Symbol\tGene Title\n")
+        for i, probe in enumerate(probe_names):
+            chip_file.write("%s\t%s\tSynthetic gene\n" % (probe, names[i // probes_per_gene]))
+
+# Write an MSigDB-like database with the tables and columns read by gene_set_info.py and msigdb_search.py
+def write_msigdb(path, gene_sets, names):
+    con = sqlite3.connect(path)
+    try:
+        con.executescript("""
+            CREATE TABLE gene_set (id INTEGER PRIMARY KEY, standard_name TEXT);
+            CREATE TABLE gene_set_details (gene_set_id INTEGER, description_brief TEXT, description_full TEXT,
+                systematic_name TEXT, exact_source TEXT, external_details_URL TEXT, source_species_code TEXT,
+                contributor TEXT, contrib_organization TEXT, publication_id INTEGER, GEO_id TEXT);
+            CREATE TABLE publication (id INTEGER PRIMARY KEY, title TEXT, PMID TEXT, DOI TEXT, URL TEXT);
+            CREATE TABLE author (id INTEGER PRIMARY KEY, display_name TEXT);
+            CREATE TABLE publication_author (publication_id INTEGER, author_id INTEGER, author_order INTEGER);
+            CREATE TABLE species (species_code TEXT, species_name TEXT);
+            CREATE TABLE gene_symbol (id INTEGER PRIMARY KEY, symbol TEXT);
+            CREATE TABLE gene_set_gene_symbol (gene_set_id INTEGER, gene_symbol_id INTEGER);
+            INSERT INTO species VALUES ('HS', 'Homo sapiens');
+        """)
+        con.executemany("INSERT INTO gene_symbol VALUES (?, ?)", enumerate(names))
+        con.executemany("INSERT INTO author VALUES (?, ?)", ((i, "Author %d" % i) for i in range(100)))
+        for i, (name, positions) in enumerate(gene_sets.items()):
+            con.execute("INSERT INTO gene_set VALUES (?, ?)", (i, name))
+            con.execute("INSERT INTO gene_set_details VALUES (?, ?, ?, ?, ?, ?, 'HS', 'Benchmark', 'GSEACompass', ?, NULL)",
+                        (i, name.replace("_", " ").lower(), "Synthetic gene set " + name, "M%05d" % i, "synthetic",
+                         "https://example.org/" + name, i))
+            con.execute("INSERT INTO publication VALUES (?, ?, ?, NULL, NULL)", (i, "Publication of " + name, str(10000000 + i)))
+            con.executemany("INSERT INTO publication_author VALUES (?, ?, ?)", ((i, (i + k) % 100, k) for k in range(3)))
+            con.executemany("INSERT INTO gene_set_gene_symbol VALUES (?, ?)", ((i, int(p)) for p in positions))
+        con.commit()
+    finally:
+        con.close()
+
+# Generate all the synthetic inputs in the given directory, returning their paths
+def generate_inputs(data_dir, params):
+    rng = np.random.default_rng(params["seed"])
+    names = gene_names(params["genes"])
+    gene_sets, enriched_genes = generate_gene_sets(rng, params)
+    values = generate_expression(rng, params, enriched_genes)
+
+    paths = {name: os.path.join(data_dir, name) for name in
+             ["expression.gct", "probes.gct", "probes.chip", "labels.cls", "ranked.rnk", "gene_sets.gmt", "msigdb.db"]}
+    write_gmt(paths["gene_sets.gmt"], gene_sets, names)
+    write_gct(paths["expression.gct"], names, values)
+    write_cls(paths["labels.cls"], params["samples"])
+    write_rnk(paths["ranked.rnk"], rng, names, enriched_genes)
+    write_probes(paths["probes.gct"], paths["probes.chip"], rng, names, values, params["probes_per_gene"])
+    write_msigdb(paths["msigdb.db"], gene_sets, names)
+    return paths
+
+# Stages, run in the benchmark processes
+
+# Time the given function called with the given arguments as the given stage, adding its record to the given list
+# The number of items processed is given, or computed from the returned value by the given function
+def timed(records, stage, function, *args, rows=None):
+    start_time = time.perf_counter()
+    value = function(*args)
+    seconds = time.perf_counter() - start_time
+
+    if callable(rows):
+        rows = rows(value)
+    records.append({"stage": stage, "seconds": seconds, "rows": rows, "peak_rss_mb": peak_rss_mb()})
+    return value
+
+# Return the arguments of the plot of the given type (same order as the gsea_plot.py ones) on the given terms
+def plot_args(group, terms, paths, data_dir):
+    size = ["8", "6", "in"]
+    terms_json = json.dumps(terms)
+    match group:
+        case "plot-enrichment":
+            return ["enrichment-plot", json.dumps(terms[:1])] + size
+        case "plot-enrichment-multi":
+            return ["enrichment-plot", terms_json] + size
+        case "plot-dotplot":
+            # The dotplot reads the selected column and terms from a file
+            selection_path = os.path.join(data_dir, "dotplot_selection.json")
+            with open(selection_path, "w") as selection_file:
+                json.dump(["FDR q-val", terms], selection_file)
+            return ["dotplot", selection_path] + size
+        case "plot-heatmap":
+            return ["heatmap", json.dumps({"Term": terms[0]})] + size
+        case "plot-leading-edge-heatmap":
+            return ["leading-edge-heatmap", terms_json] + size
+        case "plot-iou":
+            return ["intersection-over-union", terms_json, paths["gene_sets.gmt"]] + size
+        case "plot-wordcloud":
+            return ["wordcloud", json.dumps(["Term", terms]), "1200", "900", "px"]
+
+# Run the given group of stages on the inputs with the given paths, returning the records of its stages
+def run_stage_group(group, paths, params):
+    import analysis_events as events
+
+    # The events of the analyses aren't needed
+    events.set_sink(None)
+
+    records = []
+    threads = "threads=%d" % params["threads"]
+    set_range = [str(params["set_min"]), str(params["set_max"])]
+
+    if group.startswith("import-plot-"):
+        import gsea_plot
+        timed(records, group, gsea_plot.import_plot_modules, group[len("import-plot-"):])
+
+    elif group.startswith("import-"):
+        timed(records, group, importlib.import_module, group[len("import-"):])
+
+    elif group == "parse":
+        import gmt_cache
+        import gsea_engine
+        from input_readers import read_gct, read_rnk
+
+        expression_set = timed(records, "parse-gct", read_gct, paths["expression.gct"], rows=len)
+        ranked_list = timed(records, "parse-rnk", read_rnk, paths["ranked.rnk"], rows=len)
+        timed(records, "parse-gmt", gmt_cache.load_gmt, paths["gene_sets.gmt"], rows=params["sets"])
+        timed(records, "parse-cls", gsea_engine.read_cls, paths["labels.cls"], rows=lambda cls: len(cls[2]))
+
+        # The same scans of the parsed values done while parsing (see input_readers.py)
+        values = expression_set.iloc[:, 1:].to_numpy()
+        timed(records, "validate-gct", lambda: (expression_set.index.hasnans, np.isnan(values).any()), rows=len(values))
+        timed(records, "validate-rnk", lambda: (ranked_list.index.hasnans, np.isnan(ranked_list[1].to_numpy()).any()), rows=len(ranked_list))
+
+    elif group == "remap":
+        import chip_remap
+        from input_readers import read_gct
+
+        probes = read_gct(paths["probes.gct"])
+        chip_index = timed(records, "parse-chip", chip_remap.read_chip_index, paths["probes.chip"], rows=len(probes))
+        timed(records, "remap", chip_remap.remap, probes.iloc[:, 1:], chip_index, "max", rows=len(probes))
+
+    elif group == "gsea":
+        import gsea
+        from result_store import save_result
+
+        res = timed(records, "gsea", gsea.run_gsea,
+                    [paths["gene_sets.gmt"], str(params["permutations"])] + set_range +
+                    [paths["expression.gct"], paths["labels.cls"], "none", "null", "cache=false", threads],
+                    rows=lambda res: len(res.res2d))
+        timed(records, "serialize-gsea", save_result, res, GSEA_RUN_ID, rows=len(res.res2d))
+
+    elif group == "gsea-preranked":
+        import gsea_preranked
+        from result_store import save_result
+
+        res = timed(records, "gsea-preranked", gsea_preranked.run_gsea_preranked,
+                    [paths["gene_sets.gmt"], str(params["permutations"])] + set_range +
+                    [paths["ranked.rnk"], "none", "null", "cache=false", threads],
+                    rows=lambda res: len(res.res2d))
+        timed(records, "serialize-gsea-preranked", save_result, res, PRERANKED_RUN_ID, rows=len(res.res2d))
+
+    elif group == "load":
+        from result_store import load_result
+
+        # Read every term, the ranking and the heatmat, not just the memory-mapped files
+        def load(run_id):
+            res = load_result(run_id)
+            terms = [res.results[term]["RES"].sum() for term in res.results]
+            np.asarray(res.ranking).sum()
+            if res.heatmat is not None:
+                res.heatmat.to_numpy().sum()
+            return terms
+
+        timed(records, "load-gsea", load, GSEA_RUN_ID, rows=len)
+        timed(records, "load-gsea-preranked", load, PRERANKED_RUN_ID, rows=len)
+
+    elif group == "index":
+        from result_store import load_result
+        from leading_edge import load_leading_edge
+        from term_tokens import load_term_tokens
+
+        res = load_result(GSEA_RUN_ID)
+        timed(records, "index-leading-edge", load_leading_edge, res, rows=len(res.res2d))
+        timed(records, "index-term-tokens", load_term_tokens, res, rows=len(res.res2d))
+
+    elif group.startswith("plot-"):
+        import gsea_plot
+        from result_store import load_result
+
+        res = load_result(GSEA_RUN_ID)
+        # Terms spread over the results table, so that their statistics aren't all the same
+        all_terms = res.res2d["Term"].astype(str).tolist()
+        terms = [all_terms[i] for i in np.unique(np.linspace(0, len(all_terms) - 1, PLOT_TERMS).astype(int))]
+        args = plot_args(group, terms, paths, os.path.dirname(paths["msigdb.db"]))
+        # The libraries of the plot are imported first, their import is timed by the import-plot-* stages
+        gsea_plot.import_plot_modules(args[0])
+        gsea_plot.import_extension_modules(gsea_plot.PREVIEW_EXTENSIONS)
+        # Without a run ID the plot is drawn at each call, not read from the plot cache
+        timed(records, group, gsea_plot.run_plot, res, args, None, gsea_plot.PREVIEW_EXTENSIONS)
+
+    elif group == "msigdb":
+        import gene_set_info
+        import msigdb_search
+
+        con = sqlite3.connect(paths["msigdb.db"])
+        terms = [name for (name,) in con.execute("SELECT standard_name FROM gene_set")]
+        con.close()
+
+        timed(records, "gene-sets-info", gene_set_info.gene_sets_info, paths["msigdb.db"], terms, rows=len(terms))
+        timed(records, "msigdb-search-index", msigdb_search.open_index, paths["msigdb.db"], rows=len(terms))
+        queries = [("SYNTHETIC_" + SET_WORDS[0], "name"), (SET_WORDS[1].lower(), "text"), ("GENE00001", "gene")]
+        timed(records, "msigdb-search", lambda: [msigdb_search.search_gene_sets(paths["msigdb.db"], q, by) for q, by in queries],
+              rows=len(queries))
+
+    return records
+
+# Benchmark driver
+
+# Return the app version and the git commit (None if not in a git repository)
+def app_version():
+    try:
+        with open(os.path.join(APP_DIR, "package.json"), "r") as package_file:
+            version = json.load(package_file).get("version")
+    except (OSError, ValueError):
+        version = None
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=APP_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return version, commit
+
+# Run the given group of stages in a new process, with its home directory in the given one
+# Return the records of its stages
+def run_group_process(group, paths, params, home_dir):
+    env = dict(os.environ, HOME=home_dir, USERPROFILE=home_dir, GSEACOMPASS_ANALYSIS_CACHE_MB="0")
+    stage = subprocess.run([sys.executable, os.path.abspath(__file__), "--stage", group, json.dumps(paths), json.dumps(params)],
+                           cwd=BACKEND_DIR, env=env, capture_output=True, text=True)
+
+    # The records are the last line printed by the process
+    lines = stage.stdout.strip().splitlines()
+    if stage.returncode != 0 or not lines:
+        errorAndExit("The benchmark stage " + group + " failed:\n" + stage.stdout + stage.stderr)
+    return json.loads(lines[-1])
+
+# Print on stderr the median time and the maximum peak memory of each stage of the given records
+def print_summary(records):
+    stages = {}
+    for record in records:
+        stages.setdefault(record["stage"], []).append(record)
+
+    print("%-28s %10s %10s %12s" % ("stage", "seconds", "rows", "peak RSS MB"), file=sys.stderr)
+    for stage, stage_records in stages.items():
+        peaks = [r["peak_rss_mb"] for r in stage_records if r["peak_rss_mb"] is not None]
+        print("%-28s %10.3f %10s %12s" % (stage,
+                                         statistics.median(r["seconds"] for r in stage_records),
+                                         stage_records[0]["rows"] if stage_records[0]["rows"] is not None else "-",
+                                         "%.1f" % max(peaks) if peaks else "-"), file=sys.stderr)
+
+# Run the benchmark with the given arguments (same order as the script call ones)
+def run_benchmark(args):
+    # The output file is taken by position, since its path may contain a "="
+    if len(args) < 1:
+        errorAndExit("The output file of the benchmark is needed.")
+    output_path = args[0]
+    options = parse_options(args[1:])
+    keep = options.get("keep", "false").lower() == "true"
+
+    # Try to parse the size of the inputs and the parameters
+    try:
+        params = {key: int(options.get(key, str(default))) for key, default in BENCHMARK_DEFAULTS.items()}
+    except ValueError:
+        errorAndExit("The sizes of the inputs and the benchmark parameters must be integers.")
+
+    if min(params[key] for key in ["genes", "sets", "set_min", "probes_per_gene", "permutations", "repeat"]) <= 0:
+        errorAndExit("The sizes of the inputs and the benchmark parameters must be positive.")
+    if params["samples"] < 4:
+        errorAndExit("The expression set needs at least 4 samples.")
+    if params["set_min"] > params["set_max"] or params["set_max"] > params["genes"]:
+        errorAndExit("The gene sets sizes must be between set_min and set_max, at most the number of genes.")
+
+    version, commit = app_version()
+    run_info = {"version": version, "commit": commit, "python": platform.python_version(),
+                "platform": platform.platform(), "params": params}
+
+    work_dir = tempfile.mkdtemp(prefix="gseacompass_benchmark_")
+    try:
+        data_dir = os.path.join(work_dir, "data")
+        os.makedirs(data_dir)
+
+        start_time = time.perf_counter()
+        paths = generate_inputs(data_dir, params)
+        print("Inputs generated in %.3f s in %s" % (time.perf_counter() - start_time, data_dir), file=sys.stderr)
+
+        records = []
+        with open(output_path, "a") as output_file:
+            for repeat in range(params["repeat"]):
+                home_dir = os.path.join(work_dir, "home%d" % repeat)
+                os.makedirs(home_dir)
+                for group in STAGE_GROUPS:
+                    for record in run_group_process(group, paths, params, home_dir):
+                        record = dict(run_info, repeat=repeat, time=datetime.now(timezone.utc).isoformat(), **record)
+                        output_file.write(json.dumps(record) + "\n")
+                        output_file.flush()
+                        records.append(record)
+                        print("%s: %.3f s" % (record["stage"], record["seconds"]), file=sys.stderr)
+    finally:
+        if keep:
+            print("Benchmark files kept in " + work_dir, file=sys.stderr)
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    print_summary(records)
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--stage":
+        print(json.dumps(run_stage_group(sys.argv[2], json.loads(sys.argv[3]), json.loads(sys.argv[4]))))
+    else:
+        run_benchmark(sys.argv[1:])
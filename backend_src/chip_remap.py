@@ -0,0 +1,60 @@
+# Remapping of the input identifiers (e.g. probes) to gene symbols through a chip platform file.
+#
+# Each chip file is parsed once per process into a hashed identifier -> gene symbol index. The values
+# are then remapped by looking up the identifiers in the index, without joining the whole chip table,
+# and the identifiers mapped to the same gene symbol are collapsed with one of COLLAPSE_STRATEGIES
+# ("none" keeps them all, as they are, and leaves them to the analysis engine).
+import numpy as np
+import pandas as pd
+
+from input_readers import file_key, read_table, MissingValuesError
+
+# Strategies to collapse the values of the identifiers mapped to the same gene symbol
+COLLAPSE_STRATEGIES = ["none", "max", "mean", "median", "max-abs"]
+
+# Chip indexes by (path, size, modification time)
+chip_indexes = {}
+
+# Identifier -> gene symbol index of a chip file
+class ChipIndex:
+    def __init__(self, identifiers, symbols):
+        # The first of duplicated identifiers wins
+        unique = ~pd.Index(identifiers).duplicated()
+        self.identifiers = pd.Index(identifiers[unique])
+        self.symbols = np.asarray(symbols[unique], dtype=object)
+
+    # Return the gene symbol of each of the given identifiers, None for the missing ones
+    def symbols_of(self, identifiers):
+        positions = self.identifiers.get_indexer(pd.Index(identifiers).astype(str))
+        return np.where(positions >= 0, self.symbols[positions], None)
+
+# Parse a .chip platform file (identifier, gene symbol, title... per line, with a header) into its index,
+# just if it isn't parsed yet
+# Raise MissingValuesError if any identifier or gene symbol is missing
+def read_chip_index(chip_path):
+    key = file_key(chip_path)
+    if key not in chip_indexes:
+        chip = read_table(chip_path, {0: str, 1: str}, usecols=[0, 1], skiprows=1)
+        if chip[0].isnull().any() or chip[1].isnull().any():
+            raise MissingValuesError("The chip platform file has some missing values")
+        chip_indexes[key] = ChipIndex(chip[0].to_numpy(dtype=object), chip[1].to_numpy(dtype=object))
+    return chip_indexes[key]
+
+# Remap the given values (DataFrame or Series indexed by identifier) to gene symbols, dropping the
+# identifiers without a gene symbol and collapsing the duplicated gene symbols with the given strategy
+# For a DataFrame, each column is collapsed on its own (e.g. "max" takes the maximum of each sample)
+def remap(values, chip_index, strategy="none"):
+    symbols = chip_index.symbols_of(values.index)
+    mapped = pd.notnull(symbols)
+    remapped = values[mapped]
+    remapped.index = pd.Index(symbols[mapped], name="Gene Symbol")
+
+    if strategy == "none" or not remapped.index.duplicated().any():
+        return remapped
+
+    groups = remapped.groupby(level=0)
+    if strategy == "max-abs":
+        # The value with the largest absolute value, the positive one on ties
+        maximum, minimum = groups.max(), groups.min()
+        return maximum.where(maximum >= -minimum, minimum)
+    return groups.agg(strategy)
@@ -0,0 +1,170 @@
+# Equivalence check of the native analysis engines (see gsea_engine.py, gsea_preranked_engine.py) against gseapy,
+# on the synthetic inputs of the benchmark (see benchmark.py).
+#
+# Usage: python engine_check.py [genes=<n>] [samples=<n>] [sets=<n>] [set_min=<n>] [set_max=<n>]
+#                               [permutations=<n>] [seed=<n>] [tolerance=<float>] [noise=<float>]
+#
+# The check needs the gseapy version pinned in requirements.txt, since the results of the other versions
+# differ (e.g. their enrichment scores and leading edges). The GSEA and GSEA preranked analyses are run with
+# both engines, with the caches disabled and the home directory (result store and caches) in a temporary
+# directory, and their results are compared:
+#   ranking      -> same genes in the same order, values within tolerance
+#   terms, hits  -> same gene sets, with the same positions of their genes in the ranking
+#   ES           -> enrichment scores within tolerance
+#   Lead_genes   -> same leading edges for GSEA preranked. For GSEA just their fraction is reported, since
+#                   gseapy takes them from a running ES whose maximum isn't the ES (see gsea_engine.py)
+#   statistics   -> mean absolute difference of NES, NOM p-val, FDR q-val and FWER p-val within noise, since
+#                   the permutations of gseapy come from its own random number generator
+# One line per check is printed on stderr, and the script exits with 1 if any check fails.
+
+# Utility function to exit on error
+def errorAndExit(errorString):
+    print(errorString)
+    exit(1)
+
+try:
+    import sys
+    import os
+    import os.path
+    import re
+    import shutil
+    import tempfile
+    import numpy as np
+    from backend_options import parse_options
+    from benchmark import BENCHMARK_DEFAULTS, APP_DIR, generate_inputs
+except Exception as e:
+    errorAndExit('Some python libraries weren\'t found.\n' + str(e))
+
+# Default size of the synthetic inputs and parameters of the check
+CHECK_DEFAULTS = {
+    "genes": 2000,
+    "samples": 20,
+    "sets": 50,
+    "set_min": 15,
+    "set_max": 100,
+    "permutations": 1000,
+    "seed": 1,
+}
+
+# Statistics compared by their mean absolute difference
+NOISY_COLUMNS = ["NES", "NOM p-val", "FDR q-val", "FWER p-val"]
+
+# Return the gseapy version pinned in requirements.txt, None if it isn't pinned
+def pinned_gseapy_version():
+    with open(os.path.join(APP_DIR, "requirements.txt")) as requirements:
+        for line in requirements:
+            match = re.match(r"\s*gseapy\s*==\s*([^\s;#]+)", line)
+            if match:
+                return match.group(1)
+    return None
+
+# Compare the results of the two engines, printing one line per check on stderr
+# Return whether all the checks passed
+def compare_results(analysis, native, reference, tolerance, noise, same_leading_edges):
+    checks = []
+
+    def check(name, passed, detail):
+        checks.append(passed)
+        print("%-16s %-24s %-4s %s" % (analysis, name, "ok" if passed else "FAIL", detail), file=sys.stderr)
+
+    same_genes = native.ranking.index.equals(reference.ranking.index)
+    ranking_diff = np.abs(native.ranking.to_numpy() - reference.ranking.to_numpy()).max() if same_genes else np.inf
+    check("ranking", same_genes and ranking_diff <= tolerance,
+          "max difference %.3g" % ranking_diff if same_genes else "different genes or order")
+
+    terms = list(native.results)
+    same_terms = set(terms) == set(reference.results)
+    check("terms", same_terms, "%d gene sets" % len(terms) if same_terms else "different gene sets")
+    if not same_terms:
+        return False
+
+    same_hits = all(list(native.results[term]["hits"]) == list(reference.results[term]["hits"]) for term in terms)
+    check("hits", same_hits, "" if same_hits else "different positions of the genes of the gene sets")
+
+    es_diff = max(abs(native.results[term]["es"] - reference.results[term]["es"]) for term in terms)
+    check("ES", es_diff <= tolerance, "max difference %.3g" % es_diff)
+
+    same_lead = np.mean([native.results[term]["lead_genes"] == reference.results[term]["lead_genes"] for term in terms])
+    if same_leading_edges:
+        check("Lead_genes", same_lead == 1, "%.0f%% identical" % (100 * same_lead))
+    else:
+        print("%-16s %-24s %-4s %s" % (analysis, "Lead_genes", "-", "%.0f%% identical" % (100 * same_lead)), file=sys.stderr)
+
+    native_table = native.res2d.set_index("Term")
+    reference_table = reference.res2d.set_index("Term").loc[native_table.index]
+    for column in NOISY_COLUMNS:
+        diff = np.abs(native_table[column].astype(float) - reference_table[column].astype(float)).mean()
+        check(column, diff <= noise, "mean difference %.3g" % diff)
+
+    return all(checks)
+
+# Run the check with the given arguments (same order as the script call ones)
+def run_check(args):
+    options = parse_options(args)
+
+    # Try to parse the size of the inputs and the parameters
+    try:
+        params = {key: int(options.get(key, str(default))) for key, default in CHECK_DEFAULTS.items()}
+        tolerance = float(options.get("tolerance", "1e-10"))
+        noise = float(options.get("noise", "0.05"))
+    except ValueError:
+        errorAndExit("The sizes of the inputs and the check parameters must be numbers.")
+
+    if min(params[key] for key in ["genes", "sets", "set_min", "permutations"]) <= 0:
+        errorAndExit("The sizes of the inputs and the check parameters must be positive.")
+    if params["samples"] < 4:
+        errorAndExit("The expression set needs at least 4 samples.")
+    if params["set_min"] > params["set_max"] or params["set_max"] > params["genes"]:
+        errorAndExit("The gene sets sizes must be between set_min and set_max, at most the number of genes.")
+
+    try:
+        import gseapy
+    except Exception:
+        errorAndExit("The check needs gseapy installed.")
+
+    pinned_version = pinned_gseapy_version()
+    if gseapy.__version__ != pinned_version:
+        errorAndExit("The check needs gseapy " + str(pinned_version) + " (pinned in requirements.txt), "
+                     "gseapy " + gseapy.__version__ + " is installed.")
+
+    work_dir = tempfile.mkdtemp(prefix="gseacompass_engine_check_")
+    try:
+        data_dir = os.path.join(work_dir, "data")
+        os.makedirs(data_dir)
+        paths = generate_inputs(data_dir, dict(BENCHMARK_DEFAULTS, **params))
+
+        # The home directory and the caches are set before the analysis scripts are imported
+        home_dir = os.path.join(work_dir, "home")
+        os.makedirs(home_dir)
+        os.environ.update(HOME=home_dir, USERPROFILE=home_dir, GSEACOMPASS_ANALYSIS_CACHE_MB="0",
+                          GSEACOMPASS_NULL_CACHE_MB="0")
+
+        # Imported here, since they read the home directory while they're imported
+        import analysis_events as events
+        import gsea
+        import gsea_preranked
+
+        # The events of the analyses aren't needed
+        events.set_sink(None)
+
+        common_args = [paths["gene_sets.gmt"], str(params["permutations"]), str(params["set_min"]), str(params["set_max"])]
+        analyses = [
+            ("gsea", gsea.run_gsea,
+             common_args + [paths["expression.gct"], paths["labels.cls"], "none", "null"], False),
+            ("gsea-preranked", gsea_preranked.run_gsea_preranked,
+             common_args + [paths["ranked.rnk"], "none", "null"], True),
+        ]
+
+        passed = True
+        for analysis, run, analysis_args, same_leading_edges in analyses:
+            native = run(analysis_args + ["cache=false", "engine=native"])
+            reference = run(analysis_args + ["cache=false", "engine=gseapy"])
+            passed = compare_results(analysis, native, reference, tolerance, noise, same_leading_edges) and passed
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if not passed:
+        errorAndExit("The native engines differ from gseapy " + gseapy.__version__ + ".")
+
+if __name__ == "__main__":
+    run_check(sys.argv[1:])
@@ -0,0 +1,231 @@
+# Bulk export of the enrichment plots of many terms of an analysis run (e.g. all the significant ones).
+#
+# A single figure is drawn once per process, with the term-independent axes (ranked metric and its
+# color map) shared by all the plots, then for each term just its artists are updated: title, running
+# enrichment score line, hits and statistics labels. The terms are spread in chunks over a pool of
+# processes, each one reading the stored result of the run on its own.
+# The plots are written in a .zip archive (one file per term) or in a single paged .pdf file.
+#
+# Usage: python enrichment_export.py <run ID> <output .zip/.pdf> <size x> <size y> <unit>
+#                                    [fdr=<max FDR q-val>] [format=.png|.pdf|.svg] [processes=<n>]
+#                                    [downsample=true|false] [trace_dpi=<n>]
+# The running enrichment scores and the ranked metric are downsampled to the plot resolution (see
+# trace_downsampling.py), unless "downsample=false" (e.g. for publication exports).
+import sys
+import os
+import re
+import time
+import zipfile
+from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# The plots are saved to files, matplotlib is set to its non-interactive backend before it's imported
+os.environ["MPLBACKEND"] = "Agg"
+
+import numpy as np
+
+from result_store import load_result
+from backend_options import parse_options
+from scheduler import num_processes
+from trace_downsampling import TRACE_DPI, trace_buckets, downsample_indices, downsample_fill
+from gsea_plot import convert_to_inches
+import analysis_events as events
+
+# Default maximum FDR q-val of the exported terms
+DEFAULT_MAX_FDR = 0.25
+
+# Extensions of the plots written in the .zip archives
+EXPORT_EXTENSIONS = [".png", ".pdf", ".svg"]
+
+# Number of terms rendered by each task of the process pool
+EXPORT_CHUNK_TERMS = 16
+
+# Utility function to exit on error
+def errorAndExit(errorString):
+    print(errorString)
+    exit(1)
+
+# Return the terms of the given result whose FDR q-val is below the given one, in the results table order
+def select_terms(res, max_fdr=DEFAULT_MAX_FDR):
+    res2d = res.res2d
+    fdr = res2d["FDR q-val"].astype(float).to_numpy()
+    return [term for term, significant in zip(res2d["Term"], fdr < max_fdr) if significant and term in res.results]
+
+# Return the file name of the given term inside the archive, numbered in the export order
+def archive_name(index, term, ext):
+    return "%04d_%s%s" % (index + 1, re.sub(r"[^A-Za-z0-9_.-]", "_", term)[:150], ext)
+
+# Enrichment plot (see gsea_plot.gseaplot_modified) drawn once and redrawn for each term by updating
+# just its term-dependent artists, with the traces downsampled to the given number of buckets (0 for none)
+class EnrichmentPlotTemplate:
+    def __init__(self, res, figsize, buckets=0):
+        # Imported here, since gseapy loads all its plotting libraries
+        from gseapy.plot import GSEAPlot
+
+        self.res = res
+        self.buckets = buckets
+        first_term = next(iter(res.results))
+        first = res.results[first_term]
+
+        self.plot = GSEAPlot(first_term, first["hits"], first["RES"], first["nes"], first["pval"], first["fdr"],
+                             rank_metric=res.ranking, pheno_pos=res.pheno_pos, pheno_neg=res.pheno_neg, figsize=figsize)
+        self.plot.add_axes()
+
+        # Axes added by GSEAPlot.add_axes(): ranked metric, color map, hits and enrichment score
+        self.hits_ax = self.plot.fig.axes[-2]
+        self.stat_ax = self.plot.ax
+        self.hits_lines = self.hits_ax.collections[-1]
+        self.res_line = self.stat_ax.lines[0]
+        self.fdr_label, self.pval_label, self.nes_label = self.stat_ax.texts[:3]
+
+        # The ranked metric is the same for all the terms
+        if buckets > 0:
+            downsample_fill(self.plot.fig.axes[0].collections[0], res.ranking, buckets)
+
+    # Redraw the plot for the given term
+    def update(self, term):
+        result = self.res.results[term]
+
+        self.plot.fig._suptitle.set_text(term)
+        running_es = np.asarray(result["RES"])
+        kept = downsample_indices(running_es, self.buckets)
+        self.res_line.set_data(kept, running_es[kept])
+        self.hits_lines.set_segments([[(hit, 0), (hit, 1)] for hit in result["hits"]])
+        self.nes_label.set_text("NES: " + "{:.3f}".format(float(result["nes"])))
+        self.pval_label.set_text("Pval: " + "{:.3e}".format(float(result["pval"])))
+        self.fdr_label.set_text("FDR: " + "{:.3e}".format(float(result["fdr"])))
+
+        # Rescale the enrichment score axis on the new line, keeping the zero line in view
+        self.stat_ax.relim()
+        self.stat_ax.update_datalim([(0, 0)])
+        self.stat_ax.autoscale_view()
+
+    # Save the plot in the given file or buffer with the given extension
+    def save(self, output, ext):
+        self.plot.fig.savefig(output, format=ext[1:], bbox_inches="tight", dpi=300)
+
+# Plot template of the process, shared by all the chunks it renders
+export_state = {}
+
+def init_export_process(run_id, figsize, buckets):
+    export_state["template"] = EnrichmentPlotTemplate(load_result(run_id), figsize, buckets)
+
+# Render the given chunk of (index, term) pairs with the given extension, returning (archive name, file bytes) pairs
+def render_chunk(chunk, ext):
+    template = export_state["template"]
+    rendered = []
+    for index, term in chunk:
+        template.update(term)
+        output = BytesIO()
+        template.save(output, ext)
+        rendered.append((archive_name(index, term, ext), output.getvalue()))
+    return rendered
+
+# Export the enrichment plots of the given terms of the given run in a .zip archive, with the given extension,
+# using the given number of processes
+def export_archive(run_id, terms, output_path, ext, figsize, buckets, processes):
+    chunks = [list(enumerate(terms))[start:start + EXPORT_CHUNK_TERMS] for start in range(0, len(terms), EXPORT_CHUNK_TERMS)]
+    processes = min(processes, len(chunks))
+
+    # The .png and .pdf files are already compressed
+    compression = zipfile.ZIP_DEFLATED if ext == ".svg" else zipfile.ZIP_STORED
+    tmp_path = output_path + ".tmp%d" % os.getpid()
+
+    with zipfile.ZipFile(tmp_path, "w", compression=compression) as archive:
+        def write_chunk(rendered):
+            for name, data in rendered:
+                archive.writestr(name, data)
+            write_chunk.done += len(rendered)
+            events.progress(write_chunk.done, len(terms))
+        write_chunk.done = 0
+
+        if processes <= 1:
+            init_export_process(run_id, figsize, buckets)
+            for chunk in chunks:
+                write_chunk(render_chunk(chunk, ext))
+            export_state.clear()
+        else:
+            with ProcessPoolExecutor(max_workers=processes, initializer=init_export_process, initargs=(run_id, figsize, buckets)) as pool:
+                futures = [pool.submit(render_chunk, chunk, ext) for chunk in chunks]
+                for future in as_completed(futures):
+                    write_chunk(future.result())
+
+    os.replace(tmp_path, output_path)
+
+# Export the enrichment plots of the given terms of the given run in a single paged .pdf file
+# The pages are written in order to the same file, so they're rendered by this process
+def export_paged_pdf(run_id, terms, output_path, figsize, buckets):
+    from matplotlib.backends.backend_pdf import PdfPages
+
+    tmp_path = output_path + ".tmp%d" % os.getpid()
+    template = EnrichmentPlotTemplate(load_result(run_id), figsize, buckets)
+
+    with PdfPages(tmp_path) as pdf:
+        for i, term in enumerate(terms):
+            template.update(term)
+            template.save(pdf, ".pdf")
+            events.progress(i + 1, len(terms))
+
+    os.replace(tmp_path, output_path)
+
+# Export the enrichment plots requested in the given arguments (same order as the script call ones)
+def run_enrichment_export(args):
+    # The output file is taken by position, since its path may contain a "="
+    positional = args[:5]
+    options = parse_options(args[5:])
+
+    if len(positional) < 5:
+        errorAndExit("The run ID, the output file and the plot size are needed to export the enrichment plots.")
+
+    run_id, output_path = positional[0], positional[1]
+    measurement_unit = positional[4]
+    ext = options.get("format", ".png")
+    downsample = options.get("downsample", "true").lower() != "false"
+
+    # Try to parse the plot size, the maximum FDR q-val, the number of processes and the traces resolution
+    try:
+        size_x = float(positional[2])
+        size_y = float(positional[3])
+        max_fdr = float(options.get("fdr", str(DEFAULT_MAX_FDR)))
+        processes = num_processes(int(options.get("processes", "0")))
+        trace_dpi = int(options.get("trace_dpi", str(TRACE_DPI)))
+    except ValueError:
+        errorAndExit("The plot size, the maximum FDR q-val, the number of processes and the traces resolution must be numbers.")
+
+    figsize = (convert_to_inches(measurement_unit, size_x), convert_to_inches(measurement_unit, size_y))
+    if figsize[0] > 50 or figsize[1] > 50:
+        errorAndExit("Plot sizes cannot exceed 50 inches.")
+    buckets = trace_buckets(figsize[0], trace_dpi) if downsample else 0
+
+    if ext not in EXPORT_EXTENSIONS:
+        errorAndExit("The requested plot extension isn't supported.")
+
+    paged = output_path.lower().endswith(".pdf")
+    if not paged and not output_path.lower().endswith(".zip"):
+        errorAndExit("The enrichment plots can be exported just in a .zip archive or in a .pdf file.")
+
+    try:
+        terms = select_terms(load_result(run_id), max_fdr)
+    except (FileNotFoundError, ValueError):
+        errorAndExit("The results of the requested analysis are not available anymore, run the analysis again.")
+
+    if not terms:
+        errorAndExit("No gene set has a FDR q-val below " + str(max_fdr) + ".")
+
+    start_time = time.perf_counter()
+    try:
+        if paged:
+            export_paged_pdf(run_id, terms, output_path, figsize, buckets)
+        else:
+            export_archive(run_id, terms, output_path, ext, figsize, buckets, processes)
+    except OSError:
+        errorAndExit("The enrichment plots couldn't be written in the selected file.")
+    seconds = time.perf_counter() - start_time
+
+    # Throughput of the export, on stderr, and number of plots exported, on stdout
+    print("Exported %d enrichment plots in %.3f s (%.1f plots/s)" % (len(terms), seconds, len(terms) / max(seconds, 1e-9)), file=sys.stderr)
+    print(len(terms))
+    sys.stdout.flush()
+
+if __name__ == "__main__":
+    run_enrichment_export(sys.argv[1:])
@@ -0,0 +1,108 @@
+# On-disk, memory-mapped copies of the expression sets (.gct), for the out-of-core GSEA.
+#
+# Each expression set is converted once, streaming its genes in chunks, and stored in a directory
+# named after the hash of its content:
+#   manifest.json -> format version, number of genes and samples, samples names
+#   values.bin    -> (genes x samples) float64 values, row-major
+#   genes.npy     -> gene names, in file order
+#   heatmat_*.npy -> heatmaps of the analyses run on the expression set (see gsea_engine.BlockedExpression)
+# The values are memory-mapped, so an analysis reads just the blocks of genes it's working on.
+# The least recently used expression sets are evicted when the cache exceeds its size cap.
+import os
+import os.path
+import json
+import shutil
+
+import numpy as np
+
+from input_readers import file_hash, read_gct_header, read_gct_chunks
+from result_store import evict_results
+from gsea_engine import BlockedExpression
+
+EXPRESSION_CACHE_VERSION = 1
+
+# Directory in which the expression sets are converted, one sub-directory per file hash
+EXPRESSION_CACHE_DIR = os.path.join(os.path.expanduser("~"), "gseacompass_cache", "expression")
+
+# Maximum disk space used by the converted expression sets (MB), it can be set through the environment
+EXPRESSION_CACHE_MB = int(os.environ.get("GSEACOMPASS_EXPRESSION_CACHE_MB", 8192))
+
+# Convert the given .gct file in the given cache directory
+# Raise MissingValuesError or NonNumericValuesError if the gene names or the values aren't all there and numeric
+def build_cache(gct_path, cache_dir):
+    _, header = read_gct_header(gct_path)
+
+    # Write everything in a temporary directory first, so that a reader never sees a partial conversion
+    tmp_dir = cache_dir + ".tmp%d" % os.getpid()
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    genes = []
+    try:
+        with open(os.path.join(tmp_dir, "values.bin"), "wb") as values_file:
+            for names, _, values in read_gct_chunks(gct_path, header):
+                values_file.write(np.ascontiguousarray(values, dtype=np.float64).tobytes())
+                genes.extend(names)
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    np.save(os.path.join(tmp_dir, "genes.npy"), np.asarray(genes, dtype=str))
+
+    manifest = {
+        "version": EXPRESSION_CACHE_VERSION,
+        "num_genes": len(genes),
+        "samples": header[2:],
+    }
+    with open(os.path.join(tmp_dir, "manifest.json"), "w") as manifest_file:
+        json.dump(manifest, manifest_file)
+
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    try:
+        os.replace(tmp_dir, cache_dir)
+    except OSError:
+        # Another process has already converted the same file
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+# Expression set converted on disk
+class ExpressionMatrix:
+    def __init__(self, cache_dir):
+        manifest_path = os.path.join(cache_dir, "manifest.json")
+        with open(manifest_path, "r") as manifest_file:
+            manifest = json.load(manifest_file)
+
+        # The manifest modification time tracks the last access, used by the LRU eviction
+        os.utime(manifest_path)
+
+        if manifest["version"] != EXPRESSION_CACHE_VERSION:
+            raise ValueError("Unsupported expression cache version: " + str(manifest["version"]))
+
+        self.cache_dir = cache_dir
+        self.samples = manifest["samples"]
+        self.shape = (manifest["num_genes"], len(self.samples))
+        self.genes = np.load(os.path.join(cache_dir, "genes.npy"))
+
+    # Return the expression matrix to be read in blocks by the GSEA engine, with the gene of each row
+    # replaced by the given one (e.g. remapped through a chip), None or "" to drop the row
+    def blocked(self, row_genes=None):
+        if row_genes is None:
+            row_genes = self.genes
+        return BlockedExpression(os.path.join(self.cache_dir, "values.bin"), self.shape, row_genes, self.samples)
+
+# Return the expression set of the given .gct file, converting it just if it isn't converted yet
+# Raise MissingValuesError or NonNumericValuesError if the gene names or the values aren't all there and numeric
+def load_expression(gct_path):
+    cache_dir = os.path.join(EXPRESSION_CACHE_DIR, file_hash(gct_path))
+    try:
+        return ExpressionMatrix(cache_dir)
+    except (OSError, ValueError, KeyError):
+        pass
+
+    os.makedirs(EXPRESSION_CACHE_DIR, exist_ok=True)
+    build_cache(gct_path, cache_dir)
+    # A failure of the eviction just leaves the cache above its size cap
+    try:
+        evict_results(EXPRESSION_CACHE_DIR, EXPRESSION_CACHE_MB, keep=(os.path.basename(cache_dir),))
+    except OSError:
+        pass
+    return ExpressionMatrix(cache_dir)
@@ -1,6 +1,9 @@
 import sqlite3
 import sys
 import json
+import os.path
+from urllib.request import pathname2url
+import profiling
 
 # Utility function to exit on error
 def errorAndExit(errorString):
@@ -14,20 +17,28 @@ def row_to_dict(cursor: sqlite3.Cursor, row: sqlite3.Row) -> dict:
         data[col[0]] = row[idx]
     return data
 
-# Read term argument passed as script argument
-term = sys.argv[1]
+# Maximum number of terms looked up by each query (below the SQLite limit of bound parameters)
+TERMS_PER_QUERY = 500
 
-# Read MSigDB file path passed as script argument
-msigdb_path = sys.argv[2]
+# Memory-mapped size of the MSigDB file (bytes)
+MSIGDB_MMAP_SIZE = 1 << 30
 
-# Queries
-genes_query = """ 
-    SELECT symbol 
-        FROM gene_set a 
+# Indexes covering the lookups of the queries, created in the MSigDB file if it's writable
+msigdb_indexes = [
+    "CREATE INDEX IF NOT EXISTS gseacompass_gene_set_name ON gene_set (standard_name, id)",
+    "CREATE INDEX IF NOT EXISTS gseacompass_gene_set_genes ON gene_set_gene_symbol (gene_set_id, gene_symbol_id)",
+    "CREATE INDEX IF NOT EXISTS gseacompass_details_gene_set ON gene_set_details (gene_set_id)",
+    "CREATE INDEX IF NOT EXISTS gseacompass_publication_authors ON publication_author (publication_id, author_order, author_id)",
+]
+
+# Queries, each one taking the list of the terms to look up in place of {terms}
+genes_query = """
+    SELECT a.standard_name, symbol
+        FROM gene_set a
             LEFT JOIN gene_set_gene_symbol ab ON a.id=ab.gene_set_id
             LEFT JOIN gene_symbol b ON b.id=ab.gene_symbol_id
-        WHERE standard_name=? """
-details_query = """ 
+        WHERE standard_name IN ({terms}) """
+details_query = """
     SELECT a.standard_name,
             b.description_brief,
             b.description_full,
@@ -38,51 +49,153 @@ details_query = """
             b.contributor,
             b.contrib_organization AS contributor_organization,
             c.title AS publication_title,
-            c.PMID AS publication_PMID, 
-            c.DOI AS publication_DOI, 
+            c.PMID AS publication_PMID,
+            c.DOI AS publication_DOI,
             c.URL AS publication_URL,
             b.GEO_id
         FROM gene_set a
             LEFT JOIN gene_set_details b ON a.id=b.gene_set_id
             LEFT JOIN publication c ON c.id=b.publication_id
             LEFT JOIN species d ON d.species_code=b.source_species_code
-        WHERE standard_name=? """
+        WHERE standard_name IN ({terms}) """
 authors_query = """
-    SELECT d.display_name AS name
+    SELECT a.standard_name, d.display_name AS name
         FROM gene_set a
             LEFT JOIN gene_set_details b ON a.id=b.gene_set_id
             LEFT JOIN publication_author c ON c.publication_id=b.publication_id
             LEFT JOIN author d ON d.id=c.author_id
-        WHERE standard_name=? 
-        ORDER BY c.author_order ASC """
-
-# Open SQLite database connection
-try:
-    con = sqlite3.connect(msigdb_path)
-except:
-    errorAndExit('The MSigDB file (msigdb.db) couldn\'t be opened.')
-    
-con.row_factory = row_to_dict
-cur = con.cursor()
-
-# Executes all queries
-try:
-    details = cur.execute(details_query, (term, )).fetchone()
-    genes = []
-    for row in cur.execute(genes_query, (term, )):
-        genes.append(row["symbol"])
-    authors = []
-    for row in cur.execute(authors_query, (term, )):
-        authors.append(row["name"])
-        
-    # Format result to print
-    res = details
-    res["genes"] = genes
-    res["authors"] = authors
-    res_json = json.dumps(res)
-except:
-    errorAndExit('The gene set wasn\'t found in the MSigDB or there was an error while retreiving it.')
-
-# Print and flush the result on stdout
-print(res_json)
-sys.stdout.flush()
+        WHERE standard_name IN ({terms})
+        ORDER BY a.standard_name, c.author_order ASC """
+
+# Open read-only connections to the MSigDB files, by path, with the key of the file they were opened on
+# (see msigdb_key()), kept open to serve the following requests
+connections = {}
+
+# Return the key of the given MSigDB file, changing whenever the file is modified or replaced
+# (as input_readers.file_key(), not imported since this script doesn't need numpy and pandas)
+def msigdb_key(msigdb_path):
+    stat = os.stat(msigdb_path)
+    return (os.path.realpath(msigdb_path), stat.st_size, stat.st_mtime_ns)
+
+# Create the indexes covering the queries, if missing and if the MSigDB file can be written
+def create_indexes(msigdb_path):
+    try:
+        con = sqlite3.connect(msigdb_path)
+        try:
+            for index in msigdb_indexes:
+                con.execute(index)
+            con.commit()
+        finally:
+            con.close()
+    except sqlite3.Error:
+        pass
+
+# Return the read-only connection to the given MSigDB file, opening it just the first time and whenever
+# the file is replaced
+def open_msigdb(msigdb_path):
+    msigdb_path = os.path.realpath(msigdb_path)
+    if not os.path.isfile(msigdb_path):
+        raise FileNotFoundError(msigdb_path)
+
+    key, con = connections.get(msigdb_path, (None, None))
+    if key != msigdb_key(msigdb_path):
+        if con is not None:
+            con.close()
+
+        create_indexes(msigdb_path)
+
+        # The connection is opened again if the file changes, so SQLite can skip locking and change detection
+        con = sqlite3.connect("file:%s?mode=ro&immutable=1" % pathname2url(msigdb_path), uri=True, check_same_thread=False)
+        con.execute("PRAGMA mmap_size=%d" % MSIGDB_MMAP_SIZE)
+        # The key is taken once the covering indexes are created, since creating them modifies the file
+        connections[msigdb_path] = (msigdb_key(msigdb_path), con)
+    return connections[msigdb_path][1]
+
+# Run the given query on the given terms, TERMS_PER_QUERY terms at a time, yielding the result rows
+def query_terms(con, query, terms, row_factory=None):
+    cur = con.cursor()
+    cur.row_factory = row_factory
+    for start in range(0, len(terms), TERMS_PER_QUERY):
+        chunk = terms[start:start + TERMS_PER_QUERY]
+        yield from cur.execute(query.format(terms=",".join("?" * len(chunk))), chunk)
+
+# Return the MSigDB information (details, genes and authors) of each of the given terms, by term,
+# None for the terms that aren't in the MSigDB
+def gene_sets_info(msigdb_path, terms):
+    con = open_msigdb(msigdb_path)
+    terms = list(dict.fromkeys(terms))
+
+    info = {term: None for term in terms}
+    for row in query_terms(con, details_query, terms, row_to_dict):
+        if info[row["standard_name"]] is None:
+            row["genes"] = []
+            row["authors"] = []
+            info[row["standard_name"]] = row
+
+    for term, symbol in query_terms(con, genes_query, terms):
+        if symbol is not None:
+            info[term]["genes"].append(symbol)
+    for term, name in query_terms(con, authors_query, terms):
+        if name is not None:
+            info[term]["authors"].append(name)
+
+    return info
+
+# Retrieve the MSigDB information of the term in the given arguments (same order as
+# the script call ones) and print them as a JSON-formatted string
+def run_gene_set_info(args):
+    # Read term argument passed as script argument
+    term = args[0]
+
+    # Read MSigDB file path passed as script argument
+    msigdb_path = args[1]
+
+    # Open SQLite database connection
+    with profiling.stage("open-msigdb"):
+        try:
+            open_msigdb(msigdb_path)
+        except:
+            errorAndExit('The MSigDB file (msigdb.db) couldn\'t be opened.')
+
+    # Executes all queries
+    with profiling.stage("query", rows=1):
+        try:
+            res = gene_sets_info(msigdb_path, [term])[term]
+            res_json = json.dumps(res)
+            if res is None:
+                raise KeyError(term)
+        except:
+            errorAndExit('The gene set wasn\'t found in the MSigDB or there was an error while retreiving it.')
+
+    # Print and flush the result on stdout
+    print(res_json)
+    sys.stdout.flush()
+
+# Retrieve the MSigDB information of many terms at once, given the MSigDB file path followed by the
+# terms, and print them as a JSON-formatted object by term (null for the terms not in the MSigDB)
+def run_gene_sets_info(args):
+    msigdb_path = args[0]
+    terms = args[1:]
+
+    # Open SQLite database connection
+    with profiling.stage("open-msigdb"):
+        try:
+            open_msigdb(msigdb_path)
+        except:
+            errorAndExit('The MSigDB file (msigdb.db) couldn\'t be opened.')
+
+    with profiling.stage("query", rows=len(terms)):
+        try:
+            res_json = json.dumps(gene_sets_info(msigdb_path, terms))
+        except:
+            errorAndExit('There was an error while retreiving the gene sets from the MSigDB.')
+
+    # Print and flush the result on stdout
+    print(res_json)
+    sys.stdout.flush()
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--batch":
+        run_gene_sets_info(sys.argv[2:])
+    else:
+        run_gene_set_info(sys.argv[1:])
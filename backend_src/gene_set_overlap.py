@@ -0,0 +1,54 @@
+# Intersection over union (Jaccard index) of the gene sets selected in the results table.
+#
+# The selected gene sets are a sparse binary (gene sets x genes) matrix M, so all the intersection
+# sizes come from the single sparse product M M^T, while the union sizes are |A| + |B| - |A n B|.
+# Just the lower triangle (main diagonal included), the one drawn by the plot, is computed.
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.cluster.hierarchy import linkage, leaves_list, optimal_leaf_ordering
+
+# Return the sparse binary (gene sets x genes) matrix of the given CSR membership (see gmt_cache.py)
+def membership_matrix(indptr, indices):
+    num_genes = int(indices.max()) + 1 if len(indices) > 0 else 0
+    data = np.ones(len(indices), dtype=np.int32)
+    return sparse.csr_matrix((data, np.asarray(indices), np.asarray(indptr)), shape=(len(indptr) - 1, num_genes))
+
+# Return the (gene sets x gene sets) IoU matrix of the given membership matrix, with just the lower
+# triangle (main diagonal included) filled, NaN above it
+def lower_iou(matrix):
+    sizes = np.asarray(matrix.sum(axis=1)).ravel()
+    intersections = sparse.tril(matrix @ matrix.T).tocoo()
+
+    iou = np.zeros((matrix.shape[0], matrix.shape[0]))
+    unions = sizes[intersections.row] + sizes[intersections.col] - intersections.data
+    iou[intersections.row, intersections.col] = intersections.data / np.maximum(unions, 1)
+    iou[np.triu_indices(matrix.shape[0], k=1)] = np.nan
+    return iou
+
+# Return the order of the gene sets given by the hierarchical clustering (average linkage) of the
+# IoU distances (1 - IoU), with the leaves ordered so that similar gene sets are adjacent
+def clustering_order(iou):
+    if len(iou) < 3:
+        return np.arange(len(iou))
+
+    # Condensed distance matrix, read from the lower triangle (in the row-major upper triangle order)
+    distances = 1 - iou.T[np.triu_indices(len(iou), k=1)]
+    tree = linkage(distances, method="average")
+    return leaves_list(optimal_leaf_ordering(tree, distances))
+
+# Return the IoU DataFrame (lower triangle, NaN above it) of the given gene set names, indexed by
+# the gene set names in the selection order or, if cluster is True, in the clustering order
+# gene_sets: gene sets database loaded by gmt_cache.load_gmt()
+def gene_sets_iou(gene_sets, names, cluster=False):
+    iou = lower_iou(membership_matrix(*gene_sets.select_membership(names)))
+
+    if cluster:
+        order = clustering_order(iou)
+        # Reordering moves cells above the diagonal, so the symmetric matrix is reordered instead
+        full = np.tril(np.nan_to_num(iou)) + np.tril(np.nan_to_num(iou), k=-1).T
+        iou = np.tril(full[np.ix_(order, order)])
+        iou[np.triu_indices(len(iou), k=1)] = np.nan
+        names = [names[i] for i in order]
+
+    return pd.DataFrame(iou, index=names, columns=names)
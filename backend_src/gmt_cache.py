@@ -0,0 +1,179 @@
+# Parsed and indexed cache of the gene sets database (.gmt) files.
+#
+# Each .gmt file is parsed once and stored in binary form, in a directory named after the hash of
+# its content and the cache version:
+#   terms.npy        -> gene set names, in file order
+#   term_order.npy   -> order sorting the gene set names, used to look up a name by binary search
+#   genes.npy        -> interned gene names, each gene appears once in the whole database
+#   indptr.npy       -> CSR index pointers, the genes of gene set i are indices[indptr[i]:indptr[i+1]]
+#   indices.npy      -> CSR gene IDs (positions in genes.npy)
+#   manifest.json    -> cache version and number of gene sets, written last
+# The arrays are memory-mapped on load, so looking up a few gene sets reads just those, without
+# parsing the whole file again.
+# The manifest modification time tracks the last access of each file: the least recently used ones are
+# evicted when the cache exceeds its size cap.
+import os
+import os.path
+import json
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from input_readers import file_hash
+from result_store import evict_results
+
+GMT_CACHE_VERSION = 1
+
+# Directory in which the parsed gene sets databases are cached, one sub-directory per file hash and cache version
+GMT_CACHE_DIR = os.path.join(os.path.expanduser("~"), "gseacompass_cache", "gmt")
+
+# Maximum disk space used by the parsed gene sets databases (MB), it can be set through the environment
+GMT_CACHE_MB = int(os.environ.get("GSEACOMPASS_GMT_CACHE_MB", 1024))
+
+# Return the cache directory of the given .gmt file
+# The file hash is memoized by input_readers.file_hash(), so the long-lived backend worker doesn't hash
+# again the same file at each request
+def gmt_cache_dir(gmt_path):
+    return os.path.join(GMT_CACHE_DIR, "%s_v%d" % (file_hash(gmt_path), GMT_CACHE_VERSION))
+
+# Parse a .gmt file (name, description, genes... per line) into a dict of gene set name -> genes
+# Empty fields and duplicated genes of a gene set are dropped, the last of duplicated gene set names wins
+def parse_gmt(gmt_path):
+    gene_sets = {}
+    with open(gmt_path, "r") as gmt_file:
+        for line in gmt_file:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) > 2:
+                gene_sets[fields[0]] = list(dict.fromkeys(g.strip() for g in fields[2:] if g.strip() != ""))
+    return gene_sets
+
+# Parse the given .gmt file and write its binary form in the given cache directory
+def build_cache(gmt_path, cache_dir):
+    gene_sets = parse_gmt(gmt_path)
+
+    # Intern the gene names, giving each distinct gene an ID
+    gene_ids = {}
+    indptr = np.zeros(len(gene_sets) + 1, dtype=np.int64)
+    indices = []
+    for i, genes in enumerate(gene_sets.values()):
+        indices.extend(gene_ids.setdefault(g, len(gene_ids)) for g in genes)
+        indptr[i + 1] = len(indices)
+
+    terms = np.asarray(list(gene_sets.keys()), dtype=str)
+
+    # Write everything in a temporary directory first, so that a reader never sees a partial cache
+    tmp_dir = cache_dir + ".tmp%d" % os.getpid()
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    np.save(os.path.join(tmp_dir, "terms.npy"), terms)
+    np.save(os.path.join(tmp_dir, "term_order.npy"), np.argsort(terms, kind="stable"))
+    np.save(os.path.join(tmp_dir, "genes.npy"), np.asarray(list(gene_ids.keys()), dtype=str))
+    np.save(os.path.join(tmp_dir, "indptr.npy"), indptr)
+    np.save(os.path.join(tmp_dir, "indices.npy"), np.asarray(indices, dtype=np.int32))
+    with open(os.path.join(tmp_dir, "manifest.json"), "w") as manifest_file:
+        json.dump({"version": GMT_CACHE_VERSION, "gene_sets": len(terms)}, manifest_file)
+
+    # A cache directory without manifest (of an older version) is replaced
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    try:
+        os.replace(tmp_dir, cache_dir)
+    except OSError:
+        # Another process has already built the same cache
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+# Gene sets database read from the cache
+class GeneSets:
+    def __init__(self, cache_dir):
+        self.terms = np.load(os.path.join(cache_dir, "terms.npy"), mmap_mode="r")
+        self.term_order = np.load(os.path.join(cache_dir, "term_order.npy"), mmap_mode="r")
+        self.genes = np.load(os.path.join(cache_dir, "genes.npy"), mmap_mode="r")
+        self.indptr = np.load(os.path.join(cache_dir, "indptr.npy"), mmap_mode="r")
+        self.indices = np.load(os.path.join(cache_dir, "indices.npy"), mmap_mode="r")
+
+    def __len__(self):
+        return len(self.terms)
+
+    # Return the position of each of the given gene set names, -1 for the missing ones
+    def term_positions(self, names):
+        names = np.asarray(names, dtype=str)
+        if len(self.terms) == 0 or len(names) == 0:
+            return np.full(len(names), -1, dtype=np.int64)
+
+        found = np.searchsorted(self.terms, names, sorter=self.term_order)
+        positions = np.asarray(self.term_order)[np.minimum(found, len(self.terms) - 1)]
+        return np.where(self.terms[positions] == names, positions, -1)
+
+    # Return the genes of the gene set at the given position
+    def genes_at(self, position):
+        return self.genes[self.indices[self.indptr[position]:self.indptr[position + 1]]].tolist()
+
+    # Return a dict of gene set name -> genes for the given gene set names, reading just those
+    # Raise KeyError if any of them isn't in the database
+    def select(self, names):
+        positions = self.term_positions(names)
+        missing = [name for name, position in zip(names, positions) if position < 0]
+        if missing:
+            raise KeyError(missing[0])
+        return {name: self.genes_at(position) for name, position in zip(names, positions)}
+
+    # Return the CSR membership (index pointers, interned gene IDs) of the given gene set names, in the
+    # given order, reading just those
+    # Raise KeyError if any of them isn't in the database
+    def select_membership(self, names):
+        positions = self.term_positions(names)
+        missing = [name for name, position in zip(names, positions) if position < 0]
+        if missing:
+            raise KeyError(missing[0])
+
+        members = [self.indices[self.indptr[position]:self.indptr[position + 1]] for position in positions]
+        indptr = np.concatenate([[0], np.cumsum([len(m) for m in members])]).astype(np.int64)
+        indices = np.concatenate(members) if members else np.zeros(0, dtype=np.int32)
+        return indptr, indices
+
+    # Return a dict of gene set name -> genes of the whole database
+    def to_dict(self):
+        return {term: self.genes_at(i) for i, term in enumerate(self.terms.tolist())}
+
+    # Build the sparse (CSR) membership matrix of the gene sets whose size, once restricted to the
+    # given genes, is inside [min_size, max_size] (and smaller than the number of genes)
+    # Return the kept terms, the CSR index pointers and the CSR gene indices (positions in genes,
+    # sorted inside each set)
+    def membership(self, genes, min_size, max_size):
+        # Position in the given genes of each interned gene, -1 if missing (the last one if duplicated)
+        found = pd.Index(self.genes).get_indexer(pd.Index(genes).astype(str))
+        gene_position = np.full(len(self.genes), -1, dtype=np.int64)
+        gene_position[found[found >= 0]] = np.flatnonzero(found >= 0)
+
+        set_sizes = np.diff(self.indptr)
+        rows = np.repeat(np.arange(len(self.terms)), set_sizes)
+        positions = gene_position[self.indices]
+        rows, positions = rows[positions >= 0], positions[positions >= 0]
+
+        # Sort the genes inside each set, sorting a single (set, position) key
+        keys = np.sort(rows * len(genes) + positions)
+        rows, positions = keys // len(genes), keys % len(genes)
+
+        sizes = np.bincount(rows, minlength=len(self.terms))
+        keep = (sizes >= max(min_size, 1)) & (sizes <= max_size) & (sizes < len(genes))
+
+        terms = self.terms[keep].tolist()
+        indptr = np.concatenate([[0], np.cumsum(sizes[keep])]).astype(np.int64)
+        return terms, indptr, positions[keep[rows]].astype(np.int64)
+
+# Return the gene sets of the given .gmt file, parsing it just if it isn't cached yet
+def load_gmt(gmt_path):
+    cache_dir = gmt_cache_dir(gmt_path)
+    try:
+        # The manifest modification time tracks the last access, used by the LRU eviction
+        os.utime(os.path.join(cache_dir, "manifest.json"))
+    except FileNotFoundError:
+        os.makedirs(GMT_CACHE_DIR, exist_ok=True)
+        build_cache(gmt_path, cache_dir)
+        # A failure of the eviction just leaves the cache above its size cap
+        try:
+            evict_results(GMT_CACHE_DIR, GMT_CACHE_MB, keep=(os.path.basename(cache_dir),))
+        except OSError:
+            pass
+    return GeneSets(cache_dir)
@@ -7,107 +7,290 @@ try:
     import sys
     import os.path
     import pandas as pd
-    import matplotlib.pyplot as plt
-    import gseapy as gp
-    from pandas.api.types import is_numeric_dtype
-    import dill
+    import multiprocessing
+    import time
+    import scheduler
+    import analysis_events as events
+    import profiling
+    import gsea_engine
+    import expression_cache
+    import gmt_cache
+    import analysis_cache
+    import chip_remap
+    from input_readers import read_gct, MissingValuesError, NonNumericValuesError
+    from result_store import save_result, new_run_id
+    from backend_options import parse_options, positional_args
 except Exception as e:
     errorAndExit('Some python libraries weren\'t found.\n' + str(e))
 
 # Home directory of user running this script
 HOME_DIR = os.path.expanduser("~")
 
-# Read arguments passed on the script call
-gene_sets_path = sys.argv[1]
-num_permutation = int(sys.argv[2])
-min_gene_set = int(sys.argv[3])
-max_gene_set = int(sys.argv[4])
-expression_set_path = sys.argv[5]
-phenotype_labels_path = sys.argv[6]
-remap = sys.argv[7]
-chip_path = sys.argv[8]
-
-# If files types are not correct, print error and exit
-if (not expression_set_path.endswith((".gct", ".txt"))):
-    errorAndExit("The expression set file (.gct, .txt) is not of the right type.")
-if (not gene_sets_path.endswith(".gmt")):
-    errorAndExit("The gene set file (.gmt) is not of the right type.")
-if (not phenotype_labels_path.endswith(".cls")):
-    errorAndExit("The phenotype labels file (.cls) is not of the right type.")
-
-# Try to parse the expression set file
-try:
-    expression_set = pd.read_csv(expression_set_path, header=2, index_col=0, sep="\t")
-except Exception:
-    errorAndExit("The expression set file is malformed and cannot be intepreted.")
-
-# Check if any value is missing in the expression set file (except for the description column)
-# Each row of the expression set must have the same number of fields
-if (expression_set.drop(expression_set.columns[0], axis=1).isnull().any().any() or expression_set.index.hasnans):
-    errorAndExit("The expression set file has some missing values and cannot be used.")
-
-# Check if any cell of the expression set file (except description column) is not numeric
-if (expression_set.iloc[:,1:].apply(lambda x: not is_numeric_dtype(x)).any()):
-    errorAndExit("The expression set file has some non-numerical values and cannot be used.")
-
-expression_set_chosen = ""
-
-# If the number of permutation is invalid, exit and print error
-if num_permutation <= 0:
-    errorAndExit("The number of permutations must be positive.")
-
-if min_gene_set < 0:
-    errorAndExit("Min gene set size must be positive.")
-if max_gene_set < 0:
-    errorAndExit("Max gene set size must be positive.")
-if min_gene_set > max_gene_set:
-    errorAndExit("Max gene set size must be greater than min gene set size.")
-
-# If remap unselected
-if remap == "none":
-    expression_set_chosen = expression_set
-# If remap selected
-else:
-    # If chip file not selected (left blank), exit and print error
-    if (chip_path == "null"):
-        errorAndExit("If remap selected, a chip must be selected too.")
-        
-    # If chip platform file is not correct, exit and print error
-    if (not chip_path.endswith(".chip")):
-        errorAndExit("The chip platform file (.chip) is not of the right type.")
-
-    # Try to parse chip platform file
+# Engines available to compute the analysis
+ENGINES = ["native", "gseapy"]
+
+# Seed of the permutations, fixed so that the same analysis always gives the same result
+SEED = 7
+
+# Report the provisional results of an adaptive analysis round, as events and on stderr
+def report_estimates(permutations, refining, rows):
+    for row in rows:
+        events.result(row, final=False)
+    print("%d permutations done, %d gene sets still refining" % (permutations, refining), file=sys.stderr)
+
+# Run a GSEA analysis on the given arguments (same order as the script call ones),
+# emit its progress and results as events (see analysis_events.py) and return the result object
+# After the positional arguments, the "key=value" options are accepted:
+#   engine   -> "native" (default, vectorized permutations) or "gseapy"
+#   threads  -> number of processes/threads to use (default 0, i.e. all the available cores)
+#   adaptive -> "true" to refine with more permutations just the gene sets whose significance is uncertain,
+#               the number of permutations becomes the maximum one (native engine only, default "false")
+#   alpha    -> NOM p-value threshold used by the adaptive mode (default 0.05)
+#   cache    -> "false" to compute the analysis even if its result is in the analysis cache (default "true")
+#   collapse -> how the expression values of the identifiers remapped to the same gene symbol are collapsed:
+#               "none" (default, left to the engine), "max", "mean", "median" or "max-abs"
+#   memmap   -> "true" to convert the expression set once to an on-disk matrix and compute the analysis reading
+#               it a block of genes at a time, for expression sets that don't fit in memory (native engine only,
+#               default "false")
+def run_gsea(args):
+    gene_sets_path = args[0]
+    num_permutation = int(args[1])
+    min_gene_set = int(args[2])
+    max_gene_set = int(args[3])
+    expression_set_path = args[4]
+    phenotype_labels_path = args[5]
+    remap = args[6]
+    chip_path = args[7]
+    options = parse_options(args[8:])
+    start_time = time.perf_counter()
+    engine = options.get("engine", "native")
+
+    if engine not in ENGINES:
+        errorAndExit("The requested engine doesn't exist.")
+
+    # Try to parse the number of threads
     try:
-        chip = pd.read_csv(chip_path, header=0, index_col=0, sep="\t")
-    except Exception:
-        errorAndExit("The chip platform file is malformed and cannot be intepreted.")
+        threads = int(options.get("threads", "0"))
+    except ValueError:
+        errorAndExit("The number of threads must be an integer.")
 
-    # Check if any cell (index included) of the chip platform file is missing
-    if (chip.iloc[:, 0].isnull().any() or chip.index.hasnans):
-        errorAndExit("The chip platform file has some missing values and cannot be used.")
-            
-    # Convert the ranked list genes in the chip platform notation
-    expression_set_chosen = expression_set.join(chip).reset_index(drop=True).dropna()
+    adaptive = options.get("adaptive", "false").lower() == "true"
 
-try:
-    res = gp.gsea(data=expression_set_chosen,
-                gene_sets=gene_sets_path,
-                cls=phenotype_labels_path,
-                permutation_type="phenotype",
-                permutation_num=num_permutation,
-                outdir=None,
-                method="signal_to_noise",
-                min_size=min_gene_set,
-                max_size=max_gene_set,
-                threads=4, 
-                seed=7)
-except Exception:
-    errorAndExit("GSEA failed while computing the analysis.")
-
-# Print and send on stdout the result as a JSON-formatted string
-res_json = res.res2d.to_json(orient="records")
-print(res_json)
-sys.stdout.flush()
-
-# Save the python session in a file
-dill.dump_session(os.path.join(HOME_DIR, "gseacompass_python_session.pkl"))
+    # Try to parse the adaptive mode threshold
+    try:
+        alpha = float(options.get("alpha", "0.05"))
+    except ValueError:
+        errorAndExit("The adaptive mode threshold must be a number.")
+
+    if not 0 < alpha < 1:
+        errorAndExit("The adaptive mode threshold must be between 0 and 1.")
+
+    if adaptive and engine != "native":
+        errorAndExit("The adaptive mode is available just with the native engine.")
+
+    use_cache = options.get("cache", "true").lower() != "false"
+    memmap = options.get("memmap", "false").lower() == "true"
+
+    if memmap and engine != "native":
+        errorAndExit("The memory-mapped mode is available just with the native engine.")
+
+    collapse = options.get("collapse", "none").lower()
+
+    if collapse not in chip_remap.COLLAPSE_STRATEGIES:
+        errorAndExit("The requested collapse strategy doesn't exist.")
+
+    if memmap and collapse not in ["none", "mean"]:
+        errorAndExit("The memory-mapped mode collapses the duplicated gene symbols just by their mean.")
+
+    events.phase("reading-inputs")
+
+    # If files types are not correct, print error and exit
+    if (not expression_set_path.endswith((".gct", ".txt", ".gct.gz", ".txt.gz"))):
+        errorAndExit("The expression set file (.gct, .txt) is not of the right type.")
+    if (not gene_sets_path.endswith(".gmt")):
+        errorAndExit("The gene set file (.gmt) is not of the right type.")
+    if (not phenotype_labels_path.endswith(".cls")):
+        errorAndExit("The phenotype labels file (.cls) is not of the right type.")
+
+    # Return the cached result if the same analysis, on the same input files, was already computed
+    cache_key = analysis_cache.analysis_key("gsea",
+                                            {"gmt": gene_sets_path,
+                                             "expression": expression_set_path,
+                                             "cls": phenotype_labels_path,
+                                             "chip": None if remap == "none" else chip_path},
+                                            {"remap": remap,
+                                             "collapse": collapse,
+                                             "permutations": num_permutation,
+                                             "min_size": min_gene_set,
+                                             "max_size": max_gene_set,
+                                             "seed": SEED,
+                                             "engine": engine,
+                                             "adaptive": adaptive,
+                                             "alpha": alpha if adaptive else None})
+    with profiling.stage("read-cache"):
+        cached_res = analysis_cache.load_cached(cache_key) if use_cache else None
+    if cached_res is not None:
+        print("Result read from the analysis cache", file=sys.stderr)
+        events.phase("writing-results")
+        events.results_table(cached_res.res2d)
+        events.summary(cached_res.res2d, time.perf_counter() - start_time)
+        return cached_res
+
+    # Try to parse the gene sets database (parsed just once per file and then cached, see gmt_cache.py)
+    with profiling.stage("parse-gmt") as stage:
+        try:
+            gene_sets = gmt_cache.load_gmt(gene_sets_path)
+        except Exception:
+            errorAndExit("The gene sets database file is malformed and cannot be intepreted.")
+        stage["rows"] = len(gene_sets.terms)
+
+    # Try to parse the expression set file, checking that all its values (except the description column)
+    # are there and numerical while parsing it
+    # In memory-mapped mode, it's converted to an on-disk matrix just the first time (see expression_cache.py)
+    with profiling.stage("parse-gct") as stage:
+        try:
+            if memmap:
+                expression_set = expression_cache.load_expression(expression_set_path)
+            else:
+                expression_set = read_gct(expression_set_path)
+        except MissingValuesError:
+            errorAndExit("The expression set file has some missing values and cannot be used.")
+        except NonNumericValuesError:
+            errorAndExit("The expression set file has some non-numerical values and cannot be used.")
+        except Exception:
+            errorAndExit("The expression set file is malformed and cannot be intepreted.")
+        stage["rows"] = len(expression_set.genes) if memmap else len(expression_set)
+
+    expression_set_chosen = ""
+
+    # If the number of permutation is invalid, exit and print error
+    if num_permutation <= 0:
+        errorAndExit("The number of permutations must be positive.")
+
+    if min_gene_set < 0:
+        errorAndExit("Min gene set size must be positive.")
+    if max_gene_set < 0:
+        errorAndExit("Max gene set size must be positive.")
+    if min_gene_set > max_gene_set:
+        errorAndExit("Max gene set size must be greater than min gene set size.")
+
+    # If remap unselected
+    if remap == "none":
+        expression_set_chosen = expression_set
+    # If remap selected
+    else:
+        # If chip file not selected (left blank), exit and print error
+        if (chip_path == "null"):
+            errorAndExit("If remap selected, a chip must be selected too.")
+
+        # If chip platform file is not correct, exit and print error
+        if (not chip_path.endswith((".chip", ".chip.gz"))):
+            errorAndExit("The chip platform file (.chip) is not of the right type.")
+
+        # Try to parse chip platform file (parsed just once per file and then kept in memory, see chip_remap.py)
+        with profiling.stage("parse-chip"):
+            try:
+                chip_index = chip_remap.read_chip_index(chip_path)
+            except MissingValuesError:
+                errorAndExit("The chip platform file has some missing values and cannot be used.")
+            except Exception:
+                errorAndExit("The chip platform file is malformed and cannot be intepreted.")
+
+        # Convert the expression set genes in the chip platform notation, collapsing the duplicated gene symbols
+        # (the on-disk matrix is remapped while it's read)
+        if not memmap:
+            with profiling.stage("remap", rows=len(expression_set)):
+                expression_set_chosen = chip_remap.remap(expression_set.iloc[:, 1:], chip_index, collapse)
+
+    events.phase("computing")
+
+    # The native engine takes just the numeric sample columns, indexed by gene name
+    if engine == "native":
+        if memmap:
+            # The rows of the on-disk matrix are read through their gene, or their chip gene symbol
+            if remap == "none":
+                expression_matrix = expression_set.blocked()
+            else:
+                expression_matrix = expression_set.blocked(chip_index.symbols_of(expression_set.genes))
+        elif remap == "none":
+            expression_matrix = expression_set.iloc[:, 1:]
+        else:
+            expression_matrix = expression_set_chosen
+
+        with profiling.stage("permutation") as stage:
+            try:
+                res = gsea_engine.gsea(expression_matrix,
+                                       gene_sets,
+                                       phenotype_labels_path,
+                                       num_permutation,
+                                       min_gene_set,
+                                       max_gene_set,
+                                       seed=SEED,
+                                       processes=scheduler.num_processes(threads),
+                                       adaptive=adaptive,
+                                       alpha=alpha,
+                                       on_progress=events.progress,
+                                       on_round=report_estimates)
+            except Exception:
+                errorAndExit("GSEA failed while computing the analysis.")
+            stage["rows"] = len(res.res2d)
+
+        # Report the time spent on each shard of permutations
+        print(scheduler.format_timings(res.shard_timings), file=sys.stderr)
+    else:
+        with profiling.stage("permutation") as stage:
+            try:
+                # Imported here, since gseapy loads its plotting libraries too
+                import gseapy as gp
+
+                # gseapy reads the gene names from the first column (an index is moved there only if its
+                # dtype is object, which isn't the case for the pandas string dtype)
+                if remap == "none":
+                    expression_data = expression_set.iloc[:, 1:].reset_index()
+                else:
+                    expression_data = expression_set_chosen.reset_index()
+
+                res = gp.gsea(data=expression_data,
+                            gene_sets=gene_sets.to_dict(),
+                            cls=phenotype_labels_path,
+                            permutation_type="phenotype",
+                            permutation_num=num_permutation,
+                            outdir=None,
+                            method="signal_to_noise",
+                            min_size=min_gene_set,
+                            max_size=max_gene_set,
+                            threads=scheduler.num_processes(threads),
+                            seed=SEED)
+            except Exception:
+                errorAndExit("GSEA failed while computing the analysis.")
+            stage["rows"] = len(res.res2d)
+
+    # Cache the result, the run result store then shares its files (see result_store.py)
+    with profiling.stage("write-cache", rows=len(res.res2d)):
+        res = analysis_cache.store_cached(res, cache_key)
+
+    # Send the results table, one row per event, and the summary
+    events.phase("writing-results")
+    with profiling.stage("send-results", rows=len(res.res2d)):
+        events.results_table(res.res2d)
+        events.summary(res.res2d, time.perf_counter() - start_time)
+
+    return res
+
+if __name__ == "__main__":
+    # Needed by the process pool in the packaged (frozen) executable
+    multiprocessing.freeze_support()
+
+    res = run_gsea(sys.argv[1:])
+
+    # Save the result in the result store, to be used by the plots
+    # The run ID can be passed after the positional arguments, otherwise a new one is generated
+    # The run ID can be followed by the options
+    extra_args = positional_args(sys.argv[9:])
+    if len(extra_args) > 0:
+        run_id = extra_args[0]
+    else:
+        run_id = new_run_id()
+        print("Result stored with run ID " + run_id, file=sys.stderr)
+    with profiling.stage("save-result", rows=len(res.res2d)):
+        save_result(res, run_id)
@@ -0,0 +1,561 @@
+# Native, vectorized GSEA engine (phenotype permutation, signal to noise ranking metric).
+#
+# The permutations are computed in batches:
+#   - the signal to noise metric of every permutation of a batch is a single matrix product
+#     between the permuted labels matrix and the expression matrix
+#   - the enrichment scores of every gene set and permutation of a batch are computed from the
+#     cumulative sums of the hits weights, using a sparse (CSR) gene set membership matrix, so
+#     that just the positions of the hits are visited instead of the whole ranked list
+# The significance (NES, NOM p-val, FDR q-val, FWER p-val) follows the gseapy/GSEA definitions.
+#
+# The expression matrix can be an on-disk, memory-mapped one (see BlockedExpression and expression_cache.py):
+# the metric is then computed reading a block of genes at a time, so the memory used depends on the
+# block size instead of the dataset size.
+import os
+import os.path
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+import scheduler
+
+# Maximum number of elements of each (permutations x genes) or (permutations x hits) batch matrix
+BATCH_ELEMENTS = 2**22
+
+# Maximum number of elements of each (genes x samples) block read from an on-disk expression matrix
+BLOCK_ELEMENTS = 2**20
+
+# z score of the NOM p-value confidence intervals used by the adaptive mode (99% confidence)
+ADAPTIVE_Z = 2.576
+
+# Parse a .cls phenotype labels file, returning the positive and negative phenotype names
+# and the phenotype of each sample (same rules of gseapy)
+def read_cls(cls_path):
+    with open(cls_path, "r") as cls_file:
+        lines = cls_file.readlines()
+
+    classes = lines[2].strip().split()
+    phenotypes = lines[1].strip("#").strip().split()
+
+    if len(phenotypes) != 2:
+        raise ValueError("Input groups have to be 2!")
+
+    # If the labels are not the phenotype names, the first label is the first phenotype
+    if len(set(phenotypes) & set(classes)) < 2:
+        classes = [phenotypes[0] if c == classes[0] else phenotypes[1] for c in classes]
+
+    return phenotypes[0], phenotypes[1], classes
+
+# Signal to noise metric of each gene, for each labels row
+# expression: (genes x samples) matrix, labels: (permutations x samples) boolean matrix (True if positive)
+# Return a (permutations x genes) matrix
+def signal_to_noise(expression, labels):
+    pos = labels.astype(np.float64)
+    neg = 1.0 - pos
+    n_pos = pos.sum(axis=1, keepdims=True)
+    n_neg = neg.sum(axis=1, keepdims=True)
+
+    # Per class sums and sums of squares of all permutations, as matrix products
+    squares = expression ** 2
+    mean_pos = (pos @ expression.T) / n_pos
+    mean_neg = (neg @ expression.T) / n_neg
+    var_pos = ((pos @ squares.T) - n_pos * mean_pos ** 2) / (n_pos - 1)
+    var_neg = ((neg @ squares.T) - n_neg * mean_neg ** 2) / (n_neg - 1)
+
+    std_pos = np.sqrt(np.maximum(var_pos, 0))
+    std_neg = np.sqrt(np.maximum(var_neg, 0))
+
+    return (mean_pos - mean_neg) / (std_pos + std_neg)
+
+# Expression matrix read in blocks of genes from an on-disk (genes x samples) float64 matrix
+# The rows are filtered and the duplicated genes averaged as prepare_expression() does, but while each block
+# is read: the values of a block are computed from just its rows
+# Pickled by path, so that the processes computing the permutations map the same file
+class BlockedExpression:
+    def __init__(self, path, shape, row_genes, samples):
+        self.path = path
+        self.file_shape = tuple(shape)
+        self.samples = list(samples)
+        self._values = None
+
+        # Group the rows by gene, the rows of gene i being rows[row_ptr[i]:row_ptr[i + 1]]
+        row_genes = pd.Series(row_genes, dtype=object)
+        valid = np.flatnonzero(row_genes.notna().to_numpy() & (row_genes != "").to_numpy())
+        # Averaging the duplicated genes sorts them by name, as the groupby of prepare_expression() does
+        codes, uniques = pd.factorize(row_genes.iloc[valid].to_numpy(), sort=len(valid) > 0 and row_genes.iloc[valid].duplicated().any())
+        order = np.argsort(codes, kind="stable")
+        self.rows = valid[order]
+        self.row_ptr = np.concatenate([[0], np.cumsum(np.bincount(codes, minlength=len(uniques)))]).astype(np.int64)
+        self.all_genes = pd.Index(uniques)
+        self.genes = self.all_genes
+        self.kept = np.arange(len(uniques))
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["_values"] = None
+        return state
+
+    @property
+    def values(self):
+        if self._values is None:
+            self._values = np.memmap(self.path, dtype=np.float64, mode="r", shape=self.file_shape)
+        return self._values
+
+    @property
+    def shape(self):
+        return (len(self.kept), len(self.samples))
+
+    # Ranges (start, stop) of the genes of each block
+    def blocks(self):
+        block_genes = max(1, BLOCK_ELEMENTS // max(1, len(self.samples)))
+        return [(start, min(start + block_genes, len(self.kept))) for start in range(0, len(self.kept), block_genes)]
+
+    # Values of the given genes (positions among the kept ones), averaging the duplicated ones
+    def raw_rows(self, positions):
+        genes = self.kept[positions]
+        counts = self.row_ptr[genes + 1] - self.row_ptr[genes]
+        starts = np.repeat(self.row_ptr[genes] - np.concatenate([[0], np.cumsum(counts)[:-1]]), counts)
+        rows = self.rows[starts + np.arange(counts.sum())]
+        block = np.asarray(self.values[rows], dtype=np.float64)
+        if len(rows) > len(genes):
+            block = np.add.reduceat(block, np.concatenate([[0], np.cumsum(counts)[:-1]]), axis=0) / counts[:, np.newaxis]
+        return block
+
+    # Values of the given genes (positions among the kept ones), shifted as prepare_expression() does
+    def rows_of(self, positions):
+        return self.raw_rows(positions) + 1e-08
+
+    # Values of the genes from start to stop, each gene centered if requested
+    def block(self, start, stop, centered=False):
+        block = self.rows_of(np.arange(start, stop))
+        if centered:
+            block -= block.mean(axis=1, keepdims=True)
+        return block
+
+    # Drop the genes with all zero values and, if each phenotype has at least 3 samples, the genes with zero
+    # variance in both phenotypes, as prepare_expression() does
+    # Return the labels of the samples (True if positive)
+    def prepare(self, classes, pheno_pos):
+        labels = np.asarray(classes) == pheno_pos
+        self.kept = np.arange(len(self.all_genes))
+        keep = np.zeros(len(self.kept), dtype=bool)
+
+        for start, stop in self.blocks():
+            values = self.raw_rows(np.arange(start, stop))
+            keep[start:stop] = np.abs(values).sum(axis=1) > 0
+            if labels.sum() >= 3 and (~labels).sum() >= 3:
+                keep[start:stop] &= (values[:, labels].std(axis=1) + values[:, ~labels].std(axis=1)) > 0
+
+        self.kept = np.flatnonzero(keep)
+        self.genes = self.all_genes[keep]
+        return labels
+
+    # Write the heatmap data (genes in the given order, positive phenotype samples first) next to the matrix
+    # file, block by block, and return it as a memory-mapped DataFrame
+    # The file is named after the heatmap content, so each different heatmap is written once
+    def heatmat(self, order, labels):
+        columns = np.concatenate([np.flatnonzero(labels), np.flatnonzero(~labels)])
+        digest = hashlib.sha256(order.tobytes() + columns.tobytes() + self.kept.tobytes() + self.rows.tobytes())
+        heatmat_path = os.path.join(os.path.dirname(self.path), "heatmat_%s.npy" % digest.hexdigest()[:32])
+
+        if not os.path.exists(heatmat_path):
+            tmp_path = heatmat_path + ".tmp%d.npy" % os.getpid()
+            heatmat = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float64, shape=(len(order), len(columns)))
+            block_genes = max(1, BLOCK_ELEMENTS // max(1, len(columns)))
+            for start in range(0, len(order), block_genes):
+                heatmat[start:start + block_genes] = self.rows_of(order[start:start + block_genes])[:, columns]
+            heatmat.flush()
+            del heatmat
+            os.replace(tmp_path, heatmat_path)
+
+        samples = np.asarray(self.samples, dtype=object)[columns]
+        return pd.DataFrame(np.load(heatmat_path, mmap_mode="r"), index=self.genes[order], columns=samples)
+
+# Signal to noise metric of each gene, for each labels row, of an in-memory (centered) expression matrix or
+# of a BlockedExpression, read a block of genes at a time
+def ranking_metric(expression, labels):
+    if not isinstance(expression, BlockedExpression):
+        return signal_to_noise(expression, labels)
+
+    metric = np.empty((labels.shape[0], expression.shape[0]))
+    for start, stop in expression.blocks():
+        metric[:, start:stop] = signal_to_noise(expression.block(start, stop, centered=True), labels)
+    return metric
+
+# Enrichment scores of each gene set, for each row of the metric matrix
+# metric: (permutations x genes) matrix, indptr/indices: CSR gene sets membership
+# Return a (gene sets x permutations) matrix
+def enrichment_scores(metric, indptr, indices):
+    num_perm, num_genes = metric.shape
+    sizes = np.diff(indptr)
+    set_ids = np.repeat(np.arange(len(sizes)), sizes)
+
+    # Position of each gene in each (descending) ranked list and the sorted weights
+    order = np.argsort(-metric, axis=1, kind="stable")
+    position = np.empty_like(order)
+    np.put_along_axis(position, order, np.arange(num_genes)[np.newaxis, :], axis=1)
+    sorted_weights = np.abs(np.take_along_axis(metric, order, axis=1))
+
+    # Positions of the hits, sorted inside each gene set
+    keys = set_ids * num_genes + position[:, indices]
+    keys.sort(axis=1)
+    hit_position = keys - set_ids * num_genes
+    hit_weight = np.take_along_axis(sorted_weights, hit_position, axis=1)
+
+    # Cumulative weights restarted at the beginning of each gene set
+    cumulative = np.cumsum(hit_weight, axis=1)
+    offsets = np.concatenate([np.zeros((num_perm, 1)), cumulative[:, indptr[1:-1] - 1]], axis=1)
+    cumulative -= offsets[:, set_ids]
+    total = cumulative[:, indptr[1:] - 1]
+
+    # Running enrichment score right after and right before each hit
+    hit_rank = np.arange(len(indices)) - indptr[set_ids]
+    miss = (hit_position - hit_rank) / (num_genes - sizes[set_ids])
+    norm = total[:, set_ids]
+    after_hit = cumulative / norm - miss
+    before_hit = (cumulative - hit_weight) / norm - miss
+
+    # The running enrichment score starts and ends at 0
+    es_max = np.maximum(np.maximum.reduceat(after_hit, indptr[:-1], axis=1), 0)
+    es_min = np.minimum(np.minimum.reduceat(before_hit, indptr[:-1], axis=1), 0)
+
+    return np.where(np.abs(es_max) > np.abs(es_min), es_max, es_min).T
+
+# Full running enrichment score of a gene set, given its hit positions in the ranked list
+def running_enrichment_score(sorted_metric, hits):
+    num_genes = len(sorted_metric)
+    tag = np.zeros(num_genes)
+    tag[hits] = 1
+    hit_weight = tag * np.abs(sorted_metric)
+    return np.cumsum(hit_weight / hit_weight.sum() - (1 - tag) / (num_genes - len(hits)))
+
+# The null enrichment scores are kept as a list of blocks (sets, offset, scores): the scores of the gene sets
+# with the given indices, for the permutations starting at the given offset. In this way each gene set
+# can have its own number of permutations (see the adaptive mode).
+
+# Count, for each gene set, the null enrichment scores of the same sign of its enrichment score and the ones
+# at least as extreme as it
+def pvalue_counts(es, null_blocks):
+    extreme = np.zeros(len(es))
+    same_sign = np.zeros(len(es))
+
+    for sets, _, scores in null_blocks:
+        observed = es[sets, np.newaxis]
+        extreme[sets] += np.where(observed >= 0, scores >= observed, scores < observed).sum(axis=1)
+        same_sign[sets] += np.where(observed >= 0, scores >= 0, scores < 0).sum(axis=1)
+
+    return extreme, same_sign
+
+# NOM p-value of each gene set, compared with the null distribution of the same sign
+# If no null enrichment score has the same sign, the p-value is 1 (as in gseapy)
+def nominal_pvalues(es, null_blocks):
+    extreme, same_sign = pvalue_counts(es, null_blocks)
+    return np.where(same_sign > 0, extreme / np.maximum(same_sign, 1), 1.0)
+
+# Normalized enrichment scores of the observed and null enrichment scores
+def normalize(es, null_blocks):
+    sum_pos = np.zeros(len(es))
+    sum_neg = np.zeros(len(es))
+    count_pos = np.zeros(len(es))
+    count_neg = np.zeros(len(es))
+
+    for sets, _, scores in null_blocks:
+        sum_pos[sets] += np.where(scores >= 0, scores, 0).sum(axis=1)
+        sum_neg[sets] += np.where(scores < 0, scores, 0).sum(axis=1)
+        count_pos[sets] += (scores >= 0).sum(axis=1)
+        count_neg[sets] += (scores < 0).sum(axis=1)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        null_pos = sum_pos / count_pos
+        null_neg = sum_neg / count_neg
+        nes = np.where(es >= 0, es / null_pos, -es / null_neg)
+        # If no null enrichment score has the same sign, the NES is the ES sign (as in gseapy)
+        nes = np.where(np.isfinite(nes), nes, np.sign(es))
+        nes_null_blocks = [(sets, offset, np.where(scores >= 0, scores / null_pos[sets, np.newaxis], -scores / null_neg[sets, np.newaxis]))
+                           for sets, offset, scores in null_blocks]
+
+    return nes, nes_null_blocks
+
+# FDR q-value of each normalized enrichment score
+def fdr_qvalues(nes, nes_null_blocks):
+    null_sorted = np.sort(np.concatenate([scores[np.isfinite(scores)] for _, _, scores in nes_null_blocks]))
+    nes_sorted = np.sort(nes[np.isfinite(nes)])
+
+    null_pos = len(null_sorted) - np.searchsorted(null_sorted, 0, side="left")
+    null_neg = np.searchsorted(null_sorted, 0, side="left")
+    obs_pos = len(nes_sorted) - np.searchsorted(nes_sorted, 0, side="left")
+    obs_neg = np.searchsorted(nes_sorted, 0, side="left")
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        fdr_pos = ((len(null_sorted) - np.searchsorted(null_sorted, nes, side="left")) / null_pos) \
+            / ((len(nes_sorted) - np.searchsorted(nes_sorted, nes, side="left")) / obs_pos)
+        fdr_neg = (np.searchsorted(null_sorted, nes, side="right") / null_neg) \
+            / (np.searchsorted(nes_sorted, nes, side="right") / obs_neg)
+
+    fdr = np.where(nes >= 0, fdr_pos, fdr_neg)
+    return np.where(np.isfinite(fdr), np.minimum(fdr, 1.0), 1.0)
+
+# FWER p-value of each normalized enrichment score: fraction of permutations whose most extreme
+# null NES (of the same sign) among all gene sets is at least as extreme as the observed one
+# Just the permutations computed for all the gene sets are considered
+def fwer_pvalues(nes, nes_null_blocks):
+    num_perm = max(offset + scores.shape[1] for _, offset, scores in nes_null_blocks)
+    max_pos = np.full(num_perm, -np.inf)
+    min_neg = np.full(num_perm, np.inf)
+    coverage = np.zeros(num_perm)
+
+    for sets, offset, scores in nes_null_blocks:
+        columns = slice(offset, offset + scores.shape[1])
+        max_pos[columns] = np.maximum(max_pos[columns], np.where(scores >= 0, scores, -np.inf).max(axis=0))
+        min_neg[columns] = np.minimum(min_neg[columns], np.where(scores < 0, scores, np.inf).min(axis=0))
+        coverage[columns] += len(sets)
+
+    complete = coverage == len(nes)
+    pos = (max_pos[np.newaxis, complete] >= nes[:, np.newaxis]).mean(axis=1)
+    neg = (min_neg[np.newaxis, complete] <= nes[:, np.newaxis]).mean(axis=1)
+    return np.where(nes >= 0, pos, neg)
+
+# Compute NOM p-values, NES, FDR q-values and FWER p-values from the null enrichment scores blocks
+def significance(es, null_blocks):
+    pvals = nominal_pvalues(es, null_blocks)
+    nes, nes_null_blocks = normalize(es, null_blocks)
+    return pvals, nes, fdr_qvalues(nes, nes_null_blocks), fwer_pvalues(nes, nes_null_blocks)
+
+# Wilson score interval of the NOM p-values, given the counts returned by pvalue_counts()
+def pvalue_intervals(extreme, same_sign, z=ADAPTIVE_Z):
+    n = np.maximum(same_sign, 1)
+    p = extreme / n
+    denominator = 1 + z ** 2 / n
+    center = (p + z ** 2 / (2 * n)) / denominator
+    half_width = z * np.sqrt(p * (1 - p) / n + z ** 2 / (4 * n ** 2)) / denominator
+    return center - half_width, center + half_width
+
+# Rounds of the adaptive mode, as (first shard, last shard) ranges: the number of shards doubles at each round
+def adaptive_rounds(num_shards):
+    rounds = []
+    first = 0
+    while first < num_shards:
+        last = min(num_shards, max(1, 2 * first))
+        rounds.append((first, last))
+        first = last
+    return rounds
+
+# Restrict the CSR gene sets membership to the given (sorted) gene sets
+def subset_membership(indptr, indices, sets):
+    sizes = np.diff(indptr)
+    keep = np.isin(np.repeat(np.arange(len(sizes)), sizes), sets)
+    return np.concatenate([[0], np.cumsum(sizes[sets])]), indices[keep]
+
+# Generate the permuted labels (permutations x samples boolean matrix) with the given random generator
+def permuted_labels(labels, num_permutation, rng):
+    return np.array([rng.permutation(labels) for _ in range(num_permutation)], dtype=bool).reshape(num_permutation, len(labels))
+
+# Compute the null enrichment scores (gene sets x permutations) of the given permuted labels
+def null_enrichment_scores(expression, labels_matrix, indptr, indices):
+    num_perm = labels_matrix.shape[0]
+    batch_size = max(1, BATCH_ELEMENTS // max(expression.shape[0], len(indices)))
+    es_null = np.empty((len(indptr) - 1, num_perm))
+
+    for start in range(0, num_perm, batch_size):
+        batch = labels_matrix[start:start + batch_size]
+        es_null[:, start:start + len(batch)] = enrichment_scores(ranking_metric(expression, batch), indptr, indices)
+
+    return es_null
+
+# Compute the null enrichment scores of a shard of permutations (see scheduler.py)
+def shard_null_enrichment_scores(expression, labels, indptr, indices, num_permutation, rng):
+    return null_enrichment_scores(expression, permuted_labels(labels, num_permutation, rng), indptr, indices)
+
+# Result of the native engine, exposing the same attributes of the gseapy result objects
+# used by the rest of the backend (res2d, results, ranking, heatmat, pheno_pos, pheno_neg)
+class EngineResult:
+    def __init__(self, res2d, results, ranking, heatmat, pheno_pos, pheno_neg):
+        self.shard_timings = []
+        self.res2d = res2d
+        self.results = results
+        self.ranking = ranking
+        self.heatmat = heatmat
+        self.pheno_pos = pheno_pos
+        self.pheno_neg = pheno_neg
+
+# Columns of the results table (same of gseapy)
+RESULT_COLUMNS = ["Name", "Term", "ES", "NES", "NOM p-val", "FDR q-val", "FWER p-val", "Tag %", "Gene %", "Lead_genes"]
+
+# Compute the per term results that don't depend on the permutations: hits, running enrichment
+# score and leading edge (same fields and format of gseapy)
+def term_details(name, terms, indptr, indices, es, ranking):
+    num_genes = len(ranking)
+    sorted_metric = ranking.to_numpy()
+    genes = ranking.index
+    details = {}
+
+    for i, term in enumerate(terms):
+        hits = np.sort(indices[indptr[i]:indptr[i + 1]])
+        running_es = running_enrichment_score(sorted_metric, hits)
+
+        # Extract the leading edge genes
+        if es[i] >= 0:
+            es_i = int(running_es.argmax())
+            leading_edge = hits[hits <= es_i]
+            gene_frac = (es_i + 1) / num_genes
+        else:
+            es_i = int(running_es.argmin())
+            leading_edge = hits[hits >= es_i][::-1]
+            gene_frac = (num_genes - es_i) / num_genes
+
+        details[term] = {
+            "name": name,
+            "es": float(es[i]),
+            "tag %": "%s/%s" % (len(leading_edge), len(hits)),
+            "gene %": "{0:.2%}".format(gene_frac),
+            "lead_genes": ";".join(map(str, genes[leading_edge])),
+            "matched_genes": ";".join(map(str, genes[hits])),
+            "hits": hits.tolist(),
+            "RES": running_es.tolist(),
+        }
+
+    return details
+
+# Row of the results table of the given term
+def result_row(details, term, nes, pval, fdr, fwer):
+    detail = details[term]
+    values = [detail["name"], term, detail["es"], float(nes), float(pval), float(fdr), fwer if fwer is None else float(fwer),
+              detail["tag %"], detail["gene %"], detail["lead_genes"]]
+    return dict(zip(RESULT_COLUMNS, values))
+
+# Build the per term results and the results table (same fields and format of gseapy)
+def build_result(terms, details, nes, pvals, fdrs, fwers, ranking, heatmat, pheno_pos, pheno_neg):
+    results = {}
+    rows = []
+
+    for i, term in enumerate(terms):
+        detail = details[term]
+        results[term] = {
+            "name": detail["name"],
+            "es": detail["es"],
+            "nes": float(nes[i]),
+            "pval": float(pvals[i]),
+            "fdr": float(fdrs[i]),
+            "fwerp": float(fwers[i]),
+            "tag %": detail["tag %"],
+            "gene %": detail["gene %"],
+            "lead_genes": detail["lead_genes"],
+            "matched_genes": detail["matched_genes"],
+            "hits": detail["hits"],
+            "RES": detail["RES"],
+        }
+        rows.append(result_row(details, term, nes[i], pvals[i], fdrs[i], fwers[i]))
+
+    res2d = pd.DataFrame(rows, columns=RESULT_COLUMNS)
+    # Order by absolute NES, as gseapy does
+    res2d = res2d.reindex(res2d["NES"].abs().sort_values(ascending=False).index).reset_index(drop=True)
+
+    return EngineResult(res2d, results, ranking, heatmat, pheno_pos, pheno_neg)
+
+# Filter the expression data as gseapy does: average duplicated genes, drop genes with all zero
+# values and, if each phenotype has at least 3 samples, genes with zero variance in both phenotypes
+def prepare_expression(expression, classes, pheno_pos):
+    expression = expression.astype(np.float64)
+    if expression.index.duplicated().any():
+        expression = expression.groupby(level=0).mean()
+
+    labels = np.asarray(classes) == pheno_pos
+    values = expression.to_numpy()
+    keep = np.abs(values).sum(axis=1) > 0
+    if labels.sum() >= 3 and (~labels).sum() >= 3:
+        keep &= (values[:, labels].std(axis=1) + values[:, ~labels].std(axis=1)) > 0
+
+    return expression[keep] + 1e-08, labels
+
+# Run a phenotype permutation GSEA with the signal to noise ranking metric
+# expression: DataFrame (genes x samples) indexed by gene name, with just the numeric sample columns, or a
+# BlockedExpression (out-of-core mode)
+# gene_sets: gene sets database loaded by gmt_cache.load_gmt()
+# The permutations are computed in shards spread over the given number of processes
+# In adaptive mode, the permutations are computed in rounds of growing size and a gene set stops being
+# refined as soon as its NOM p-value confidence interval is entirely above or below alpha, so
+# num_permutation is the maximum number of permutations of each gene set
+# If given, on_progress(permutations done, permutations requested) is called after each shard of permutations
+# and, after each adaptive round, on_round(permutations done, gene sets still refining, rows) is called with
+# the provisional results table rows of the gene sets that stopped being refined in the round
+def gsea(expression, gene_sets, cls_path, num_permutation, min_size, max_size, seed, processes=1,
+         adaptive=False, alpha=0.05, on_progress=None, on_round=None):
+    pheno_pos, pheno_neg, classes = read_cls(cls_path)
+    if len(classes) != expression.shape[1]:
+        raise ValueError("The number of samples in the expression set and in the phenotype labels differ.")
+
+    if isinstance(expression, BlockedExpression):
+        labels = expression.prepare(classes, pheno_pos)
+        genes = expression.genes
+        centered = expression
+    else:
+        expression, labels = prepare_expression(expression, classes, pheno_pos)
+        genes = expression.index
+        values = expression.to_numpy()
+        # Centering each gene doesn't change the metric but improves the sums of squares precision
+        centered = values - values.mean(axis=1, keepdims=True)
+
+    terms, indptr, indices = gene_sets.membership(genes, min_size, max_size)
+    if len(terms) == 0:
+        raise LookupError("No gene sets passed through filtering condition.")
+
+    # Observed ranking
+    metric = ranking_metric(centered, labels[np.newaxis, :])[0]
+    order = np.argsort(-metric, kind="stable")
+    ranking = pd.Series(metric[order], index=genes[order])
+    position = np.empty_like(order)
+    position[order] = np.arange(len(order))
+
+    es = enrichment_scores(metric[np.newaxis, :], indptr, indices)[:, 0]
+    details = term_details("gsea", terms, indptr, position[indices], es, ranking)
+
+    shards = scheduler.make_shards(num_permutation)
+    rounds = adaptive_rounds(len(shards)) if adaptive else [(0, len(shards))]
+    active = np.arange(len(terms))
+    null_blocks = []
+    shard_timings = []
+
+    # Count the permutations done, for the progress report
+    permutations_done = 0
+    def shard_done(timing):
+        nonlocal permutations_done
+        permutations_done += timing["permutations"]
+        if on_progress is not None:
+            on_progress(permutations_done, num_permutation)
+
+    for first, last in rounds:
+        sub_indptr, sub_indices = subset_membership(indptr, indices, active)
+        values, timings = scheduler.run_sharded(shard_null_enrichment_scores, (centered, labels, sub_indptr, sub_indices),
+                                                shards[first:last], seed, processes, shard_done)
+        offset = sum(n for _, n in shards[:first])
+        block = np.concatenate(values, axis=1)
+        null_blocks.append((active, offset, block))
+        shard_timings += timings
+
+        if adaptive:
+            # Keep refining just the gene sets whose p-value interval contains alpha
+            lower, upper = pvalue_intervals(*pvalue_counts(es, null_blocks))
+            refining = (lower[active] <= alpha) & (upper[active] >= alpha)
+            stopped = active[~refining]
+            active = active[refining]
+
+            if on_round is not None:
+                pvals, nes, fdrs, _ = significance(es, null_blocks)
+                rows = [result_row(details, terms[i], nes[i], pvals[i], fdrs[i], None) for i in stopped]
+                on_round(offset + block.shape[1], len(active), rows)
+
+            if len(active) == 0:
+                break
+
+    pvals, nes, fdrs, fwers = significance(es, null_blocks)
+
+    # Heatmap data: genes in ranked order, positive phenotype samples first
+    if isinstance(expression, BlockedExpression):
+        heatmat = expression.heatmat(order, labels)
+    else:
+        heatmat = pd.concat([expression.iloc[order, labels], expression.iloc[order, ~labels]], axis=1)
+
+    res = build_result(terms, details, nes, pvals, fdrs, fwers, ranking, heatmat, pheno_pos, pheno_neg)
+    res.shard_timings = shard_timings
+    return res
@@ -1,20 +1,63 @@
+# The plotting libraries are imported just by the plot types needing them (see import_plot_modules()),
+# so that a plot loads just its own libraries. The plots are always saved to files, so matplotlib is set
+# up front to its non-interactive backend, before any of them imports it.
+from __future__ import annotations
 import sys
+import os
 import os.path
+
+os.environ["MPLBACKEND"] = "Agg"
+
+import json
+import shutil
+import hashlib
 import warnings
+import importlib
 import pandas as pd
-import matplotlib.pyplot as plt
-from gseapy.plot import GSEAPlot, Heatmap ,TracePlot, DotPlot
 from io import StringIO
-import dill
+from result_store import load_result, evict_results
+from input_readers import file_hash
+from gmt_cache import load_gmt
+from backend_options import parse_options
+import profiling
+from trace_downsampling import TRACE_DPI, trace_buckets, downsample_lines, downsample_fill
 import numpy as np
-import seaborn as sns
-from wordcloud import WordCloud
-from typing import Sequence, Optional, List, Tuple, Dict, Union, Any
-import fontTools
-import fontTools.ttLib.ttFont
-import fontTools.ttLib.tables.otTables
-import fontTools.otlLib.maxContextCalc
-import fontTools.subset.util
+from typing import Sequence, Optional, List, Tuple, Dict, Union, Any, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import matplotlib.pyplot as plt
+
+# Libraries needed by each plot type, imported when a plot of that type is requested (each plot type
+# imports the names it uses where it uses them)
+PLOT_MODULES = {
+    "enrichment-plot": ["gseapy.plot"],
+    "dotplot": ["gseapy.plot"],
+    "heatmap": ["gseapy.plot", "leading_edge"],
+    "leading-edge-heatmap": ["gseapy.plot", "leading_edge"],
+    "intersection-over-union": ["matplotlib.pyplot", "seaborn", "gene_set_overlap"],
+    "wordcloud": ["wordcloud", "term_tokens"],
+}
+
+# Import the libraries needed by the given plot type, just the first time it's requested by this process
+def import_plot_modules(plot_type):
+    for module in PLOT_MODULES.get(plot_type, []):
+        importlib.import_module(module)
+
+# Import the libraries needed to save the plots with the given extensions: matplotlib embeds the fonts
+# of the .pdf and .svg files through fontTools
+def import_extension_modules(extensions):
+    if ".pdf" in extensions or ".svg" in extensions:
+        import fontTools
+        import fontTools.ttLib.ttFont
+        import fontTools.ttLib.tables.otTables
+        import fontTools.otlLib.maxContextCalc
+        import fontTools.subset.util
+
+# Close the figures drawn by this process, if matplotlib was loaded by any plot
+def close_figures():
+    pyplot = sys.modules.get("matplotlib.pyplot")
+    if pyplot is not None:
+        pyplot.close("all")
 
 # Utility function to convert inches, cm and px
 def convert_to_inches(measurement_unit, value):
@@ -56,8 +99,12 @@ def gseaplot_modified(
     # Added parameter, to choose the output file extensions
     # Each element of the list must be an extension (.png, .pdf, etc.)
     ofext: Optional[List[str]] = None,
+    # Added parameter, number of buckets (pixel columns) the traces are downsampled to, 0 to draw them in full
+    trace_buckets: int = 0,
     **kwargs,
 ) -> Optional[List[plt.Axes]]:
+    from gseapy.plot import GSEAPlot
+
     g = GSEAPlot(
         term, 
         hits, 
@@ -74,13 +121,24 @@ def gseaplot_modified(
         # The file name is concatened to the first extension for compatibility reasons
         ofname + ofext[0])
     g.add_axes()
+
+    # Downsample the running enrichment score and the ranked metric (see trace_downsampling.py)
+    if trace_buckets > 0:
+        downsample_lines(g.ax, trace_buckets)
+        if rank_metric is not None:
+            downsample_fill(g.fig.axes[0].collections[0], rank_metric, trace_buckets)
+
     if ofname is None:
         return g.fig.axes
     
-    # Export the output file as an image of each given extension
-    for ext in ofext:
+    # Export the output file as an image of the given extension
+    def save(ext):
         g.ofname = ofname + ext
         g.savefig(bbox_inches="tight")
+
+    for ext in ofext:
+        save(ext)
+    return save
         
 # Modified version of gseapy.gseaplot2
 def gseaplot2_modified(
@@ -96,8 +154,12 @@ def gseaplot2_modified(
     # Added parameter, to choose the output file extensions
     # Each element of the list must be an extension (.png, .pdf, etc.)
     ofext: Optional[List[str]] = None,
+    # Added parameter, number of buckets (pixel columns) the traces are downsampled to, 0 to draw them in full
+    trace_buckets: int = 0,
     **kwargs,
 ) -> Optional[List[plt.Axes]]:
+    from gseapy.plot import TracePlot
+
     # in case you just input one pathway
     if isinstance(terms, str):
         terms = [terms]
@@ -122,13 +184,25 @@ def gseaplot2_modified(
         **kwargs,
     )
     trace.add_axes()
+
+    # Downsample the running enrichment scores and the ranked metric (see trace_downsampling.py)
+    # The axes are the hits of each term, the enrichment scores and the ranked metric
+    if trace_buckets > 0:
+        downsample_lines(trace.fig.axes[len(terms)], trace_buckets)
+        if rank_metric is not None:
+            downsample_fill(trace.fig.axes[len(terms) + 1].collections[0], rank_metric, trace_buckets)
+
     if ofname is None:
         return trace.fig.axes
     
-    # Export the output file as an image of each given extension
-    for ext in ofext:
+    # Export the output file as an image of the given extension
+    def save(ext):
         trace.savefig(ofname=ofname+ext, bbox_inches="tight")
 
+    for ext in ofext:
+        save(ext)
+    return save
+
 # Modified version of gseapy.dotplot
 def dotplot_modified(
     df: pd.DataFrame,
@@ -159,6 +233,8 @@ def dotplot_modified(
         warnings.warn("group is deprecated; use x instead", DeprecationWarning, 2)
         return
 
+    from gseapy.plot import DotPlot
+
     dot = DotPlot(
         df=df,
         x=x,
@@ -192,10 +268,14 @@ def dotplot_modified(
     if ofname is None:
         return ax
     
-    # Export the output file as an image of each given extension
-    for ext in ofext:
+    # Export the output file as an image of the given extension
+    def save(ext):
         dot.fig.savefig(ofname + ext, bbox_inches="tight", dpi=300)
 
+    for ext in ofext:
+        save(ext)
+    return save
+
 # Modified version of gseapy.heatmap
 def heatmap_modified(
     df: pd.DataFrame,
@@ -211,11 +291,15 @@ def heatmap_modified(
     # Each element of the list must be an extension (.png, .pdf, etc.)
     ofext: Optional[List[str]] = None,
     ax: Optional[plt.Axes] = None,
+    # Added parameter, True if df is already z-scored (see leading_edge.py), so it's drawn as it is
+    zscored: bool = False,
     **kwargs,
 ):
+    from gseapy.plot import Heatmap
+
     ht = Heatmap(
         df=df,
-        z_score=z_score,
+        z_score=None if zscored else z_score,
         title=title,
         figsize=figsize,
         cmap=cmap,
@@ -226,235 +310,424 @@ def heatmap_modified(
         ax=ax,
         **kwargs,
     )
+    if zscored:
+        ht.cbar_title = "Z-Score"
     ax = ht.draw()
     if ofname is None:
         return ax
     
-    # Export the output file as an image of each given extension
-    for ext in ofext:
+    # Export the output file as an image of the given extension
+    def save(ext):
         ht.fig.savefig(ofname + ext, bbox_inches="tight", dpi=300)
 
+    for ext in ofext:
+        save(ext)
+    return save
+
 # Home directory of user running this script
 HOME_DIR = os.path.expanduser("~")
 
-# Load the saved python session, with all its variables
-dill.load_session(os.path.join(HOME_DIR, "gseacompass_python_session.pkl"))
-
 # Default plot file name and extensions
 PLOT_FILE = os.path.join(HOME_DIR, "gsea_plot")
 plot_extensions = [".png", ".pdf", ".svg"]
 
-# Read plot type argument passed by the script call
-plot_type = sys.argv[1]
+# Extension of the plot preview, the only one rendered when a plot is requested by the app
+# The other ones are rendered when the plot is exported (see export_plot())
+PREVIEW_EXTENSIONS = [".png"]
+
+# Directory in which the rendered plots are cached, one sub-directory per plot (run, type, arguments)
+PLOT_CACHE_DIR = os.path.join(HOME_DIR, "gseacompass_cache", "plots")
+
+# Maximum disk space used by the rendered plots (MB), it can be set through the environment
+PLOT_CACHE_MB = int(os.environ.get("GSEACOMPASS_PLOT_CACHE_MB", 512))
+
+# Last plot drawn by this process, kept to save it in other extensions without drawing it again if the
+# same plot is requested again (e.g. exported):
+#   dir  -> its cache directory
+#   save -> function saving the drawn plot in its cache directory with a given extension
+last_plot = {}
+
+# Return the cache directory of the plot requested by the given arguments for the given run
+# The arguments that are files (e.g. selected data passed by the app) count by their content
+def plot_cache_dir(run_id, args):
+    digest = hashlib.sha256(run_id.encode())
+    for arg in args:
+        if os.path.isfile(arg):
+            digest.update(("file:" + file_hash(arg)).encode())
+        else:
+            digest.update(("arg:" + arg).encode())
+        digest.update(b"\0")
+    return os.path.join(PLOT_CACHE_DIR, digest.hexdigest())
+
+# Copy the given extension of the cached plot as the plot file read by the app
+def publish_plot(cache_dir, ext):
+    shutil.copyfile(os.path.join(cache_dir, "plot" + ext), PLOT_FILE + ext)
+
+# Generate the plot drawn by the given function in the given cache directory with the given extensions,
+# reusing the ones already rendered with the same arguments
+# The function is given the file name (without extension) and the extensions to save, and returns the
+# function saving the drawn plot with a given extension
+def show_plot(cache_dir, draw, extensions):
+    missing = [ext for ext in extensions if not os.path.exists(os.path.join(cache_dir, "plot" + ext))]
+    if missing:
+        new_dir = not os.path.isdir(cache_dir)
+        os.makedirs(cache_dir, exist_ok=True)
+        try:
+            with profiling.stage("render", rows=len(missing)):
+                if last_plot.get("dir") == cache_dir:
+                    for ext in missing:
+                        last_plot["save"](ext)
+                else:
+                    close_figures()
+                    last_plot.clear()
+                    last_plot.update({"dir": cache_dir, "save": draw(os.path.join(cache_dir, "plot"), missing)})
+        # A directory without manifest is never evicted, so the one created for a plot failing is removed
+        except BaseException:
+            if new_dir:
+                shutil.rmtree(cache_dir, ignore_errors=True)
+            raise
+
+    with profiling.stage("publish", rows=len(extensions)):
+        # The manifest modification time tracks the last access, used by the LRU eviction
+        with open(os.path.join(cache_dir, "manifest.json"), "w") as manifest_file:
+            json.dump({"extensions": sorted(os.path.splitext(f)[1] for f in os.listdir(cache_dir) if f.startswith("plot."))}, manifest_file)
+
+        for ext in extensions:
+            publish_plot(cache_dir, ext)
+        # Data exported together with the plot (e.g. IoU values)
+        if os.path.exists(os.path.join(cache_dir, "plot.csv")):
+            publish_plot(cache_dir, ".csv")
+
+        evict_results(PLOT_CACHE_DIR, PLOT_CACHE_MB, keep=(os.path.basename(cache_dir),))
+
+# Export with the given extension (one of plot_extensions) the plot requested by the given arguments (same
+# of run_plot()) for the given run, rendering it from its cache directory if it isn't there yet
+def export_plot(res, args, run_id, ext):
+    if ext not in plot_extensions:
+        print("The requested plot extension isn't supported.")
+        exit(1)
+
+    run_plot(res, args, run_id=run_id, extensions=[ext])
 
-match plot_type:
+# Generate the plot requested in the given arguments (same order as the script call ones)
+# from the given GSEA/GSEA preranked result object
+# The plot is saved with the given extensions (default all plot_extensions), if the run ID is given the
+# rendered plots are cached, so that the same plot (e.g. after a resize back) is generated just once
+def run_plot(res, args, run_id=None, extensions=None):
+    # Read plot type argument passed by the script call
+    plot_type = args[0]
 
-    case "enrichment-plot":
-        selected_terms_raw = sys.argv[2]
-        size_x = float(sys.argv[3])
-        size_y = float(sys.argv[4])
-        measurement_unit = sys.argv[5]
+    if extensions is None:
+        extensions = plot_extensions
+
+    # Libraries of the requested plot type and extensions, loaded by the first plot needing them
+    with profiling.stage("import"):
+        import_plot_modules(plot_type)
+        import_extension_modules(extensions)
+
+    match plot_type:
+
+        case "enrichment-plot":
+            selected_terms_raw = args[1]
+            size_x = float(args[2])
+            size_y = float(args[3])
+            measurement_unit = args[4]
+            # Traces downsampled to the plot resolution (default), "downsample=false" draws them in full
+            # (e.g. for publication exports), "trace_dpi=<n>" sets the resolution
+            options = parse_options(args[5:])
+            downsample = options.get("downsample", "true").lower() != "false"
         
-        converted_size_x = convert_to_inches(measurement_unit, size_x)
-        converted_size_y = convert_to_inches(measurement_unit, size_y)
+            converted_size_x = convert_to_inches(measurement_unit, size_x)
+            converted_size_y = convert_to_inches(measurement_unit, size_y)
         
-        if (converted_size_x > 50 or converted_size_y > 50):
-            print("Plot sizes cannot exceed 50 inches.")
-            exit(1)
+            if (converted_size_x > 50 or converted_size_y > 50):
+                print("Plot sizes cannot exceed 50 inches.")
+                exit(1)
+
+            try:
+                buckets = trace_buckets(converted_size_x, int(options.get("trace_dpi", str(TRACE_DPI)))) if downsample else 0
+            except ValueError:
+                print("The traces resolution must be an integer.")
+                exit(1)
+
+            # Convert the JSON-formatted input in a Series
+            selected_terms = pd.read_json(StringIO(selected_terms_raw))[0]
 
-        # Convert the JSON-formatted input in a Series
-        selected_terms = pd.read_json(StringIO(selected_terms_raw))[0]
-
-        # If just one term is passed
-        if len(selected_terms) == 1:
-            gseaplot_modified(
-                rank_metric=res.ranking, 
-                term=selected_terms[0],
-                figsize=(converted_size_x,converted_size_y),
-                ofname=PLOT_FILE,
-                ofext=plot_extensions,
-                **res.results[selected_terms[0]])
+            # If just one term is passed
+            if len(selected_terms) == 1:
+                def draw(ofname, ofext):
+                    return gseaplot_modified(
+                        rank_metric=res.ranking, 
+                        term=selected_terms[0],
+                        figsize=(converted_size_x,converted_size_y),
+                        ofname=ofname,
+                        ofext=ofext,
+                        trace_buckets=buckets,
+                        **res.results[selected_terms[0]])
         
-        # If two or more terms are passed
-        else:
-            hits = [res.results[t]["hits"] for t in selected_terms]
-            runes = [res.results[t]["RES"] for t in selected_terms]
-
-            gseaplot2_modified(
-                terms=selected_terms, 
-                RESs=runes, 
-                hits=hits,
-                rank_metric=res.ranking,
-                legend_kws={"loc": (0, 1.1)}, 
-                figsize=(converted_size_x,converted_size_y),
-                ofname=PLOT_FILE,
-                ofext=plot_extensions)
+            # If two or more terms are passed
+            else:
+                def draw(ofname, ofext):
+                    hits = [res.results[t]["hits"] for t in selected_terms]
+                    runes = [res.results[t]["RES"] for t in selected_terms]
+
+                    return gseaplot2_modified(
+                        terms=selected_terms, 
+                        RESs=runes, 
+                        hits=hits,
+                        rank_metric=res.ranking,
+                        legend_kws={"loc": (0, 1.1)}, 
+                        figsize=(converted_size_x,converted_size_y),
+                        ofname=ofname,
+                        ofext=ofext,
+                        trace_buckets=buckets)
     
-    case "dotplot":
-        selected_column_and_terms_file_path = sys.argv[2]
-        size_x = float(sys.argv[3])
-        size_y = float(sys.argv[4])
-        measurement_unit = sys.argv[5]
+        case "dotplot":
+            selected_column_and_terms_file_path = args[1]
+            size_x = float(args[2])
+            size_y = float(args[3])
+            measurement_unit = args[4]
         
-        converted_size_x = convert_to_inches(measurement_unit, size_x)
-        converted_size_y = convert_to_inches(measurement_unit, size_y)
+            converted_size_x = convert_to_inches(measurement_unit, size_x)
+            converted_size_y = convert_to_inches(measurement_unit, size_y)
         
-        if (converted_size_x > 50 or converted_size_y > 50):
-            print("Plot sizes cannot exceed 50 inches.")
-            exit(1)
+            if (converted_size_x > 50 or converted_size_y > 50):
+                print("Plot sizes cannot exceed 50 inches.")
+                exit(1)
         
-        # Parse file content as JSON
-        selected_column_and_terms = pd.read_json(selected_column_and_terms_file_path)
+            # Parse file content as JSON
+            selected_column_and_terms = pd.read_json(selected_column_and_terms_file_path)
         
-        # Extract selected column name (first field)
-        selected_column = selected_column_and_terms.iloc[0, 0]
+            # Extract selected column name (first field)
+            selected_column = selected_column_and_terms.iloc[0, 0]
         
-        # Extract selected terms (second field, list) and convert it to a series
-        selected_terms = pd.Series(selected_column_and_terms.iloc[1, 0]).rename('Term')
+            # Extract selected terms (second field, list) and convert it to a series
+            selected_terms = pd.Series(selected_column_and_terms.iloc[1, 0]).rename('Term')
         
-        # Join the GSEA/GSEA preranked result with the selected terms
-        # i.e filter out from res.res2d all those rows not having a term contained in selected_terms
-        filtered_res = res.res2d.merge(selected_terms, how="inner", on="Term")
+            # Join the GSEA/GSEA preranked result with the selected terms
+            # i.e filter out from res.res2d all those rows not having a term contained in selected_terms
+            filtered_res = res.res2d.merge(selected_terms, how="inner", on="Term")
             
-        dotplot_modified(
-            filtered_res,
-            title="",
-            column=selected_column,
-            cmap=plt.cm.viridis,
-            size=6,
-            figsize=(converted_size_x,converted_size_y), 
-            cutoff=0.25, 
-            show_ring=False,
-            ofname=PLOT_FILE,
-            ofext=plot_extensions)
+            def draw(ofname, ofext):
+                return dotplot_modified(
+                    filtered_res,
+                    title="",
+                    column=selected_column,
+                    cmap="viridis",
+                    size=6,
+                    figsize=(converted_size_x,converted_size_y), 
+                    cutoff=0.25, 
+                    show_ring=False,
+                    ofname=ofname,
+                    ofext=ofext)
         
-    case "heatmap":
-        selected_row_raw = sys.argv[2]
-        size_x = float(sys.argv[3])
-        size_y = float(sys.argv[4])
-        measurement_unit = sys.argv[5]
+        case "heatmap":
+            from leading_edge import load_leading_edge
+
+            selected_row_raw = args[1]
+            size_x = float(args[2])
+            size_y = float(args[3])
+            measurement_unit = args[4]
         
-        converted_size_x = convert_to_inches(measurement_unit, size_x)
-        converted_size_y = convert_to_inches(measurement_unit, size_y)
+            converted_size_x = convert_to_inches(measurement_unit, size_x)
+            converted_size_y = convert_to_inches(measurement_unit, size_y)
         
-        if (converted_size_x > 50 or converted_size_y > 50):
-            print("Plot sizes cannot exceed 50 inches.")
-            exit(1)
+            if (converted_size_x > 50 or converted_size_y > 50):
+                print("Plot sizes cannot exceed 50 inches.")
+                exit(1)
 
-        # Convert the JSON-formatted input in a Series
-        selected_row = pd.read_json(StringIO(selected_row_raw), typ="series")
+            # Convert the JSON-formatted input in a Series
+            selected_row = pd.read_json(StringIO(selected_row_raw), typ="series")
         
-        selected_term = selected_row.Term
-        selected_genes = selected_row.Lead_genes.split(";")
+            selected_term = selected_row.Term
+
+            # Z-scored heatmat rows of the leading-edge genes, read from the leading-edge index of the run
+            try:
+                selected_heatmat = load_leading_edge(res, run_id).heatmap([selected_term])
+            except KeyError:
+                print("The gene set " + selected_term + " isn't in the analysis results.")
+                exit(1)
+            except ValueError:
+                print("The heatmap is available just for the GSEA analyses.")
+                exit(1)
         
-        heatmap_modified(
-            df=res.heatmat.loc[selected_genes],
-            z_score=0, 
-            title=selected_term,
-            figsize=(converted_size_x,converted_size_y),
-            ofname=PLOT_FILE,
-            ofext=plot_extensions)
+            def draw(ofname, ofext):
+                return heatmap_modified(
+                    df=selected_heatmat,
+                    zscored=True,
+                    title=selected_term,
+                    figsize=(converted_size_x,converted_size_y),
+                    ofname=ofname,
+                    ofext=ofext)
         
-    case "intersection-over-union":
-        selected_terms_raw = sys.argv[2]
-        gene_sets_path = sys.argv[3]
-        size_x = float(sys.argv[4])
-        size_y = float(sys.argv[5])
-        measurement_unit = sys.argv[6]
+        case "leading-edge-heatmap":
+            from leading_edge import load_leading_edge
+
+            selected_terms_raw = args[1]
+            size_x = float(args[2])
+            size_y = float(args[3])
+            measurement_unit = args[4]
         
-        converted_size_x = convert_to_inches(measurement_unit, size_x)
-        converted_size_y = convert_to_inches(measurement_unit, size_y)
+            converted_size_x = convert_to_inches(measurement_unit, size_x)
+            converted_size_y = convert_to_inches(measurement_unit, size_y)
         
-        if (converted_size_x > 50 or converted_size_y > 50):
-            print("Plot sizes cannot exceed 50 inches.")
-            exit(1)
+            if (converted_size_x > 50 or converted_size_y > 50):
+                print("Plot sizes cannot exceed 50 inches.")
+                exit(1)
+
+            # Convert the JSON-formatted selected terms in a list
+            selected_terms = pd.read_json(StringIO(selected_terms_raw))[0].tolist()
+
+            # Z-scored heatmat rows of the union of the leading edges of the selected gene sets
+            try:
+                selected_heatmat = load_leading_edge(res, run_id).heatmap(selected_terms)
+            except KeyError as e:
+                print("The gene set " + str(e.args[0]) + " isn't in the analysis results.")
+                exit(1)
+            except ValueError:
+                print("The heatmap is available just for the GSEA analyses.")
+                exit(1)
+
+            def draw(ofname, ofext):
+                return heatmap_modified(
+                    df=selected_heatmat,
+                    zscored=True,
+                    title=selected_terms[0] if len(selected_terms) == 1 else "Leading edge of " + str(len(selected_terms)) + " gene sets",
+                    figsize=(converted_size_x,converted_size_y),
+                    ofname=ofname,
+                    ofext=ofext)
         
-        # Convert the JSON-formatted selected terms in a Series
-        selected_terms = pd.read_json(StringIO(selected_terms_raw))[0]
+        case "intersection-over-union":
+            import matplotlib.pyplot as plt
+            import seaborn as sns
+            from gene_set_overlap import gene_sets_iou
+
+            selected_terms_raw = args[1]
+            gene_sets_path = args[2]
+            size_x = float(args[3])
+            size_y = float(args[4])
+            measurement_unit = args[5]
+            # Gene sets order: "selection" (default) or "clustered"
+            order = parse_options(args[6:]).get("order", "selection")
         
-        # Get the numbers of columns in each line of the gene sets database
-        # Needed since the gene sets data database has a different number of fields for each row
-        col_count = []
-        with open(gene_sets_path, "r") as gene_sets_file:
-            col_count = [ len(line.split("\t")) for line in gene_sets_file.readlines() ]
+            converted_size_x = convert_to_inches(measurement_unit, size_x)
+            converted_size_y = convert_to_inches(measurement_unit, size_y)
         
-        # Read the gene sets database CSV file       
-        gene_sets_database = pd.read_csv(gene_sets_path, sep="\t", names=range(max(col_count)), header=None, index_col=0, engine="python")
+            if (converted_size_x > 50 or converted_size_y > 50):
+                print("Plot sizes cannot exceed 50 inches.")
+                exit(1)
         
-        genesets = {}
-        labels = {}
-        i = 0
+            # Convert the JSON-formatted selected terms in a Series
+            selected_terms = pd.read_json(StringIO(selected_terms_raw))[0]
+
+            # IoU of the selected gene sets, read from the parsed gene sets database (see gmt_cache.py),
+            # in the selection order or in the hierarchical clustering one
+            try:
+                iou_values = gene_sets_iou(load_gmt(gene_sets_path), selected_terms.tolist(), cluster=(order == "clustered"))
+            except KeyError as e:
+                print("The gene set " + e.args[0] + " isn't in the selected gene sets database.")
+                exit(1)
         
-        for term in selected_terms:
-            # Create a short label for each geneset
-            label = 'G' + str(i)
-            labels[label] = term
-            
-            genesets[label] = set(gene_sets_database.loc[term, 2:].dropna())
+            def draw(ofname, ofext):
+                # The labels are replaced in a copy, the values may be drawn again in another extension
+                iou_matrix = iou_values.copy()
+
+                # Export the IoU values, indexed by the full gene set names
+                iou_matrix.to_csv(ofname + ".csv")
+
+                # Create a short label for each geneset, numbered in the selection order
+                labels = {'G' + str(i): term for i, term in enumerate(selected_terms)}
+                term_labels = {term: label for label, term in labels.items()}
+                iou_matrix.index = [term_labels[term] for term in iou_matrix.index]
+                iou_matrix.columns = iou_matrix.index
+
+                # Mask for the upper triangle, main diagonal excluded (not computed)
+                mask = np.isnan(iou_matrix.to_numpy())
             
-            i = i+1
-
-        # Calculate the IOU for each pair of gene sets
-        iou_matrix = pd.DataFrame(index=genesets.keys(), columns=genesets.keys())
-        for i in genesets:
-            for j in genesets:
-                intersection = genesets[i].intersection(genesets[j])
-                union = genesets[i].union(genesets[j])
-                iou = len(intersection) / len(union)
-                iou_matrix.loc[i, j] = iou
-
-        # Convert the matrix to float
-        iou_matrix = iou_matrix.astype(float)
-
-        # Mask for the upper triangle, main diagonal included
-        mask = np.triu(np.ones_like(iou_matrix, dtype=bool), k=1)
-        
-        # Generate the heatmap
-        fig, ax = plt.subplots(figsize=(converted_size_x, converted_size_y))
-        ax.set_aspect('equal')
-        sns.heatmap(iou_matrix, mask=mask, annot=False, cmap='YlGnBu', ax=ax, linewidths=0.5, linecolor='lightgrey')
-
-        # Add a legend for the labels
-        ax.legend([plt.Line2D([0], [0], color='white') for _ in labels], 
-                [f'{k}: {v}' for k, v in labels.items()], 
-                bbox_to_anchor=(1.20, 1.1), loc='upper left')
-
-        # Save the figure as an images with several extensions
-        for ext in plot_extensions:
-            fig.savefig(PLOT_FILE + ext, bbox_inches='tight')
-        
-    case "wordcloud":
-        selected_column_file_path = sys.argv[2]
-        size_x = int(sys.argv[3])
-        size_y = int(sys.argv[4])
-        measurement_unit = sys.argv[5]
-        
-        converted_size_x = convert_to_px(measurement_unit, size_x)
-        converted_size_y = convert_to_px(measurement_unit, size_y)
+                # Generate the heatmap
+                fig, ax = plt.subplots(figsize=(converted_size_x, converted_size_y))
+                ax.set_aspect('equal')
+                sns.heatmap(iou_matrix, mask=mask, annot=False, cmap='YlGnBu', ax=ax, linewidths=0.5, linecolor='lightgrey')
+
+                # Add a legend for the labels
+                ax.legend([plt.Line2D([0], [0], color='white') for _ in labels], 
+                        [f'{k}: {v}' for k, v in labels.items()], 
+                        bbox_to_anchor=(1.20, 1.1), loc='upper left')
+
+                # Save the figure as an image of the given extension
+                def save(ext):
+                    fig.savefig(ofname + ext, bbox_inches='tight')
+
+                for ext in ofext:
+                    save(ext)
+                return save
         
-        if (converted_size_x > 3000 or converted_size_y > 3000):
-            print("Plot sizes cannot exceed 3000 pixels.")
-            exit(1)
+        case "wordcloud":
+            from wordcloud import WordCloud
+            from term_tokens import load_term_tokens
+
+            # JSON-formatted pair of the column name (Term or Lead_genes) and the terms whose words are drawn
+            selected_column_and_terms_raw = args[1]
+            size_x = int(args[2])
+            size_y = int(args[3])
+            measurement_unit = args[4]
         
-        # Read selected column data from file path passed as CLI arguments
-        file = open(selected_column_file_path, "r")
-        selected_column = file.read()
-        file.close()
+            converted_size_x = convert_to_px(measurement_unit, size_x)
+            converted_size_y = convert_to_px(measurement_unit, size_y)
         
-        data = selected_column.replace("_", " ").replace(";", " ").replace(",", " ")
+            if (converted_size_x > 3000 or converted_size_y > 3000):
+                print("Plot sizes cannot exceed 3000 pixels.")
+                exit(1)
         
-        wc = WordCloud(
-            width=converted_size_x, 
-            height=converted_size_y,
-            background_color="white",
-            scale=1).generate(data)
+            selected_column, selected_terms = json.loads(selected_column_and_terms_raw)
+
+            # Word frequencies of the selected terms, from the word counts of the run (see term_tokens.py)
+            try:
+                frequencies = load_term_tokens(res, run_id).frequencies(selected_column, selected_terms)
+            except KeyError as e:
+                print("The column or the gene set " + str(e.args[0]) + " isn't in the analysis results.")
+                exit(1)
+
+            if not frequencies:
+                print("The selected gene sets have no words to draw.")
+                exit(1)
+
+            # The .svg image extension is excluded, since it's not supported for wordclouds
+            extensions = [ext for ext in extensions if ext != ".svg"]
         
-        # The .svg image extension is excluded, since it's not supported for wordclouds
-        for ext in plot_extensions[:2]:
-            wc.to_file(PLOT_FILE + ext)
+            def draw(ofname, ofext):
+                wc = WordCloud(
+                    width=converted_size_x, 
+                    height=converted_size_y,
+                    background_color="white",
+                    scale=1).generate_from_frequencies(frequencies)
+
+                def save(ext):
+                    wc.to_file(ofname + ext)
+
+                for ext in ofext:
+                    save(ext)
+                return save
     
-    case _:
-        print("The requested plot doesn't exist", file=sys.stderr)
-        exit(1)
+        case _:
+            print("The requested plot doesn't exist", file=sys.stderr)
+            exit(1)
 
+    # Without a run ID, the plot is drawn straight into the plot file
+    if run_id is None:
+        last_plot.clear()
+        with profiling.stage("render", rows=len(extensions)):
+            draw(PLOT_FILE, extensions)
+    else:
+        show_plot(plot_cache_dir(run_id, args), draw, extensions)
+
+if __name__ == "__main__":
+    # Load the stored result of the run whose ID is passed as first argument
+    with profiling.stage("load-result"):
+        try:
+            res = load_result(sys.argv[1])
+        except (FileNotFoundError, ValueError):
+            print("The results of the requested analysis are not available anymore, run the analysis again.")
+            exit(1)
 
+    run_plot(res, sys.argv[2:], run_id=sys.argv[1])
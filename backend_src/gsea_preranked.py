@@ -7,99 +7,226 @@ try:
     import sys
     import os.path
     import pandas as pd
-    import matplotlib.pyplot as plt
-    from pandas.api.types import is_numeric_dtype
-    import gseapy as gp
-    import dill
+    import multiprocessing
+    import time
+    import scheduler
+    import analysis_events as events
+    import profiling
+    import gsea_preranked_engine
+    import gmt_cache
+    import analysis_cache
+    import chip_remap
+    from input_readers import read_rnk, MissingValuesError, NonNumericValuesError
+    from result_store import save_result, new_run_id
+    from backend_options import parse_options, positional_args
 except Exception as e:
     errorAndExit('Some python libraries weren\'t found.\n' + str(e))
 
 # Home directory of user running this script
 HOME_DIR = os.path.expanduser("~")
 
-# Read arguments passed on the script call
-gene_sets_path = sys.argv[1]
-num_permutation = int(sys.argv[2])
-min_gene_set = int(sys.argv[3])
-max_gene_set = int(sys.argv[4])
-rnk_list_path = sys.argv[5]
-remap = sys.argv[6]
-chip_path = sys.argv[7]
-
-# If the files types are not correct, print error and exit
-if (not rnk_list_path.endswith(".rnk")):
-    errorAndExit("The ranked list file (.rnk) is not of the right type.")
-if (not gene_sets_path.endswith(".gmt")):
-    errorAndExit("The gene set file (.gmt) is not of the right type.")
-   
-# Try to parse the ranked list 
-try:
-    rnk_list = pd.read_csv(rnk_list_path, header=None, index_col=0, sep="\t")
-except Exception:
-    errorAndExit("The ranked list file is malformed and cannot be intepreted.")
-    
-# Check if any value in the ranked list file is missing
-if (rnk_list.isnull().any().any() or rnk_list.index.hasnans):
-    errorAndExit("The ranked list file has some missing values and cannot be used.")
-
-# Check if any cell of the ranked list file (except index) is not numerical
-if (rnk_list.apply(lambda x: not is_numeric_dtype(x)).any()):
-    errorAndExit("The ranked list file has some non-numerical values and cannot be used.")
-    
-rnk_chosen = ""
-
-# If the number of permutation is invalid, exit and print error
-if num_permutation <= 0:
-    errorAndExit("The number of permutations must be positive.")
-
-if min_gene_set < 0:
-    errorAndExit("Min gene set size must be positive.")
-if max_gene_set < 0:
-    errorAndExit("Max gene set size must be positive.")
-if min_gene_set > max_gene_set:
-    errorAndExit("Max gene set size must be greater than min gene set size.")
-
-# If remap unselected
-if remap == "none":
-    rnk_chosen = rnk_list
-# If remap selected
-else:
-    # If chip file not selected (left blank), exit and print error
-    if (chip_path == "null"):
-        errorAndExit("If remap selected, a chip must be selected.")
-    
-    if (not chip_path.endswith(".chip")):
-        errorAndExit("The chip platform file (.chip) is not of the right type.")
-        
-    # Try to parse chip platform file
+# Engines available to compute the analysis
+ENGINES = ["native", "gseapy"]
+
+# Seed of the permutations, fixed so that the same analysis always gives the same result
+SEED = 7
+
+# Run a GSEA preranked analysis on the given arguments (same order as the script call ones),
+# emit its results as events (see analysis_events.py) and return the gseapy result object
+# After the positional arguments, the "key=value" options are accepted:
+#   engine   -> "native" (default, null distributions shared by size and cached) or "gseapy"
+#   threads  -> number of processes/threads to use (default 0, i.e. all the available cores)
+#   collapse -> how the values of the identifiers remapped to the same gene symbol are collapsed:
+#               "none" (default, left to the engine), "max", "mean", "median" or "max-abs"
+#   cache    -> "false" to compute the analysis even if its result is in the analysis cache (default "true")
+def run_gsea_preranked(args):
+    gene_sets_path = args[0]
+    num_permutation = int(args[1])
+    min_gene_set = int(args[2])
+    max_gene_set = int(args[3])
+    rnk_list_path = args[4]
+    remap = args[5]
+    chip_path = args[6]
+    options = parse_options(args[7:])
+    start_time = time.perf_counter()
+    engine = options.get("engine", "native")
+
+    if engine not in ENGINES:
+        errorAndExit("The requested engine doesn't exist.")
+
+    # Try to parse the number of threads
     try:
-        chip = pd.read_csv(chip_path, header=0, index_col=0, sep="\t")
-    except Exception:
-        errorAndExit("The chip platform file is malformed and cannot be intepreted.")
-        
-    # Check if any cell (index included) of the chip platform file is missing
-    if (chip.iloc[:, 0].isnull().any() or chip.index.hasnans):
-        errorAndExit("The chip platform file has some missing values and cannot be used.")
-        
-    # Convert the ranked list genes in the chip platform notation
-    rnk_chosen = rnk_list.join(chip)[["Gene Symbol", 1]].reset_index(drop=True).dropna()
+        threads = int(options.get("threads", "0"))
+    except ValueError:
+        errorAndExit("The number of threads must be an integer.")
 
-try:
-    res = gp.prerank(rnk=rnk_chosen,
-                    gene_sets=gene_sets_path,
-                    threads=4,
-                    min_size=min_gene_set,
-                    max_size=max_gene_set,
-                    permutation_num=num_permutation,
-                    outdir=None,
-                    seed=7)
-except Exception:
-    errorAndExit("GSEA preranked failed while computing the analysis.")
-
-# Print and send on stdout the result as a JSON-formatted string
-res_json = res.res2d.to_json(orient="records")
-print(res_json)
-sys.stdout.flush()
-
-# Save the python session on a file
-dill.dump_session(os.path.join(HOME_DIR, "gseacompass_python_session.pkl"))
+    use_cache = options.get("cache", "true").lower() != "false"
+    collapse = options.get("collapse", "none").lower()
+
+    if collapse not in chip_remap.COLLAPSE_STRATEGIES:
+        errorAndExit("The requested collapse strategy doesn't exist.")
+
+    events.phase("reading-inputs")
+
+    # If the files types are not correct, print error and exit
+    if (not rnk_list_path.endswith((".rnk", ".rnk.gz"))):
+        errorAndExit("The ranked list file (.rnk) is not of the right type.")
+    if (not gene_sets_path.endswith(".gmt")):
+        errorAndExit("The gene set file (.gmt) is not of the right type.")
+
+    # Return the cached result if the same analysis, on the same input files, was already computed
+    cache_key = analysis_cache.analysis_key("gsea-preranked",
+                                            {"gmt": gene_sets_path,
+                                             "rnk": rnk_list_path,
+                                             "chip": None if remap == "none" else chip_path},
+                                            {"remap": remap,
+                                             "collapse": collapse,
+                                             "permutations": num_permutation,
+                                             "min_size": min_gene_set,
+                                             "max_size": max_gene_set,
+                                             "seed": SEED,
+                                             "engine": engine})
+    with profiling.stage("read-cache"):
+        cached_res = analysis_cache.load_cached(cache_key) if use_cache else None
+    if cached_res is not None:
+        print("Result read from the analysis cache", file=sys.stderr)
+        events.phase("writing-results")
+        events.results_table(cached_res.res2d)
+        events.summary(cached_res.res2d, time.perf_counter() - start_time)
+        return cached_res
+
+    # Try to parse the gene sets database (parsed just once per file and then cached, see gmt_cache.py)
+    with profiling.stage("parse-gmt") as stage:
+        try:
+            gene_sets = gmt_cache.load_gmt(gene_sets_path)
+        except Exception:
+            errorAndExit("The gene sets database file is malformed and cannot be intepreted.")
+        stage["rows"] = len(gene_sets.terms)
+
+    # Try to parse the ranked list, checking that all its values are there and numerical while parsing it
+    with profiling.stage("parse-rnk") as stage:
+        try:
+            rnk_list = read_rnk(rnk_list_path)
+        except MissingValuesError:
+            errorAndExit("The ranked list file has some missing values and cannot be used.")
+        except NonNumericValuesError:
+            errorAndExit("The ranked list file has some non-numerical values and cannot be used.")
+        except Exception:
+            errorAndExit("The ranked list file is malformed and cannot be intepreted.")
+        stage["rows"] = len(rnk_list)
+
+    rnk_chosen = ""
+
+    # If the number of permutation is invalid, exit and print error
+    if num_permutation <= 0:
+        errorAndExit("The number of permutations must be positive.")
+
+    if min_gene_set < 0:
+        errorAndExit("Min gene set size must be positive.")
+    if max_gene_set < 0:
+        errorAndExit("Max gene set size must be positive.")
+    if min_gene_set > max_gene_set:
+        errorAndExit("Max gene set size must be greater than min gene set size.")
+
+    # If remap unselected
+    if remap == "none":
+        rnk_chosen = rnk_list
+    # If remap selected
+    else:
+        # If chip file not selected (left blank), exit and print error
+        if (chip_path == "null"):
+            errorAndExit("If remap selected, a chip must be selected.")
+
+        if (not chip_path.endswith((".chip", ".chip.gz"))):
+            errorAndExit("The chip platform file (.chip) is not of the right type.")
+
+        # Try to parse chip platform file (parsed just once per file and then kept in memory, see chip_remap.py)
+        with profiling.stage("parse-chip"):
+            try:
+                chip_index = chip_remap.read_chip_index(chip_path)
+            except MissingValuesError:
+                errorAndExit("The chip platform file has some missing values and cannot be used.")
+            except Exception:
+                errorAndExit("The chip platform file is malformed and cannot be intepreted.")
+
+        # Convert the ranked list genes in the chip platform notation, collapsing the duplicated gene symbols
+        with profiling.stage("remap", rows=len(rnk_list)):
+            rnk_chosen = chip_remap.remap(rnk_list[1], chip_index, collapse).reset_index()
+
+    events.phase("computing")
+
+    if engine == "native":
+        # The native engine takes a Series of the ranked list values indexed by gene name
+        if remap == "none":
+            ranking = rnk_chosen.iloc[:, 0]
+        else:
+            ranking = rnk_chosen.set_index("Gene Symbol")[1]
+
+        with profiling.stage("permutation") as stage:
+            try:
+                res = gsea_preranked_engine.prerank(ranking,
+                                                    gene_sets,
+                                                    num_permutation,
+                                                    min_gene_set,
+                                                    max_gene_set,
+                                                    seed=SEED,
+                                                    processes=scheduler.num_processes(threads),
+                                                    on_progress=events.progress)
+            except Exception:
+                errorAndExit("GSEA preranked failed while computing the analysis.")
+            stage["rows"] = len(res.res2d)
+
+        # Report the time spent on each shard of permutations (none if all the null distributions were cached)
+        print(scheduler.format_timings(res.shard_timings), file=sys.stderr)
+    else:
+        with profiling.stage("permutation") as stage:
+            try:
+                # Imported here, since gseapy loads its plotting libraries too
+                import gseapy as gp
+
+                # gseapy reads the gene names from the first column (an index is moved there only if its
+                # dtype is object, which isn't the case for the pandas string dtype)
+                if remap == "none":
+                    rnk_chosen = rnk_list.reset_index()
+
+                res = gp.prerank(rnk=rnk_chosen,
+                                gene_sets=gene_sets.to_dict(),
+                                threads=scheduler.num_processes(threads),
+                                min_size=min_gene_set,
+                                max_size=max_gene_set,
+                                permutation_num=num_permutation,
+                                outdir=None,
+                                seed=SEED)
+            except Exception:
+                errorAndExit("GSEA preranked failed while computing the analysis.")
+            stage["rows"] = len(res.res2d)
+
+    # Cache the result, the run result store then shares its files (see result_store.py)
+    with profiling.stage("write-cache", rows=len(res.res2d)):
+        res = analysis_cache.store_cached(res, cache_key)
+
+    # Send the results table, one row per event, and the summary
+    events.phase("writing-results")
+    with profiling.stage("send-results", rows=len(res.res2d)):
+        events.results_table(res.res2d)
+        events.summary(res.res2d, time.perf_counter() - start_time)
+
+    return res
+
+if __name__ == "__main__":
+    # Needed by the process pool in the packaged (frozen) executable
+    multiprocessing.freeze_support()
+
+    res = run_gsea_preranked(sys.argv[1:])
+
+    # Save the result in the result store, to be used by the plots
+    # The run ID can be passed after the positional arguments, otherwise a new one is generated
+    # The run ID can be followed by the options
+    extra_args = positional_args(sys.argv[8:])
+    if len(extra_args) > 0:
+        run_id = extra_args[0]
+    else:
+        run_id = new_run_id()
+        print("Result stored with run ID " + run_id, file=sys.stderr)
+    with profiling.stage("save-result", rows=len(res.res2d)):
+        save_result(res, run_id)
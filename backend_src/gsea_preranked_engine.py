@@ -0,0 +1,182 @@
+# Native GSEA preranked engine (gene set permutation).
+#
+# With the gene set permutation, the null distribution of a gene set is the one of the enrichment scores
+# of random gene sets of the same size drawn from the same ranked list, so it depends only on the ranked
+# list and on the gene set size. A single null distribution is then computed for each gene set size and
+# shared by all the gene sets of that size.
+#
+# The null distributions are cached on disk, one file per gene set size, under a key made of the hash of
+# the ranked list values, the number of permutations and the seed: running again the same ranked list,
+# even against a different gene sets database, computes just the sizes never seen before.
+# Each key directory has a manifest.json too, whose modification time tracks its last access: the least
+# recently used ones are evicted when the cache exceeds its size cap.
+import os
+import os.path
+import json
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+import scheduler
+from gsea_engine import enrichment_scores, significance, term_details, build_result
+from result_store import evict_results
+
+# Version of the cached null distributions, to be changed whenever the way they are computed changes
+NULL_CACHE_VERSION = 1
+
+# Directory in which the null distributions are cached
+NULL_CACHE_DIR = os.path.join(os.path.expanduser("~"), "gseacompass_cache", "preranked_nulls")
+
+# Maximum disk space used by the cached null distributions (MB), it can be set through the environment (0 disables the cache)
+NULL_CACHE_MB = int(os.environ.get("GSEACOMPASS_NULL_CACHE_MB", 512))
+
+# Prepare the ranked list as gseapy does: drop missing values, sort by decreasing value and make
+# the gene names unique (adding a "_<n>" suffix to the duplicated ones)
+def prepare_ranking(ranking):
+    ranking = ranking.dropna()
+    values = ranking.to_numpy(dtype=np.float64)
+    order = np.argsort(-values, kind="stable")
+
+    genes = pd.Series(ranking.index.astype(str)[order])
+    duplicated = genes.duplicated(keep=False)
+    if duplicated.any():
+        suffixes = genes[duplicated].groupby(genes[duplicated]).cumcount().map(lambda c: "_" + str(c) if c else "")
+        genes[duplicated] = genes[duplicated] + suffixes
+
+    return pd.Series(values[order], index=genes.to_numpy())
+
+# Enrichment scores of random gene sets of the same size, given the sorted absolute ranked list values
+# and the (sorted) positions of the genes of each random gene set (one row per gene set)
+def sample_enrichment_scores(sorted_weights, hit_position):
+    num_genes = len(sorted_weights)
+    size = hit_position.shape[1]
+
+    hit_weight = sorted_weights[hit_position]
+    cumulative = np.cumsum(hit_weight, axis=1)
+    norm = cumulative[:, -1:]
+    miss = (hit_position - np.arange(size)) / (num_genes - size)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        after_hit = cumulative / norm - miss
+        before_hit = (cumulative - hit_weight) / norm - miss
+
+    es_max = np.maximum(after_hit.max(axis=1), 0)
+    es_min = np.minimum(before_hit.min(axis=1), 0)
+    return np.where(np.abs(es_max) > np.abs(es_min), es_max, es_min)
+
+# Compute the null enrichment scores (sizes x permutations) of a shard of permutations (see scheduler.py)
+# The first k genes of a random permutation of the ranked list are a random gene set of size k, so each
+# permutation serves all the sizes, and its random stream doesn't depend on the requested sizes
+def shard_size_nulls(sorted_weights, sizes, num_permutation, rng):
+    num_genes = len(sorted_weights)
+    samples = rng.permuted(np.tile(np.arange(num_genes), (num_permutation, 1)), axis=1)[:, :max(sizes)]
+
+    nulls = np.empty((len(sizes), num_permutation))
+    for i, size in enumerate(sizes):
+        nulls[i] = sample_enrichment_scores(sorted_weights, np.sort(samples[:, :size], axis=1))
+    return nulls
+
+# Cache directory of the null distributions of the given ranked list values, number of permutations and seed
+def null_cache_dir(sorted_metric, num_permutation, seed):
+    key = hashlib.sha256()
+    key.update(np.ascontiguousarray(sorted_metric, dtype=np.float64).tobytes())
+    key.update(("%d:%d:%d" % (num_permutation, seed, NULL_CACHE_VERSION)).encode())
+    return os.path.join(NULL_CACHE_DIR, key.hexdigest())
+
+# Mark the given cache directory as just accessed, writing its manifest if it isn't there yet
+def touch_null_cache(cache_dir, num_permutation, seed):
+    manifest_path = os.path.join(cache_dir, "manifest.json")
+    try:
+        os.utime(manifest_path)
+    except FileNotFoundError:
+        tmp_path = manifest_path + ".tmp%d" % os.getpid()
+        with open(tmp_path, "w") as manifest_file:
+            json.dump({"version": NULL_CACHE_VERSION, "permutations": num_permutation, "seed": seed}, manifest_file)
+        os.replace(tmp_path, manifest_path)
+
+# Write the given null distributions (dict size -> array) in the given cache directory, then evict the least
+# recently used directories beyond the cache size cap
+# A failure just leaves them out of the cache, the analysis goes on
+def cache_nulls(cache_dir, nulls, num_permutation, seed):
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        for size, null in nulls.items():
+            # Write to a temporary file first, so that a reader never sees a partial file
+            tmp_path = os.path.join(cache_dir, "%d.npy.tmp%d" % (size, os.getpid()))
+            with open(tmp_path, "wb") as null_file:
+                np.save(null_file, null)
+            os.replace(tmp_path, os.path.join(cache_dir, "%d.npy" % size))
+        touch_null_cache(cache_dir, num_permutation, seed)
+        evict_results(NULL_CACHE_DIR, NULL_CACHE_MB, keep=(os.path.basename(cache_dir),))
+    except OSError:
+        pass
+
+# Return the null distribution of each requested gene set size (dict size -> array), reading the cached
+# ones and computing (and caching) the missing ones
+# Return the shard timings of the computed ones too
+def size_nulls(sorted_metric, sizes, num_permutation, seed, processes=1, on_progress=None):
+    cache_dir = null_cache_dir(sorted_metric, num_permutation, seed)
+    nulls = {}
+
+    if NULL_CACHE_MB > 0:
+        for size in sizes:
+            try:
+                nulls[size] = np.load(os.path.join(cache_dir, "%d.npy" % size))
+            except (OSError, ValueError):
+                pass
+
+    missing = [size for size in sizes if size not in nulls]
+    if len(missing) == 0:
+        try:
+            touch_null_cache(cache_dir, num_permutation, seed)
+        except OSError:
+            pass
+        return nulls, []
+
+    # Count the permutations done, for the progress report
+    permutations_done = 0
+    def shard_done(timing):
+        nonlocal permutations_done
+        permutations_done += timing["permutations"]
+        if on_progress is not None:
+            on_progress(permutations_done, num_permutation)
+
+    values, shard_timings = scheduler.run_sharded(shard_size_nulls, (np.abs(sorted_metric), missing),
+                                                  scheduler.make_shards(num_permutation), seed, processes, shard_done)
+    computed = {size: computed_null for size, computed_null in zip(missing, np.concatenate(values, axis=1))}
+    nulls.update(computed)
+
+    if NULL_CACHE_MB > 0:
+        cache_nulls(cache_dir, computed, num_permutation, seed)
+
+    return nulls, shard_timings
+
+# Run a GSEA preranked analysis (gene set permutation)
+# ranking: Series of the ranked list values indexed by gene name
+# gene_sets: gene sets database loaded by gmt_cache.load_gmt()
+def prerank(ranking, gene_sets, num_permutation, min_size, max_size, seed, processes=1, on_progress=None):
+    ranking = prepare_ranking(ranking)
+    sorted_metric = ranking.to_numpy()
+
+    terms, indptr, indices = gene_sets.membership(ranking.index, min_size, max_size)
+    if len(terms) == 0:
+        raise LookupError("No gene sets passed through filtering condition.")
+
+    # The genes are already in ranked order, so their index is their position in the ranked list
+    es = enrichment_scores(sorted_metric[np.newaxis, :], indptr, indices)[:, 0]
+    details = term_details("prerank", terms, indptr, indices, es, ranking)
+
+    # Null distribution of each gene set, shared by the gene sets of the same size
+    set_sizes = np.diff(indptr)
+    nulls, shard_timings = size_nulls(sorted_metric, sorted(set(set_sizes.tolist())), num_permutation, seed, processes, on_progress)
+    # Each gene set takes its size null rotated by its own index, so that the gene sets of the same size
+    # aren't paired with the same permutations (it matters just for the FWER, which compares the gene
+    # sets permutation by permutation)
+    es_null = np.stack([np.roll(nulls[size], i) for i, size in enumerate(set_sizes.tolist())])
+
+    pvals, nes, fdrs, fwers = significance(es, [(np.arange(len(terms)), 0, es_null)])
+
+    res = build_result(terms, details, nes, pvals, fdrs, fwers, ranking, None, "Pos", "Neg")
+    res.shard_timings = shard_timings
+    return res
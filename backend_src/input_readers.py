@@ -0,0 +1,149 @@
+# Readers of the analysis input files shared by the analysis scripts.
+#
+# The expression sets (.gct) and ranked lists (.rnk) are parsed straight into float arrays with
+# explicit types, so the values are checked to be numeric while they are parsed and the missing ones
+# are found with a single scan of the parsed array. Gzip-compressed inputs (.gz) are read as well.
+# Setting the GSEACOMPASS_CSV_ENGINE environment variable to "pyarrow" parses them with pyarrow,
+# if installed.
+#
+# The chip files are read by chip_remap.py.
+import os
+import os.path
+import gzip
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+# Parser used by pandas for the expression sets and ranked lists ("c" or "pyarrow")
+CSV_ENGINE = os.environ.get("GSEACOMPASS_CSV_ENGINE", "c")
+
+# Rows of an expression set parsed at a time by the "c" engine
+GCT_CHUNK_ROWS = 4096
+
+# Maximum memory allocated upfront for the values of an expression set from the number of genes declared
+# by the file (MB), the values array grows beyond it
+GCT_PREALLOCATED_MB = 256
+
+# Raised when an input file has some missing values
+class MissingValuesError(ValueError):
+    pass
+
+# Raised when an input file has some non-numerical values where numbers are expected
+class NonNumericValuesError(ValueError):
+    pass
+
+# Return the cache key of the given file, changing whenever the file is modified
+def file_key(path):
+    stat = os.stat(path)
+    return (os.path.realpath(path), stat.st_size, stat.st_mtime_ns)
+
+# Hash of the content of the files already seen, by (path, size, modification time)
+file_hashes = {}
+
+# Return the hash of the content of the given file
+def file_hash(path):
+    key = file_key(path)
+    if key not in file_hashes:
+        digest = hashlib.sha256()
+        with open(path, "rb") as input_file:
+            for chunk in iter(lambda: input_file.read(1 << 20), b""):
+                digest.update(chunk)
+        file_hashes[key] = digest.hexdigest()
+    return file_hashes[key]
+
+# Open the given text file, decompressing it if gzip-compressed
+def open_text(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt")
+    return open(path, "r")
+
+# Parse a tab separated file with pandas, with the given column types (by position)
+# Raise NonNumericValuesError if a numeric column has other values
+def read_table(path, dtype, **kwargs):
+    try:
+        return pd.read_csv(path, sep="\t", header=None, dtype=dtype, compression="infer", engine=CSV_ENGINE, **kwargs)
+    except pd.errors.ParserError:
+        raise
+    except (ValueError, TypeError) as e:
+        raise NonNumericValuesError(str(e))
+
+# Read the header of a .gct expression set (version line, "rows columns" line, NAME/Description/samples header)
+# Return the number of genes declared by the file (0 if missing or negative) and the header fields
+def read_gct_header(gct_path):
+    with open_text(gct_path) as gct_file:
+        gct_file.readline()
+        dimensions = gct_file.readline().split()
+        header = gct_file.readline().rstrip("\r\n").split("\t")
+
+    if len(header) < 3:
+        raise ValueError("The expression set has no samples")
+
+    try:
+        num_genes = max(0, int(dimensions[0]))
+    except (IndexError, ValueError):
+        num_genes = 0
+
+    return num_genes, header
+
+# Parse the genes of a .gct expression set in chunks, yielding (gene names, descriptions, values of the given type)
+# Raise MissingValuesError or NonNumericValuesError if the gene names or the values aren't all there and numeric
+def read_gct_chunks(gct_path, header, dtype=np.float64):
+    column_types = {0: str, 1: str}
+    column_types.update({i: dtype for i in range(2, len(header))})
+
+    # The pyarrow engine doesn't parse in chunks
+    if CSV_ENGINE == "pyarrow":
+        chunks = [read_table(gct_path, column_types, skiprows=3, names=range(len(header)))]
+    else:
+        chunks = read_table(gct_path, column_types, skiprows=3, names=range(len(header)), chunksize=GCT_CHUNK_ROWS)
+
+    for chunk in chunks:
+        names = chunk[0].to_numpy(dtype=object)
+        values = chunk.iloc[:, 2:].to_numpy(dtype=dtype)
+
+        # Each row must have a gene name and all its values (the description can be missing)
+        if pd.isnull(names).any() or np.isnan(values).any():
+            raise MissingValuesError("The expression set has some missing values")
+
+        yield names, chunk[1].to_numpy(dtype=object), values
+
+# Parse a .gct expression set
+# Return a DataFrame indexed by gene name, with the description column followed by the samples values of the
+# given type
+# Raise MissingValuesError or NonNumericValuesError if the gene names or the values aren't all there and numeric
+def read_gct(gct_path, dtype=np.float64):
+    num_genes, header = read_gct_header(gct_path)
+
+    # The number of genes in the header is used to allocate the values once (it's just a hint, the array
+    # grows if the file has more genes), up to GCT_PREALLOCATED_MB so that a wrong one can't exhaust the memory
+    row_bytes = (len(header) - 2) * np.dtype(dtype).itemsize
+    num_genes = min(num_genes, GCT_PREALLOCATED_MB * 1024 * 1024 // max(row_bytes, 1))
+    values = np.empty((num_genes, len(header) - 2), dtype=dtype)
+    names = []
+    descriptions = []
+    num_rows = 0
+    for chunk_names, chunk_descriptions, chunk_values in read_gct_chunks(gct_path, header, dtype):
+        if num_rows + len(chunk_values) > len(values):
+            values = np.resize(values, (max(2 * len(values), num_rows + len(chunk_values)), values.shape[1]))
+        values[num_rows:num_rows + len(chunk_values)] = chunk_values
+        names.extend(chunk_names)
+        descriptions.extend(chunk_descriptions)
+        num_rows += len(chunk_values)
+
+    expression_set = pd.DataFrame(values[:num_rows], index=pd.Index(names, name=header[0]), columns=header[2:], copy=False)
+    expression_set.insert(0, header[1], descriptions)
+    return expression_set
+
+# Parse a .rnk ranked list (gene name and value per line, no header)
+# Return a DataFrame indexed by gene name with the values in column 1
+# Raise MissingValuesError or NonNumericValuesError if the gene names or the values aren't all there and numeric
+def read_rnk(rnk_path):
+    rnk_list = read_table(rnk_path, {0: str, 1: np.float64}, index_col=0)
+
+    if rnk_list.shape[1] != 1:
+        raise ValueError("The ranked list must have two columns")
+    if rnk_list.index.hasnans or np.isnan(rnk_list[1].to_numpy()).any():
+        raise MissingValuesError("The ranked list has some missing values")
+
+    return rnk_list
@@ -0,0 +1,178 @@
+# Leading-edge analysis of the gene sets of a stored result: leading-edge heatmaps of any number of
+# gene sets and leading-edge overlaps, served from an index built once per run.
+#
+# The index is built in one pass over the results table and stored next to the result (see result_store.py):
+#   leading_edge.json          -> format version, samples of the z-scored heatmat (null without heatmat)
+#   leading_edge_terms.npy     -> gene set names, in results table order
+#   leading_edge_genes.npy     -> leading-edge genes, each one once, in order of first appearance
+#   leading_edge_indptr.npy    -> CSR index pointers, the leading edge of gene set i is indices[indptr[i]:indptr[i+1]]
+#   leading_edge_indices.npy   -> CSR gene IDs (positions in leading_edge_genes.npy), in Lead_genes order
+#   leading_edge_zscore.npy    -> heatmat rows of the leading-edge genes, z-scored across the samples
+# So a heatmap is a slice of the z-scored rows by position, with no label lookup or z-scoring per request,
+# and the overlaps come from the sparse (gene sets x genes) leading-edge matrix.
+#
+# Usage: python leading_edge.py <run ID> <JSON-formatted list of terms>
+import sys
+import os
+import os.path
+import json
+from io import StringIO
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from result_store import load_result, StoredResult
+import profiling
+
+LEADING_EDGE_VERSION = 1
+
+# Indexes already loaded by this process, by (result directory, manifest inode), since a run
+# directory is replaced as a whole when its result is written again
+leading_edges = {}
+
+# Return the path of the given index file of the given result directory
+def index_path(store_dir, name):
+    return os.path.join(store_dir, "leading_edge_%s.npy" % name)
+
+# Standardize each row of the given matrix to mean 0 and standard deviation 1 (as gseapy Heatmap with z_score=0)
+def zscore_rows(values):
+    mean = values.mean(axis=1, keepdims=True)
+    std = values.std(axis=1, ddof=1, keepdims=True)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (values - mean) / std
+
+# Build the leading-edge index of the given stored result and write it in its directory
+def build_index(res):
+    res2d = res.res2d
+    terms = res2d["Term"].astype(str).to_numpy()
+
+    # All the leading edges split at once (empty ones dropped), then each distinct gene gets an ID
+    lead_genes = res2d["Lead_genes"].fillna("").astype(str).reset_index(drop=True).str.split(";").explode()
+    lead_genes = lead_genes[lead_genes != ""]
+    gene_ids, genes = pd.factorize(lead_genes.to_numpy())
+
+    indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(lead_genes.index.to_numpy(dtype=np.int64), minlength=len(terms)), out=indptr[1:])
+    indices = gene_ids.astype(np.int32)
+
+    arrays = {
+        "terms": terms.astype(str),
+        "genes": np.asarray(genes, dtype=str),
+        "indptr": indptr,
+        "indices": indices,
+    }
+
+    # The heatmat is available just for the GSEA (phenotype permutation) results
+    heatmat = res.heatmat
+    samples = None
+    if heatmat is not None:
+        rows = pd.Index(heatmat.index).get_indexer(pd.Index(genes))
+        values = np.full((len(genes), heatmat.shape[1]), np.nan)
+        values[rows >= 0] = heatmat.to_numpy()[rows[rows >= 0]]
+        arrays["zscore"] = zscore_rows(values)
+        samples = [str(c) for c in heatmat.columns]
+
+    # Each file is written under a temporary name first and the JSON file, written last, marks the index complete
+    for name, array in arrays.items():
+        tmp_path = index_path(res.store_dir, name) + ".tmp%d" % os.getpid()
+        with open(tmp_path, "wb") as array_file:
+            np.save(array_file, array)
+        os.replace(tmp_path, index_path(res.store_dir, name))
+
+    tmp_path = os.path.join(res.store_dir, "leading_edge.json.tmp%d" % os.getpid())
+    with open(tmp_path, "w") as index_file:
+        json.dump({"version": LEADING_EDGE_VERSION, "samples": samples}, index_file)
+    os.replace(tmp_path, os.path.join(res.store_dir, "leading_edge.json"))
+
+# Leading-edge index of a stored result
+class LeadingEdge:
+    def __init__(self, store_dir):
+        with open(os.path.join(store_dir, "leading_edge.json"), "r") as index_file:
+            info = json.load(index_file)
+
+        if info["version"] != LEADING_EDGE_VERSION:
+            raise ValueError("Unsupported leading-edge index version: " + str(info["version"]))
+
+        self.samples = info["samples"]
+        self.terms = pd.Index(np.load(index_path(store_dir, "terms")))
+        self.genes = np.load(index_path(store_dir, "genes"))
+        indptr = np.load(index_path(store_dir, "indptr"))
+        indices = np.load(index_path(store_dir, "indices"))
+        self.matrix = sparse.csr_matrix((np.ones(len(indices), dtype=np.int32), indices, indptr), shape=(len(self.terms), len(self.genes)))
+        self.zscore = np.load(index_path(store_dir, "zscore"), mmap_mode="r") if self.samples is not None else None
+
+    # Return the positions of the given terms
+    # Raise KeyError if any of them isn't in the results
+    def term_rows(self, terms):
+        rows = self.terms.get_indexer(pd.Index(terms))
+        if (rows < 0).any():
+            raise KeyError(terms[int(np.argmax(rows < 0))])
+        return rows
+
+    # Return the IDs of the leading-edge genes of the given terms, each one once, in order of first appearance
+    def gene_ids(self, terms):
+        rows = self.term_rows(terms)
+        ids = np.concatenate([self.matrix.indices[self.matrix.indptr[r]:self.matrix.indptr[r + 1]] for r in rows]) if len(rows) > 0 else np.zeros(0, dtype=np.int32)
+        _, first = np.unique(ids, return_index=True)
+        return ids[np.sort(first)]
+
+    # Return the z-scored heatmat rows of the leading-edge genes of the given terms, indexed by gene
+    def heatmap(self, terms):
+        if self.zscore is None:
+            raise ValueError("The heatmap is available just for the GSEA results")
+        ids = self.gene_ids(terms)
+        return pd.DataFrame(np.asarray(self.zscore[ids]), index=self.genes[ids], columns=self.samples)
+
+    # Return the leading-edge overlaps of the given terms:
+    #   genes    -> leading-edge genes of the terms, in order of first appearance
+    #   counts   -> number of the terms with each of the genes in their leading edge
+    #   overlaps -> (terms x terms) number of leading-edge genes shared by each pair of terms (sizes on the diagonal)
+    def overlaps(self, terms):
+        matrix = self.matrix[self.term_rows(terms)]
+        ids = self.gene_ids(terms)
+        return {
+            "terms": list(terms),
+            "genes": self.genes[ids].tolist(),
+            "counts": np.asarray(matrix.sum(axis=0)).ravel()[ids].tolist(),
+            "overlaps": (matrix @ matrix.T).toarray().tolist(),
+        }
+
+# Return the leading-edge index of the given result of the given run, building it just if it isn't built yet
+# The index is stored with the result, so a result still in memory is read from the result store
+def load_leading_edge(res, run_id=None):
+    if not isinstance(res, StoredResult):
+        res = load_result(run_id)
+
+    key = (res.store_dir, os.stat(os.path.join(res.store_dir, "manifest.json")).st_ino)
+    if key not in leading_edges:
+        try:
+            leading_edge = LeadingEdge(res.store_dir)
+        except (OSError, ValueError, KeyError):
+            with profiling.stage("build-leading-edge", rows=len(res.res2d)):
+                build_index(res)
+            leading_edge = LeadingEdge(res.store_dir)
+        leading_edges[key] = leading_edge
+    return leading_edges[key]
+
+# Print the leading-edge overlaps of the terms in the given arguments (JSON-formatted list) of the given
+# result of the given run, as a JSON-formatted object (see LeadingEdge.overlaps())
+def run_leading_edge(res, args, run_id=None):
+    try:
+        terms = pd.read_json(StringIO(args[0]))[0].tolist()
+        res_json = json.dumps(load_leading_edge(res, run_id).overlaps(terms))
+    except KeyError as e:
+        print("The gene set " + str(e.args[0]) + " isn't in the analysis results.")
+        exit(1)
+
+    print(res_json)
+    sys.stdout.flush()
+
+if __name__ == "__main__":
+    try:
+        res = load_result(sys.argv[1])
+    except (FileNotFoundError, ValueError):
+        print("The results of the requested analysis are not available anymore, run the analysis again.")
+        exit(1)
+
+    run_leading_edge(res, sys.argv[2:], run_id=sys.argv[1])
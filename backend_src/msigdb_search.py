@@ -0,0 +1,214 @@
+# Search index of the MSigDB gene sets, for the interactive term search and autocomplete.
+#
+# The index is a small SQLite database (index.db) built once from the MSigDB file and kept in the cache
+# directory, in a sub-directory named after the MSigDB file path, size and modification time:
+#   gene_set        -> id, standard name, upper case name (indexed, for prefix searches) and brief description
+#   gene_membership -> (upper case gene symbol, gene set id) pairs, clustered by symbol
+#   gene_set_text   -> FTS5 trigram index of the names and brief descriptions (if FTS5 is available)
+# So each search is a lookup of an index instead of a scan of the MSigDB tables.
+# Each sub-directory has a manifest.json too, whose modification time tracks its last access: the least
+# recently used indexes are evicted when the cache exceeds its size cap.
+#
+# Usage: python msigdb_search.py <msigdb.db> <query> [by=name|text|gene] [limit=<n>]
+import os
+import os.path
+import sys
+import json
+import shutil
+import sqlite3
+import hashlib
+from urllib.request import pathname2url
+
+from backend_options import parse_options, positional_args
+import gene_set_info
+
+SEARCH_INDEX_VERSION = 1
+
+# Directory in which the search indexes are kept, one sub-directory per MSigDB file
+SEARCH_INDEX_DIR = os.path.join(os.path.expanduser("~"), "gseacompass_cache", "msigdb_search")
+
+# Maximum disk space used by the search indexes (MB), it can be set through the environment
+SEARCH_INDEX_MB = int(os.environ.get("GSEACOMPASS_SEARCH_INDEX_MB", 512))
+
+# Ways of searching the gene sets: by name prefix, by text in the name or description, by member gene symbol
+SEARCH_MODES = ["name", "text", "gene"]
+
+# Default maximum number of gene sets returned by a search
+DEFAULT_LIMIT = 50
+
+# Utility function to exit on error
+def errorAndExit(errorString):
+    print(errorString)
+    exit(1)
+
+# Open read-only connections to the search indexes, by MSigDB file path, with the key of the MSigDB file
+# they were built from (see gene_set_info.msigdb_key())
+connections = {}
+
+# Return True if the SQLite library supports the FTS5 trigram tokenizer
+def has_fts5_trigram(con):
+    try:
+        con.execute("CREATE VIRTUAL TABLE temp.fts5_check USING fts5(a, tokenize='trigram')")
+        con.execute("DROP TABLE temp.fts5_check")
+        return True
+    except sqlite3.Error:
+        return False
+
+# Build the search index of the given MSigDB file in the given index directory
+def build_index(msigdb_path, index_dir):
+    msigdb = gene_set_info.open_msigdb(msigdb_path)
+
+    # Write everything in a temporary directory first, so that a reader never sees a partial index
+    tmp_dir = index_dir + ".tmp%d" % os.getpid()
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    con = sqlite3.connect(os.path.join(tmp_dir, "index.db"))
+    try:
+        con.executescript("""
+            CREATE TABLE gene_set (id INTEGER PRIMARY KEY, standard_name TEXT, name_key TEXT, description_brief TEXT);
+            CREATE TABLE gene_membership (symbol_key TEXT, gene_set_id INTEGER, PRIMARY KEY (symbol_key, gene_set_id)) WITHOUT ROWID;
+        """)
+
+        con.executemany("INSERT INTO gene_set VALUES (?, ?, upper(?), ?)",
+                        ((gene_set_id, name, name, description) for gene_set_id, name, description in msigdb.execute("""
+                            SELECT a.id, a.standard_name, b.description_brief
+                                FROM gene_set a
+                                    LEFT JOIN gene_set_details b ON a.id=b.gene_set_id """)))
+        con.executemany("INSERT OR IGNORE INTO gene_membership VALUES (upper(?), ?)", msigdb.execute("""
+            SELECT b.symbol, ab.gene_set_id
+                FROM gene_set_gene_symbol ab
+                    JOIN gene_symbol b ON b.id=ab.gene_symbol_id """))
+        con.execute("CREATE INDEX gene_set_name_key ON gene_set (name_key)")
+
+        if has_fts5_trigram(con):
+            con.executescript("""
+                CREATE VIRTUAL TABLE gene_set_text USING fts5(standard_name, description_brief,
+                    content='gene_set', content_rowid='id', tokenize='trigram');
+                INSERT INTO gene_set_text (gene_set_text) VALUES ('rebuild');
+            """)
+
+        con.execute("PRAGMA user_version=%d" % SEARCH_INDEX_VERSION)
+        con.commit()
+        con.execute("VACUUM")
+    finally:
+        con.close()
+
+    with open(os.path.join(tmp_dir, "manifest.json"), "w") as manifest_file:
+        json.dump({"version": SEARCH_INDEX_VERSION, "msigdb": msigdb_path}, manifest_file)
+
+    try:
+        os.replace(tmp_dir, index_dir)
+    except OSError:
+        # Another process has already built the same index
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+# Evict the least recently used search indexes beyond the cache size cap, except the given one
+# The single file indexes of the previous layout are removed too
+def evict_indexes(index_dir):
+    # Imported here, since the searches don't need numpy and pandas
+    from result_store import evict_results
+
+    try:
+        evict_results(SEARCH_INDEX_DIR, SEARCH_INDEX_MB, keep=(os.path.basename(index_dir),))
+        for entry in os.scandir(SEARCH_INDEX_DIR):
+            if entry.is_file() and entry.name.endswith(".db"):
+                os.remove(entry.path)
+    except OSError:
+        pass
+
+# Return the read-only connection to the search index of the given MSigDB file, building it just if it
+# isn't built yet, and opening it again whenever the MSigDB file is replaced
+def open_index(msigdb_path):
+    msigdb_path = os.path.realpath(msigdb_path)
+
+    # The MSigDB file is opened first, since the first time its covering indexes are created (see
+    # gene_set_info.py), changing its modification time
+    gene_set_info.open_msigdb(msigdb_path)
+    msigdb_key = gene_set_info.msigdb_key(msigdb_path)
+
+    key, con = connections.get(msigdb_path, (None, None))
+    if key != msigdb_key:
+        if con is not None:
+            con.close()
+
+        index_name = hashlib.sha256(repr(msigdb_key).encode()).hexdigest()
+        index_dir = os.path.join(SEARCH_INDEX_DIR, "%s_v%d" % (index_name, SEARCH_INDEX_VERSION))
+        index_path = os.path.join(index_dir, "index.db")
+        if not os.path.exists(index_path):
+            os.makedirs(SEARCH_INDEX_DIR, exist_ok=True)
+            build_index(msigdb_path, index_dir)
+            evict_indexes(index_dir)
+        else:
+            # The manifest modification time tracks the last access, used by the LRU eviction
+            try:
+                os.utime(os.path.join(index_dir, "manifest.json"))
+            except OSError:
+                pass
+
+        con = sqlite3.connect("file:%s?mode=ro&immutable=1" % pathname2url(index_path), uri=True, check_same_thread=False)
+        con.row_factory = gene_set_info.row_to_dict
+        connections[msigdb_path] = (msigdb_key, con)
+    return connections[msigdb_path][1]
+
+# Return the gene sets (standard name and brief description) matching the given query, at most limit of them
+#   name -> gene sets whose name starts with the query (case insensitive), in name order
+#   text -> gene sets whose name or brief description contains the query (case insensitive)
+#   gene -> gene sets containing the gene with the query as symbol (case insensitive), in name order
+def search_gene_sets(msigdb_path, query, by="name", limit=DEFAULT_LIMIT):
+    con = open_index(msigdb_path)
+    key = query.strip().upper()
+    columns = "SELECT a.standard_name, a.description_brief FROM gene_set a"
+
+    if by == "name":
+        # Prefix search as a range of the name index
+        return con.execute(columns + " WHERE a.name_key >= ? AND a.name_key < ? ORDER BY a.name_key LIMIT ?",
+                           (key, key + "\U0010ffff", limit)).fetchall()
+
+    if by == "gene":
+        return con.execute(columns + " JOIN gene_membership b ON b.gene_set_id=a.id WHERE b.symbol_key=? ORDER BY a.name_key LIMIT ?",
+                           (key, limit)).fetchall()
+
+    # The trigram index needs at least 3 characters, shorter queries (or without FTS5) scan the gene sets
+    has_text_index = con.execute("SELECT 1 FROM sqlite_master WHERE name='gene_set_text'").fetchone() is not None
+    if has_text_index and len(key) >= 3:
+        phrase = '"' + query.strip().replace('"', '""') + '"'
+        return con.execute(columns + " JOIN gene_set_text t ON t.rowid=a.id WHERE gene_set_text MATCH ? ORDER BY t.rank LIMIT ?",
+                           (phrase, limit)).fetchall()
+
+    pattern = "%" + key.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+    return con.execute(columns + " WHERE a.name_key LIKE ? ESCAPE '\\' OR upper(a.description_brief) LIKE ? ESCAPE '\\' LIMIT ?",
+                       (pattern, pattern, limit)).fetchall()
+
+# Search the gene sets of the MSigDB file in the given arguments (same order as the script call ones)
+# and print them as a JSON-formatted list
+def run_search_gene_sets(args):
+    positional = positional_args(args)
+    options = parse_options(args)
+
+    if len(positional) < 2:
+        errorAndExit("The MSigDB file and the query are needed to search the gene sets.")
+
+    msigdb_path, query = positional[0], positional[1]
+    by = options.get("by", "name")
+
+    if by not in SEARCH_MODES:
+        errorAndExit("The requested search mode doesn't exist.")
+
+    # Try to parse the maximum number of results
+    try:
+        limit = int(options.get("limit", str(DEFAULT_LIMIT)))
+    except ValueError:
+        errorAndExit("The maximum number of results must be an integer.")
+
+    try:
+        res = search_gene_sets(msigdb_path, query, by, limit)
+    except (OSError, sqlite3.Error):
+        errorAndExit('The MSigDB file (msigdb.db) couldn\'t be searched.')
+
+    # Print and flush the result on stdout
+    print(json.dumps(res))
+    sys.stdout.flush()
+
+if __name__ == "__main__":
+    run_search_gene_sets(sys.argv[1:])
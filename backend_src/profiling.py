@@ -0,0 +1,108 @@
+# Opt-in profiling of the backend scripts: time, peak memory and rows processed by each stage.
+#
+# The profiling is enabled through the GSEACOMPASS_PROFILE environment variable:
+#   unset, "", "0" or "false" -> disabled (default), the stages cost just a function call
+#   "1", "true" or "stderr"   -> a record per stage written on stderr
+#   any other value           -> path of the sidecar file the records are appended to
+# The backend worker can change it while it runs (see set_destination()).
+#
+# Each record is a JSON object written on its own line:
+#   {"profile": "stage", "command": <script or worker command>, "stage": <name>, "seconds": <float>,
+#    "rows": <items processed or null>, "peak_rss_mb": <peak resident memory of the process so far, null
+#    if not available>, "ok": <false if the stage failed>, "pid": <int>, "time": <ISO date of the end>}
+# The peak memory is the one of the whole process, so in a long-lived process it grows just with the stages
+# needing more memory than all the previous ones.
+#
+# Usage:
+#   with profiling.stage("parse-gct") as stage:
+#       expression_set = read_gct(expression_set_path)
+#       stage["rows"] = len(expression_set)
+import sys
+import os
+import os.path
+import json
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+# Return the destination of the records set by the given value ("stderr", a file path or None if disabled)
+def parse_destination(value):
+    value = (value or "").strip()
+    if value.lower() in ["", "0", "false"]:
+        return None
+    if value.lower() in ["1", "true", "stderr"]:
+        return "stderr"
+    return value
+
+# Destination of the records, None if the profiling is disabled
+destination = parse_destination(os.environ.get("GSEACOMPASS_PROFILE"))
+
+# Command the records of this process belong to, the script name by default
+command = os.path.splitext(os.path.basename(sys.argv[0]))[0] if sys.argv and sys.argv[0] else "python"
+
+# Set the destination of the records (same values of GSEACOMPASS_PROFILE) and return the previous one
+def set_destination(value):
+    global destination
+    old_destination = destination
+    destination = parse_destination(value)
+    return old_destination
+
+# Set the command the following records belong to (e.g. the request served by the backend worker)
+def set_command(name):
+    global command
+    command = name
+
+# Return the peak resident memory (MB) of this process so far, None if not available (e.g. on Windows)
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes elsewhere
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / (1 << 10)
+
+# Write the given record to the destination (if the profiling wasn't disabled meanwhile), a profiling
+# failure never stops the script
+def write_record(record):
+    if destination is None:
+        return
+
+    line = json.dumps(record) + "\n"
+    try:
+        if destination == "stderr":
+            sys.stderr.write(line)
+            sys.stderr.flush()
+        else:
+            directory = os.path.dirname(destination)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # Each record is written at once, so the records of different processes don't mix
+            with open(destination, "a") as profile_file:
+                profile_file.write(line)
+    except OSError:
+        pass
+
+# Time the stage with the given name, the rows processed can be given or set in the yielded dict
+@contextmanager
+def stage(name, rows=None):
+    record = {"rows": rows}
+    if destination is None:
+        yield record
+        return
+
+    ok = False
+    start_time = time.perf_counter()
+    try:
+        yield record
+        ok = True
+    finally:
+        write_record({"profile": "stage",
+                      "command": command,
+                      "stage": name,
+                      "seconds": time.perf_counter() - start_time,
+                      "rows": record["rows"],
+                      "peak_rss_mb": peak_rss_mb(),
+                      "ok": ok,
+                      "pid": os.getpid(),
+                      "time": datetime.now(timezone.utc).isoformat()})
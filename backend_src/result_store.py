@@ -0,0 +1,294 @@
+# Compact, structured storage of a GSEA/GSEA preranked result.
+#
+# Instead of pickling the whole python session, just the data needed by the plots is saved:
+#   manifest.json     -> format version, terms order, number of genes and phenotype labels
+#   term_fields.json  -> per term scalar fields (es, nes, pval, fdr, lead_genes, ...)
+#   res2d.json        -> results table, in pandas "split" orientation
+#   *.npy             -> ranking, per term RES/hits and heatmat arrays
+#   leading_edge*     -> leading-edge index, added on its first use (see leading_edge.py)
+#   term_tokens*      -> word counts of the text columns, added on their first use (see term_tokens.py)
+# The .npy arrays are memory-mapped on load, so a plot reads only the rows it needs.
+#
+# Each analysis run is stored in its own directory, named after its run ID, so several results
+# can be kept at the same time. The least recently used runs are evicted when the store
+# exceeds its disk quota.
+import os
+import os.path
+import re
+import json
+import shutil
+import uuid
+from collections.abc import Mapping
+
+import numpy as np
+import pandas as pd
+
+STORE_VERSION = 1
+
+# Directory in which the analysis results are stored, one sub-directory per run
+RESULT_STORE_DIR = os.path.join(os.path.expanduser("~"), "gseacompass_results")
+
+# Maximum disk space used by the stored results (MB), it can be set through the environment
+RESULT_STORE_QUOTA_MB = int(os.environ.get("GSEACOMPASS_RESULTS_QUOTA_MB", 2048))
+
+# Per term fields stored as arrays instead of plain JSON values
+ARRAY_FIELDS = ["hits", "RES"]
+
+# Utility function to convert numpy scalars into JSON-serializable python values
+def to_json_value(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+# Generate a new run ID
+def new_run_id():
+    return uuid.uuid4().hex
+
+# Return the directory of the given run, checking that the run ID is a plain name
+def run_dir(run_id):
+    if not re.fullmatch(r"[A-Za-z0-9_-]+", run_id):
+        raise ValueError("Invalid run ID: " + run_id)
+    return os.path.join(RESULT_STORE_DIR, run_id)
+
+# Return the size (bytes) of all files inside the given directory
+# The files deleted meanwhile (e.g. by another process evicting the directory) are skipped
+def dir_size(path):
+    size = 0
+    for entry in os.scandir(path):
+        try:
+            if entry.is_file():
+                size += entry.stat().st_size
+        except FileNotFoundError:
+            pass
+    return size
+
+# Delete the least recently used results stored inside the given directory (one sub-directory each)
+# until they fit in the given quota
+# The results whose name is in keep are never deleted
+# Other processes can evict the same directory at the same time, so the results deleted meanwhile are skipped
+def evict_results(root_dir, quota_mb, keep=()):
+    try:
+        entries = list(os.scandir(root_dir))
+    except FileNotFoundError:
+        return []
+
+    stored = []
+    for entry in entries:
+        # Skip partial results still being written and unrelated files
+        if ".tmp" in entry.name:
+            continue
+        try:
+            if entry.is_dir():
+                stored.append((os.stat(os.path.join(entry.path, "manifest.json")).st_mtime, entry.name, dir_size(entry.path)))
+        except FileNotFoundError:
+            pass
+
+    total_size = sum(size for _, _, size in stored)
+    evicted = []
+
+    # Oldest access first
+    for _, name, size in sorted(stored):
+        if total_size <= quota_mb * 1024 * 1024:
+            break
+        if name in keep:
+            continue
+        shutil.rmtree(os.path.join(root_dir, name), ignore_errors=True)
+        total_size -= size
+        evicted.append(name)
+
+    return evicted
+
+# Delete the least recently used runs until the store fits in the given quota
+# The runs whose ID is in keep are never deleted
+def evict_runs(quota_mb=RESULT_STORE_QUOTA_MB, keep=()):
+    return evict_results(RESULT_STORE_DIR, quota_mb, keep)
+
+# Save the given gseapy result object as the given run, replacing any result already stored for it
+# A failure of the eviction of the other runs doesn't fail the save
+def save_result(res, run_id):
+    write_result(res, run_dir(run_id))
+    try:
+        evict_runs(keep=(run_id,))
+    except OSError:
+        pass
+
+# Write the given result object in the given directory, replacing any result already there
+# An already stored result (StoredResult) is linked, or copied, instead of being written again
+def write_result(res, store_dir):
+    # Write everything in a temporary directory first, so that a reader never sees a partial result
+    tmp_dir = store_dir + ".tmp%d" % os.getpid()
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    if isinstance(res, StoredResult):
+        link_result(res.store_dir, tmp_dir)
+    else:
+        serialize_result(res, tmp_dir)
+
+    shutil.rmtree(store_dir, ignore_errors=True)
+    os.replace(tmp_dir, store_dir)
+
+# Hard link (or copy, if not possible) the files of a stored result into the given new directory
+# The stored files are never modified, just replaced, so sharing them is safe
+# The manifest is copied instead, since its modification time tracks the last access of each directory
+def link_result(source_dir, target_dir):
+    os.makedirs(target_dir)
+    for entry in os.scandir(source_dir):
+        target_path = os.path.join(target_dir, entry.name)
+        if entry.name == "manifest.json":
+            shutil.copyfile(entry.path, target_path)
+            continue
+        try:
+            os.link(entry.path, target_path)
+        except OSError:
+            shutil.copy2(entry.path, target_path)
+
+# Serialize the given gseapy result object into the given new directory
+def serialize_result(res, tmp_dir):
+    os.makedirs(tmp_dir)
+
+    terms = list(res.results.keys())
+    term_fields = {}
+    hits_offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    all_hits = []
+
+    ranking = np.asarray(res.ranking, dtype=np.float64)
+    running_es = np.lib.format.open_memmap(os.path.join(tmp_dir, "RES.npy"), mode="w+", dtype=np.float32, shape=(len(terms), len(ranking)))
+
+    for i, term in enumerate(terms):
+        result = res.results[term]
+        term_fields[term] = {k: to_json_value(v) for k, v in result.items() if k not in ARRAY_FIELDS}
+
+        hits = np.asarray(result["hits"], dtype=np.int32)
+        all_hits.append(hits)
+        hits_offsets[i + 1] = hits_offsets[i] + len(hits)
+        running_es[i] = result["RES"]
+
+    running_es.flush()
+    del running_es
+
+    np.save(os.path.join(tmp_dir, "hits.npy"), np.concatenate(all_hits) if all_hits else np.zeros(0, dtype=np.int32))
+    np.save(os.path.join(tmp_dir, "hits_offsets.npy"), hits_offsets)
+    np.save(os.path.join(tmp_dir, "ranking.npy"), ranking)
+    np.save(os.path.join(tmp_dir, "ranking_genes.npy"), np.asarray(res.ranking.index, dtype=str))
+
+    # The heatmat is available just for the GSEA (phenotype permutation) results
+    heatmat = getattr(res, "heatmat", None)
+    heatmat_samples = None
+    if heatmat is not None:
+        np.save(os.path.join(tmp_dir, "heatmat.npy"), heatmat.to_numpy(dtype=np.float64))
+        np.save(os.path.join(tmp_dir, "heatmat_genes.npy"), np.asarray(heatmat.index, dtype=str))
+        heatmat_samples = [str(c) for c in heatmat.columns]
+
+    res.res2d.to_json(os.path.join(tmp_dir, "res2d.json"), orient="split", index=False)
+
+    with open(os.path.join(tmp_dir, "term_fields.json"), "w") as term_fields_file:
+        json.dump(term_fields, term_fields_file)
+
+    manifest = {
+        "version": STORE_VERSION,
+        "terms": terms,
+        "num_genes": len(ranking),
+        "heatmat_samples": heatmat_samples,
+        "pheno_pos": to_json_value(getattr(res, "pheno_pos", "")),
+        "pheno_neg": to_json_value(getattr(res, "pheno_neg", "")),
+    }
+    with open(os.path.join(tmp_dir, "manifest.json"), "w") as manifest_file:
+        json.dump(manifest, manifest_file)
+
+# Read-only view of the per term results of a stored result, compatible with gseapy res.results
+# The term fields are read on first access and the RES/hits arrays are memory-mapped
+class StoredTermResults(Mapping):
+    def __init__(self, store_dir, terms):
+        self._store_dir = store_dir
+        self._terms = {term: i for i, term in enumerate(terms)}
+        self._fields = None
+        self._running_es = None
+        self._hits = None
+        self._hits_offsets = None
+
+    def _load_arrays(self):
+        if self._running_es is None:
+            self._running_es = np.load(os.path.join(self._store_dir, "RES.npy"), mmap_mode="r")
+            self._hits = np.load(os.path.join(self._store_dir, "hits.npy"), mmap_mode="r")
+            self._hits_offsets = np.load(os.path.join(self._store_dir, "hits_offsets.npy"))
+
+    def fields(self, term):
+        if self._fields is None:
+            with open(os.path.join(self._store_dir, "term_fields.json"), "r") as term_fields_file:
+                self._fields = json.load(term_fields_file)
+        return self._fields[term]
+
+    def hits(self, term):
+        self._load_arrays()
+        i = self._terms[term]
+        return self._hits[self._hits_offsets[i]:self._hits_offsets[i + 1]].tolist()
+
+    def running_es(self, term):
+        self._load_arrays()
+        return np.asarray(self._running_es[self._terms[term]], dtype=np.float64)
+
+    def __getitem__(self, term):
+        if term not in self._terms:
+            raise KeyError(term)
+        result = dict(self.fields(term))
+        result["hits"] = self.hits(term)
+        result["RES"] = self.running_es(term)
+        return result
+
+    def __iter__(self):
+        return iter(self._terms)
+
+    def __len__(self):
+        return len(self._terms)
+
+    def __contains__(self, term):
+        return term in self._terms
+
+# Stored result, exposing the same attributes of the gseapy result objects used by the plots
+# (res2d, results, ranking, heatmat), each one loaded just when first accessed
+class StoredResult:
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+
+        manifest_path = os.path.join(self.store_dir, "manifest.json")
+        with open(manifest_path, "r") as manifest_file:
+            self.manifest = json.load(manifest_file)
+
+        # The manifest modification time tracks the last access, used by the LRU eviction
+        os.utime(manifest_path)
+
+        if self.manifest["version"] != STORE_VERSION:
+            raise ValueError("Unsupported result store version: " + str(self.manifest["version"]))
+
+        self.pheno_pos = self.manifest["pheno_pos"]
+        self.pheno_neg = self.manifest["pheno_neg"]
+        self.results = StoredTermResults(self.store_dir, self.manifest["terms"])
+        self._res2d = None
+        self._ranking = None
+        self._heatmat = None
+
+    @property
+    def res2d(self):
+        if self._res2d is None:
+            self._res2d = pd.read_json(os.path.join(self.store_dir, "res2d.json"), orient="split", dtype=False, convert_dates=False)
+        return self._res2d
+
+    @property
+    def ranking(self):
+        if self._ranking is None:
+            values = np.load(os.path.join(self.store_dir, "ranking.npy"), mmap_mode="r")
+            genes = np.load(os.path.join(self.store_dir, "ranking_genes.npy"), mmap_mode="r")
+            self._ranking = pd.Series(values, index=genes)
+        return self._ranking
+
+    @property
+    def heatmat(self):
+        if self._heatmat is None and self.manifest["heatmat_samples"] is not None:
+            values = np.load(os.path.join(self.store_dir, "heatmat.npy"), mmap_mode="r")
+            genes = np.load(os.path.join(self.store_dir, "heatmat_genes.npy"), mmap_mode="r")
+            self._heatmat = pd.DataFrame(values, index=genes, columns=self.manifest["heatmat_samples"])
+        return self._heatmat
+
+# Load the result stored for the given run
+def load_result(run_id):
+    return StoredResult(run_dir(run_id))
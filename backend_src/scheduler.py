@@ -0,0 +1,85 @@
+# Scheduling of the analysis permutations on a pool of processes.
+#
+# The permutations are split in shards of fixed size, each one with its own random generator seeded
+# from the analysis seed and the shard index. The shards are then spread over the processes, so the
+# results are the same whatever the number of processes used.
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+# Number of permutations of each shard
+SHARD_SIZE = 100
+
+# Return the number of cores available to this process
+def available_cores():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+# Return the number of processes to use for the requested number of threads (0 means all the available cores)
+def num_processes(threads):
+    if threads <= 0:
+        return available_cores()
+    return threads
+
+# Split the given number of permutations in shards, returning a list of (shard index, number of permutations)
+def make_shards(num_permutation, shard_size=SHARD_SIZE):
+    return [(i, min(shard_size, num_permutation - start)) for i, start in enumerate(range(0, num_permutation, shard_size))]
+
+# Random generator of the given shard, derived from the analysis seed
+def shard_rng(seed, shard_index):
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(shard_index,)))
+
+# State shared by all the shards computed by a process: the shard function and its fixed arguments
+shard_state = {}
+
+def init_shard_process(func, args):
+    shard_state["func"] = func
+    shard_state["args"] = args
+
+# Compute a shard, calling the shard function with the fixed arguments, the number of permutations and
+# the shard random generator
+def run_shard(shard_index, num_permutation, seed):
+    start_time = time.perf_counter()
+    value = shard_state["func"](*shard_state["args"], num_permutation, shard_rng(seed, shard_index))
+    timing = {
+        "shard": shard_index,
+        "permutations": num_permutation,
+        "seconds": time.perf_counter() - start_time,
+        "pid": os.getpid(),
+    }
+    return value, timing
+
+# Compute func(*args, shard permutations, shard random generator) for each of the given shards
+# (see make_shards()), using the given number of processes
+# If given, on_shard_done(timing) is called as soon as each shard is completed
+# Return the list of the shard values (in shard order) and the list of the shard timings
+def run_sharded(func, args, shards, seed, processes, on_shard_done=None):
+    processes = min(processes, len(shards))
+    outputs = {}
+
+    if processes <= 1:
+        init_shard_process(func, args)
+        for i, n in shards:
+            outputs[i] = run_shard(i, n, seed)
+            if on_shard_done is not None:
+                on_shard_done(outputs[i][1])
+        shard_state.clear()
+    else:
+        with ProcessPoolExecutor(max_workers=processes, initializer=init_shard_process, initargs=(func, args)) as pool:
+            futures = [pool.submit(run_shard, i, n, seed) for i, n in shards]
+            for future in as_completed(futures):
+                value, timing = future.result()
+                outputs[timing["shard"]] = (value, timing)
+                if on_shard_done is not None:
+                    on_shard_done(timing)
+
+    outputs = [outputs[i] for i, _ in shards]
+    return [value for value, _ in outputs], [timing for _, timing in outputs]
+
+# Format the shard timings, one line per shard
+def format_timings(timings):
+    return "\n".join("Shard %d: %d permutations in %.3f s (process %d)" % (t["shard"], t["permutations"], t["seconds"], t["pid"]) for t in timings)
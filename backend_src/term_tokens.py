@@ -0,0 +1,152 @@
+# Word frequencies of the text columns of the results table (gene set names and leading-edge genes),
+# used by the wordclouds.
+#
+# Each text column is tokenized once per run, the same way the wordclouds did on the whole selected text
+# ("_", ";" and "," as separators, "'s" endings, numbers and stopwords dropped, case variants and plurals
+# merged), and stored next to the result (see result_store.py) as a sparse (gene sets x words) count matrix:
+#   term_tokens.json             -> format version, columns tokenized
+#   term_tokens_terms.npy        -> gene set names, in results table order
+#   term_tokens_<column>_*.npy   -> words, CSR index pointers, word IDs and counts of each gene set
+# So the word frequencies of any subset of the gene sets are the sum of its rows, with no text to pass around
+# and tokenize again at each request.
+import os
+import os.path
+import re
+import json
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from result_store import load_result, StoredResult
+import profiling
+
+TERM_TOKENS_VERSION = 1
+
+# Columns of the results table that can be tokenized, by name of their files
+TOKENIZED_COLUMNS = {"Term": "term", "Lead_genes": "lead_genes"}
+
+# Words of a text (as the default wordcloud tokenizer)
+WORD_PATTERN = re.compile(r"\w[\w']*")
+
+# Word frequencies already loaded by this process, by (result directory, manifest inode)
+term_tokens = {}
+
+# Return the path of the given file of the given column (None for the gene set names) of the given result directory
+def tokens_path(store_dir, column, name):
+    if column is None:
+        return os.path.join(store_dir, "term_tokens_%s.npy" % name)
+    return os.path.join(store_dir, "term_tokens_%s_%s.npy" % (TOKENIZED_COLUMNS[column], name))
+
+# Write the given array in the given path, under a temporary name first
+def save_array(path, array):
+    tmp_path = path + ".tmp%d" % os.getpid()
+    with open(tmp_path, "wb") as array_file:
+        np.save(array_file, array)
+    os.replace(tmp_path, path)
+
+# Return the words of the given text, with the wordcloud separators, "'s" endings and numbers dropped
+def tokenize(text):
+    words = WORD_PATTERN.findall(text.replace("_", " ").replace(";", " ").replace(",", " "))
+    words = [word[:-2] if word.lower().endswith("'s") else word for word in words]
+    return [word for word in words if not word.isdigit()]
+
+# Return the word of each of the given (lower case) words, merging the plurals whose singular is there too,
+# and the display form of each word (the most common case variant)
+def merge_words(keys, variants):
+    merged = {key: key[:-1] if key.endswith("s") and not key.endswith("ss") and key[:-1] in variants else key for key in variants}
+    display = {key: variants[key].most_common(1)[0][0] for key in variants}
+    return [merged[key] for key in keys], display
+
+# Tokenize the given column of the given result, returning the words and the (gene sets x words) count matrix
+def tokenize_column(res, column):
+    # Imported here, since just the stopwords list is needed
+    from wordcloud import STOPWORDS
+
+    stopwords = {word.lower() for word in STOPWORDS}
+    texts = res.res2d[column].fillna("").astype(str)
+
+    rows = []
+    keys = []
+    variants = {}
+    for i, text in enumerate(texts):
+        for word in tokenize(text):
+            key = word.lower()
+            if key not in stopwords:
+                rows.append(i)
+                keys.append(key)
+                variants.setdefault(key, Counter())[word] += 1
+
+    keys, display = merge_words(keys, variants)
+    word_ids, words = pd.factorize(np.asarray(keys, dtype=object))
+    counts = sparse.csr_matrix((np.ones(len(word_ids), dtype=np.int32), (np.asarray(rows, dtype=np.int64), word_ids)),
+                               shape=(len(texts), len(words)))
+    counts.sum_duplicates()
+    return np.asarray([display[w] for w in words], dtype=str), counts
+
+# Tokenize the text columns of the given stored result and write their word counts in its directory
+def build_tokens(res):
+    columns = [column for column in TOKENIZED_COLUMNS if column in res.res2d.columns]
+
+    # The JSON file, written last, marks the arrays complete
+    save_array(tokens_path(res.store_dir, None, "terms"), res.res2d["Term"].astype(str).to_numpy().astype(str))
+    for column in columns:
+        words, counts = tokenize_column(res, column)
+        arrays = {"words": words, "indptr": counts.indptr.astype(np.int64), "indices": counts.indices, "counts": counts.data}
+        for name, array in arrays.items():
+            save_array(tokens_path(res.store_dir, column, name), array)
+
+    tmp_path = os.path.join(res.store_dir, "term_tokens.json.tmp%d" % os.getpid())
+    with open(tmp_path, "w") as tokens_file:
+        json.dump({"version": TERM_TOKENS_VERSION, "columns": columns}, tokens_file)
+    os.replace(tmp_path, os.path.join(res.store_dir, "term_tokens.json"))
+
+# Word counts of the text columns of a stored result
+class TermTokens:
+    def __init__(self, store_dir):
+        with open(os.path.join(store_dir, "term_tokens.json"), "r") as tokens_file:
+            info = json.load(tokens_file)
+
+        if info["version"] != TERM_TOKENS_VERSION:
+            raise ValueError("Unsupported term tokens version: " + str(info["version"]))
+
+        self.terms = pd.Index(np.load(tokens_path(store_dir, None, "terms")))
+
+        self.words = {}
+        self.counts = {}
+        for column in info["columns"]:
+            self.words[column] = np.load(tokens_path(store_dir, column, "words"))
+            indptr, indices, counts = (np.load(tokens_path(store_dir, column, name)) for name in ["indptr", "indices", "counts"])
+            self.counts[column] = sparse.csr_matrix((counts, indices, indptr), shape=(len(indptr) - 1, len(self.words[column])))
+
+    # Return the word frequencies (word -> count) of the given column over the given terms (all if None)
+    # Raise KeyError if the column isn't tokenized or any of the terms isn't in the results
+    def frequencies(self, column, terms=None):
+        counts = self.counts[column]
+        if terms is not None:
+            rows = self.terms.get_indexer(pd.Index(terms))
+            if (rows < 0).any():
+                raise KeyError(terms[int(np.argmax(rows < 0))])
+            counts = counts[rows]
+
+        totals = np.asarray(counts.sum(axis=0)).ravel()
+        present = np.flatnonzero(totals)
+        return dict(zip(self.words[column][present].tolist(), totals[present].tolist()))
+
+# Return the word counts of the given result of the given run, tokenizing it just if it isn't tokenized yet
+# The word counts are stored with the result, so a result still in memory is read from the result store
+def load_term_tokens(res, run_id=None):
+    if not isinstance(res, StoredResult):
+        res = load_result(run_id)
+
+    key = (res.store_dir, os.stat(os.path.join(res.store_dir, "manifest.json")).st_ino)
+    if key not in term_tokens:
+        try:
+            tokens = TermTokens(res.store_dir)
+        except (OSError, ValueError, KeyError):
+            with profiling.stage("build-term-tokens", rows=len(res.res2d)):
+                build_tokens(res)
+            tokens = TermTokens(res.store_dir)
+        term_tokens[key] = tokens
+    return term_tokens[key]
@@ -0,0 +1,63 @@
+# Shape-preserving downsampling of the traces of the enrichment plots (running enrichment scores and
+# ranked metric), drawing a few points per pixel column instead of one point per gene.
+#
+# The traces are split in buckets, one per pixel column of the plot at the given resolution, and just
+# the first, last, minimum and maximum point of each bucket are kept (min/max decimation). So every peak,
+# the enrichment score one included, keeps its exact position and value, the axes limits don't change
+# and a line through the kept points covers the same pixels of the full one. The hits are drawn as they are.
+#
+# The traces are downsampled after the plot axes are drawn, by replacing the data of their artists.
+import os
+
+import numpy as np
+
+# Resolution (dots per inch) the traces are downsampled to, the same of the saved plots
+# It can be set through the environment, 0 to always draw the full traces
+TRACE_DPI = int(os.environ.get("GSEACOMPASS_TRACE_DPI", 300))
+
+# Return the number of buckets (pixel columns) of a plot of the given width (inches) at the given resolution,
+# 0 (no downsampling) if the resolution is 0
+def trace_buckets(width_inches, dpi=TRACE_DPI):
+    if dpi <= 0:
+        return 0
+    return max(1, int(width_inches * dpi))
+
+# Return the sorted positions of the points of the given trace kept with the given number of buckets
+# (all of them if the buckets are 0 or the trace is already short enough)
+def downsample_indices(values, buckets):
+    values = np.asarray(values, dtype=np.float64)
+    n = len(values)
+    if buckets <= 0 or n <= 4 * buckets:
+        return np.arange(n)
+
+    # Buckets of the same size, the last one padded with the last value
+    size = -(-n // buckets)
+    buckets = -(-n // size)
+    padded = np.empty(buckets * size)
+    padded[:n] = values
+    padded[n:] = values[-1]
+    padded = padded.reshape(buckets, size)
+
+    starts = np.arange(buckets) * size
+    kept = np.concatenate([starts,
+                           starts + padded.argmin(axis=1),
+                           starts + padded.argmax(axis=1),
+                           starts + size - 1])
+    return np.unique(np.minimum(kept, n - 1))
+
+# Downsample the lines of the given axes (e.g. the running enrichment scores) with the given number of buckets
+def downsample_lines(ax, buckets):
+    for line in ax.lines:
+        x, y = (np.asarray(data) for data in line.get_data())
+        kept = downsample_indices(y, buckets)
+        if len(kept) < len(y):
+            line.set_data(x[kept], y[kept])
+
+# Downsample the given area filled between the given values (e.g. the ranked metric, drawn at positions 0..n-1)
+# and 0, with the given number of buckets
+def downsample_fill(fill, values, buckets):
+    values = np.asarray(values, dtype=np.float64)
+    kept = downsample_indices(values, buckets)
+    if len(kept) < len(values):
+        outline = np.column_stack([kept, values[kept]])
+        fill.set_verts([np.concatenate([[(kept[0], 0)], outline, [(kept[-1], 0)]])])
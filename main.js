@@ -1,6 +1,8 @@
 import { app, BrowserWindow, ipcMain, dialog, Menu, shell } from 'electron'
 import { spawn } from 'child_process'
-import { writeFileSync, existsSync, unlink, copyFile, mkdirSync } from 'fs'
+import { randomUUID } from 'crypto'
+import { createInterface } from 'readline'
+import { writeFileSync, readFileSync, existsSync, unlink, copyFile, mkdirSync } from 'fs'
 import { join } from 'node:path'
 import logPkg from 'electron-log/main.js'
 const { error, transports } = logPkg
@@ -26,33 +28,20 @@ const PLOT_PATH = join(HOME_DIR, 'gsea_plot')
 // Plot standard extensions
 const plotExtensions = ['.png', '.pdf', '.svg']
 
-// Utility function that collects the stderr output, shows a failure popup in case the passed
-// process returns a code different from 0 (unexpected exit) and logs it in a file
-const popupOnProcessFail = (process) => {
-    let stderrContent = ''
-    let stdoutContent = ''
-
-    process.stderr.on('data', (data) => {
-        stderrContent += data
-    })
-
-    process.stdout.on('data', (data) => {
-        stdoutContent += data
-    })
-
-    process.on('exit', (code) => {
-        if (code !== 0) {
-            dialog.showMessageBox({
-                message: stdoutContent != ''
-                    ? stdoutContent
-                    : stderrContent,
-                type: 'error',
-                title: 'Failure'
-            })
+// Utility function that shows a failure popup in case the passed backend response
+// has a code different from 0 (unexpected exit) and logs it in a file
+const popupOnBackendFail = (response) => {
+    if (response.code !== 0) {
+        dialog.showMessageBox({
+            message: response.stdout != ''
+                ? response.stdout
+                : response.stderr,
+            type: 'error',
+            title: 'Failure'
+        })
 
-            error('\n========================\nError description: ' + stdoutContent + '\nStderr trace:\n' + stderrContent + '\n========================\n')
-        }
-    })
+        error('\n========================\nError description: ' + response.stdout + '\nStderr trace:\n' + response.stderr + '\n========================\n')
+    }
 }
 
 // Utility function that return a local path
@@ -103,7 +92,84 @@ const LOG_FILE_NAME = 'gseacompass_error_' + currentDate
 transports.file.resolvePathFn = () => join(HOME_DIR, 'GSEACompass_log', LOG_FILE_NAME)
 transports.file.level = 'error'
 
-globalThis.chosenGeneSetsPath = ''
+// Sidecar file the backend stage timings are written to while the profiling is enabled (see backend_src/profiling.py)
+const PROFILE_PATH = join(HOME_DIR, 'GSEACompass_log', 'profile.jsonl')
+
+// Whether the backend records its stage timings, enabled from the Diagnostics menu or by starting
+// the app with the GSEACOMPASS_PROFILE environment variable set
+let profilingEnabled = !['', '0', 'false'].includes((process.env.GSEACOMPASS_PROFILE ?? '').trim().toLowerCase())
+
+// Gene sets file path of each analysis run, by run ID
+const runGeneSetsPaths = new Map()
+
+// Function that generates the ID of a new analysis run, used to store and retrieve its results
+const newRunId = () => randomUUID().replaceAll('-', '')
+
+// Long-lived python backend worker, it serves all analysis, plot and gene set info requests
+// so that python libraries are loaded just once and results are kept in memory between requests
+// The analyses and the bulk exports run in its child processes, so their responses may come after later requests ones
+let backendWorker = null
+let backendRequestId = 0
+// Pending requests by ID, each one with the resolve function of its promise and its events callback
+const backendPendingRequests = new Map()
+
+// Function that starts the backend worker and dispatches its responses to the pending requests
+const startBackendWorker = () => {
+    let workerProcess = null
+    const workerEnv = { ...process.env, GSEACOMPASS_PROFILE: profilingEnabled ? PROFILE_PATH : '' }
+
+    if (app.isPackaged)
+        workerProcess = spawn(localPath('pythonBin', 'backend_worker'), [], { env: workerEnv })
+    else
+        workerProcess = spawn('python', [localPath('python', 'backend_worker')], { env: workerEnv })
+
+    let stderrContent = ''
+
+    workerProcess.stderr.on('data', (data) => {
+        stderrContent += data
+    })
+
+    // Each line written on stdout is the JSON-formatted response of a request
+    createInterface({ input: workerProcess.stdout }).on('line', (line) => {
+        const message = JSON.parse(line)
+        const request = backendPendingRequests.get(message.id)
+
+        // The events are sent while the request is being served, the response once it's completed
+        if (message.event !== undefined) {
+            request?.onEvent?.(message.event)
+            return
+        }
+
+        backendPendingRequests.delete(message.id)
+        request?.resolve(message)
+    })
+
+    // If the worker dies, fail all its pending requests, a new one will be started on the next request
+    workerProcess.on('exit', () => {
+        backendPendingRequests.forEach((request) => request.resolve({ code: 1, stdout: '', stderr: stderrContent }))
+        backendPendingRequests.clear()
+
+        if (backendWorker === workerProcess)
+            backendWorker = null
+    })
+
+    return workerProcess
+}
+
+// Function that sends a command to the backend worker
+// It returns a promise resolved with the command response (code, stdout and stderr), while the
+// events emitted by the command (see backend_src/analysis_events.py) are passed to onEvent
+const runBackend = (command, args, onEvent) => {
+    if (backendWorker === null)
+        backendWorker = startBackendWorker()
+
+    const id = backendRequestId++
+
+    return new Promise((resolve) => {
+        backendPendingRequests.set(id, { resolve: resolve, onEvent: onEvent })
+        backendWorker.stdin.write(JSON.stringify({ id: id, command: command, args: args.map(String) }) + '\n')
+    })
+}
 
 // Function that creates the home window
 const createMainWindow = () => {
@@ -141,36 +207,28 @@ const createGseaWindow = () => {
     })
 
     // Message sent by the GseaWindow renderer when a GSEA analysis has been requested
-    ipcMain.on('send-data-gsea', (_event, geneSetsPath, numPermutations,minGeneSet,maxGeneSet, expressionSet, phenotypeLabels, remapOption, chipPath) => {
-        let pythonProcess = null
+    ipcMain.on('send-data-gsea', (_event, geneSetsPath, numPermutations,minGeneSet,maxGeneSet, expressionSet, phenotypeLabels, remapOption, chipPath, numThreads, adaptive) => {
+        const runId = newRunId()
 
         // Show the loading animation web page
         gseaWindow.loadFile(localPath('web', 'loading'))
 
-        if (app.isPackaged)
-            pythonProcess = spawn(localPath('pythonBin', 'gsea'), [geneSetsPath, numPermutations, minGeneSet, maxGeneSet, expressionSet, phenotypeLabels, remapOption, chipPath])
-        else
-            pythonProcess = spawn('python', [localPath('python', 'gsea'), geneSetsPath, numPermutations, minGeneSet, maxGeneSet,expressionSet, phenotypeLabels, remapOption, chipPath])
+        const analysisRun = trackAnalysisRun(gseaWindow, 'gsea', runId)
 
-        let jsonContent = ''
+        runBackend('gsea', [geneSetsPath, numPermutations, minGeneSet, maxGeneSet, expressionSet, phenotypeLabels, remapOption, chipPath, runId, `threads=${numThreads}`, `adaptive=${adaptive}`], analysisRun.onEvent).then((response) => {
+            analysisRun.onCompleted(response)
 
-        pythonProcess.stdout.on('data', (data) => {
-            jsonContent += data
-        })
-
-        pythonProcess.on('exit', (code) => {
-            if (code === 0) {
-                globalThis.chosenGeneSetsPath = geneSetsPath
-                createTableWindow(jsonContent, 'gsea')
+            if (response.code === 0) {
+                runGeneSetsPaths.set(runId, geneSetsPath)
                 gseaWindow.close()
             }
             // In case of error show the GSEA web page
             else {
                 gseaWindow.loadFile(localPath('web', 'gsea'))
             }
-        })
 
-        popupOnProcessFail(pythonProcess)
+            popupOnBackendFail(response)
+        })
     })
 
     // Request from the GseaWindow renderer to show an helper popup
@@ -197,27 +255,19 @@ const createGseaPrerankedWindow = () => {
     })
 
     // Message sent by the GseaPrerankedWindow renderer when a preranked analysis has been requested
-    ipcMain.on('send-data-preranked', (_event, geneSetsPath, numPermutations, minGeneSet, maxGeneSet, rankedListPath, remapOption, chipPath) => {
-        let pythonProcess = null
+    ipcMain.on('send-data-preranked', (_event, geneSetsPath, numPermutations, minGeneSet, maxGeneSet, rankedListPath, remapOption, chipPath, numThreads) => {
+        const runId = newRunId()
 
         // Show the loading animation web page
         gseaPrerankedWindow.loadFile(localPath('web', 'loading'))
 
-        if (app.isPackaged)
-            pythonProcess = spawn(localPath('pythonBin', 'gsea_preranked'), [geneSetsPath, numPermutations, minGeneSet, maxGeneSet, rankedListPath, remapOption, chipPath])
-        else
-            pythonProcess = spawn('python', [localPath('python', 'gsea_preranked'), geneSetsPath, numPermutations, minGeneSet, maxGeneSet, rankedListPath, remapOption, chipPath])
-
-        let jsonContent = ''
+        const analysisRun = trackAnalysisRun(gseaPrerankedWindow, 'gsea_preranked', runId)
 
-        pythonProcess.stdout.on('data', (data) => {
-            jsonContent += data
-        })
+        runBackend('gsea-preranked', [geneSetsPath, numPermutations, minGeneSet, maxGeneSet, rankedListPath, remapOption, chipPath, runId, `threads=${numThreads}`], analysisRun.onEvent).then((response) => {
+            analysisRun.onCompleted(response)
 
-        pythonProcess.on('exit', (code) => {
-            if (code === 0) {
-                globalThis.chosenGeneSetsPath = geneSetsPath
-                createTableWindow(jsonContent, 'gsea_preranked')
+            if (response.code === 0) {
+                runGeneSetsPaths.set(runId, geneSetsPath)
                 gseaPrerankedWindow.close()
             }
             // In case of error
@@ -225,9 +275,9 @@ const createGseaPrerankedWindow = () => {
                 // Show the GSEA web page
                 gseaPrerankedWindow.loadFile(localPath('web', 'gsea_preranked'))
             }
-        })
 
-        popupOnProcessFail(pythonProcess)
+            popupOnBackendFail(response)
+        })
     })
 
     // Request from the GseaPrerankedWindow renderer to show an helper popup
@@ -242,8 +292,9 @@ const createGseaPrerankedWindow = () => {
     gseaPrerankedWindow.loadFile(localPath('web', 'gsea_preranked'))
 }
 
-// Function that creates and handles the data table window
-const createTableWindow = (jsonRawData, analysisType) => {
+// Function that creates the data table window of the given analysis run
+// The table starts empty, its rows are sent as soon as they are available (see trackAnalysisRun)
+const createTableWindow = (analysisType, runId) => {
     const tableWindow = new BrowserWindow({
         width: 800,
         height: 600,
@@ -254,31 +305,101 @@ const createTableWindow = (jsonRawData, analysisType) => {
     })
 
     tableWindow.webContents.on('did-finish-load', () => {
-        tableWindow.webContents.send('send-analysis-data', jsonRawData, analysisType)
+        tableWindow.webContents.send('send-analysis-data', analysisType, runId)
     })
 
-    ipcMain.on('request-enrichment-plot', (_event, selectedTerms, sizeX, sizeY, measurementUnit, createOrUpdate) => {
-        let pythonProcess = null
+    tableWindow.maximize()
+
+    tableWindow.loadFile(localPath('web', 'table'))
+
+    return tableWindow
+}
+
+// Function that follows the events of an analysis run: the progress is shown by the analysis window
+// (loading web page), while the results table window is opened as soon as the first results arrive
+// and then filled as the following ones arrive, without waiting for the analysis to complete
+// It returns the events callback and the function to call with the final response
+const trackAnalysisRun = (analysisWindow, analysisType, runId) => {
+    let tableWindow = null
+    let tableLoaded = false
+    let pendingRows = []
+
+    // Send the rows received since the last call to the table window, opening it the first time
+    const sendPendingRows = () => {
+        if (pendingRows.length === 0)
+            return
+
+        if (tableWindow === null) {
+            tableWindow = createTableWindow(analysisType, runId)
+            tableWindow.webContents.on('did-finish-load', () => {
+                tableLoaded = true
+                sendPendingRows()
+            })
+        }
+        else if (tableLoaded && !tableWindow.isDestroyed()) {
+            tableWindow.webContents.send('send-analysis-rows', pendingRows)
+            pendingRows = []
+        }
+    }
+
+    const onEvent = (event) => {
+        // The result rows are sent in batches, on the next event of another type
+        if (event.event === 'result') {
+            pendingRows.push({ ...event.row, final: event.final })
+            return
+        }
+
+        sendPendingRows()
+
+        if (!analysisWindow.isDestroyed())
+            analysisWindow.webContents.send('analysis-event', event)
+    }
+
+    const onCompleted = (response) => {
+        if (response.code === 0)
+            sendPendingRows()
+        // In case of error, the partial results are discarded
+        else if (tableWindow !== null && !tableWindow.isDestroyed())
+            tableWindow.close()
+    }
+
+    return { onEvent: onEvent, onCompleted: onCompleted }
+}
+
+// Backend arguments of the plot shown by each plot window, by ID of its web contents, so that each window
+// exports its own plot whatever the plots generated meanwhile
+const plotWindowPlots = new Map()
 
-        if (app.isPackaged)
-            pythonProcess = spawn(localPath('pythonBin', 'gsea_plot'), ['enrichment-plot', selectedTerms, sizeX, sizeY, measurementUnit])
-        else
-            pythonProcess = spawn('python', [localPath('python', 'gsea_plot'), 'enrichment-plot', selectedTerms, sizeX, sizeY, measurementUnit])
+// Function that records the given plot ({ args, selectedData }) as the one shown by the plot window just
+// created (create) or by the plot window that requested it (update)
+const rememberPlot = (event, createOrUpdate, plot) => {
+    const webContents = createOrUpdate == 'create' ? globalThis.plotWindow?.webContents : event.sender
+    if (webContents !== undefined)
+        plotWindowPlots.set(webContents.id, plot)
+}
+
+// Function that registers the handlers of the requests sent by the data table windows
+// Each request carries the ID of the analysis run it refers to
+const registerTableHandlers = () => {
+    ipcMain.on('request-enrichment-plot', (event, runId, selectedTerms, sizeX, sizeY, measurementUnit, createOrUpdate) => {
+        const plotArgs = [runId, 'enrichment-plot', selectedTerms, sizeX, sizeY, measurementUnit]
 
-        pythonProcess.on('exit', (code) => {
-            if (code == 0) {
+        runBackend('plot', plotArgs).then((response) => {
+            if (response.code == 0) {
                 if (createOrUpdate == 'create')
-                    createPlotWindow(800, 600, 'enrichment-plot', selectedTerms)
+                    createPlotWindow(800, 600, 'enrichment-plot', runId, selectedTerms)
                 else if (createOrUpdate == 'update')
                     // Send the update message just if plotWindow object is not null (.?)
                     globalThis.plotWindow?.webContents.send('plot-updated')
+
+                rememberPlot(event, createOrUpdate, { args: plotArgs })
             }
-        })
 
-        popupOnProcessFail(pythonProcess)
+            popupOnBackendFail(response)
+        })
     })
 
-    ipcMain.on('request-dotplot', (_event, selectedColumnAndTerms, sizeX, sizeY, measurementUnit, createOrUpdate) => {
+    ipcMain.on('request-dotplot', (event, runId, selectedColumnAndTerms, sizeX, sizeY, measurementUnit, createOrUpdate) => {
         // Create a tmp file
         const tmpFile = fileSync();
 
@@ -289,103 +410,153 @@ const createTableWindow = (jsonRawData, analysisType) => {
                 error('The selected data file, to be passed to python script, couldn\'t be created.')
         })
 
-        let pythonProcess = null
+        const plotArgs = [runId, 'dotplot', tmpFile.name, sizeX, sizeY, measurementUnit]
 
-        if (app.isPackaged)
-            pythonProcess = spawn(localPath('pythonBin', 'gsea_plot'), ['dotplot', tmpFile.name, sizeX, sizeY, measurementUnit])
-        else
-            pythonProcess = spawn('python', [localPath('python', 'gsea_plot'), 'dotplot', tmpFile.name, sizeX, sizeY, measurementUnit])
-
-        pythonProcess.on('exit', (code) => {
+        runBackend('plot', plotArgs).then((response) => {
             // Remove the tmp file
             tmpFile.removeCallback()
 
-            if (code == 0) {
+            if (response.code == 0) {
                 if (createOrUpdate == 'create')
-                    createPlotWindow(900, 800, 'dotplot', selectedColumnAndTerms)
+                    createPlotWindow(900, 800, 'dotplot', runId, selectedColumnAndTerms)
                 else if (createOrUpdate == 'update')
                     // Send the update message only if plotWindow object is not null (.?)
                     globalThis.plotWindow?.webContents.send('plot-updated')
+
+                // The selected data file is removed, so the data is kept to pass it again on export
+                rememberPlot(event, createOrUpdate, { args: plotArgs, selectedData: selectedColumnAndTerms })
             }
-        })
 
-        popupOnProcessFail(pythonProcess)
+            popupOnBackendFail(response)
+        })
     })
 
-    ipcMain.on('request-heatmap', (_event, selectedRow, sizeX, sizeY, measurementUnit, createOrUpdate) => {
-        let pythonProcess = null
-
-        if (app.isPackaged)
-            pythonProcess = spawn(localPath('pythonBin', 'gsea_plot'), ['heatmap', selectedRow, sizeX, sizeY, measurementUnit])
-        else
-            pythonProcess = spawn('python', [localPath('python', 'gsea_plot'), 'heatmap', selectedRow, sizeX, sizeY, measurementUnit])
+    ipcMain.on('request-heatmap', (event, runId, selectedRow, sizeX, sizeY, measurementUnit, createOrUpdate) => {
+        const plotArgs = [runId, 'heatmap', selectedRow, sizeX, sizeY, measurementUnit]
 
-        pythonProcess.on('exit', (code) => {
-            if (code == 0) {
+        runBackend('plot', plotArgs).then((response) => {
+            if (response.code == 0) {
                 if (createOrUpdate == 'create')
-                    createPlotWindow(900, 800, 'heatmap', selectedRow)
+                    createPlotWindow(900, 800, 'heatmap', runId, selectedRow)
                 else if (createOrUpdate == 'update')
                     // Send the update message just if plotWindow object is not null (.?)
                     globalThis.plotWindow?.webContents.send('plot-updated')
+
+                rememberPlot(event, createOrUpdate, { args: plotArgs })
             }
-        })
 
-        popupOnProcessFail(pythonProcess)
+            popupOnBackendFail(response)
+        })
     })
 
-    ipcMain.on('request-iou-plot', (_event, selectedTerms, sizeX, sizeY, measurementUnit, createOrUpdate) => {
-        let pythonProcess = null
+    // Heatmap of the union of the leading edges of many gene sets, read from the leading-edge index of the run
+    ipcMain.on('request-leading-edge-heatmap', (event, runId, selectedTerms, sizeX, sizeY, measurementUnit, createOrUpdate) => {
+        const plotArgs = [runId, 'leading-edge-heatmap', selectedTerms, sizeX, sizeY, measurementUnit]
 
-        if (app.isPackaged)
-            pythonProcess = spawn(localPath('pythonBin', 'gsea_plot'), ['intersection-over-union', selectedTerms, globalThis.chosenGeneSetsPath, sizeX, sizeY, measurementUnit])
-        else
-            pythonProcess = spawn('python', [localPath('python', 'gsea_plot'), 'intersection-over-union', selectedTerms, globalThis.chosenGeneSetsPath, sizeX, sizeY, measurementUnit])
-
-        pythonProcess.on('exit', (code) => {
-            if (code == 0) {
+        runBackend('plot', plotArgs).then((response) => {
+            if (response.code == 0) {
                 if (createOrUpdate == 'create')
-                    createPlotWindow(800, 600, 'iou-plot', selectedTerms)
+                    createPlotWindow(900, 800, 'leading-edge-heatmap', runId, selectedTerms)
                 else if (createOrUpdate == 'update')
                     // Send the update message just if plotWindow object is not null (.?)
                     globalThis.plotWindow?.webContents.send('plot-updated')
+
+                rememberPlot(event, createOrUpdate, { args: plotArgs })
             }
-        })
 
-        popupOnProcessFail(pythonProcess)
+            popupOnBackendFail(response)
+        })
     })
 
-    ipcMain.on('request-wordcloud', (_event, selectedColumn, sizeX, sizeY, measurementUnit, createOrUpdate) => {
-        // Create a tmp file
-        const tmpFile = fileSync();
+    // The gene sets order is 'selection' (default) or 'clustered' (hierarchical clustering of the IoU)
+    ipcMain.on('request-iou-plot', (event, runId, selectedTerms, sizeX, sizeY, measurementUnit, createOrUpdate, order = 'selection') => {
+        const plotArgs = [runId, 'intersection-over-union', selectedTerms, runGeneSetsPaths.get(runId), sizeX, sizeY, measurementUnit, `order=${order}`]
 
-        // Write to the tmp file the selected column data
-        // Needed since, most of the times, lead_gene data are too long to be passed as argument
-        writeFileSync(tmpFile.name, selectedColumn, (err) => {
-            if (err)
-                error('The selected column data file, to be passed to python script, couldn\'t be created.')
-        })
+        runBackend('plot', plotArgs).then((response) => {
+            if (response.code == 0) {
+                if (createOrUpdate == 'create')
+                    createPlotWindow(800, 600, 'iou-plot', runId, selectedTerms)
+                else if (createOrUpdate == 'update')
+                    // Send the update message just if plotWindow object is not null (.?)
+                    globalThis.plotWindow?.webContents.send('plot-updated')
 
-        let pythonProcess = null
+                rememberPlot(event, createOrUpdate, { args: plotArgs })
+            }
 
-        if (app.isPackaged)
-            pythonProcess = spawn(localPath('pythonBin', 'gsea_plot'), ['wordcloud', tmpFile.name, sizeX, sizeY, measurementUnit])
-        else
-            pythonProcess = spawn('python', [localPath('python', 'gsea_plot'), 'wordcloud', tmpFile.name, sizeX, sizeY, measurementUnit])
+            popupOnBackendFail(response)
+        })
+    })
 
-        pythonProcess.on('exit', (code) => {
-            // Remove the tmp file
-            tmpFile.removeCallback()
+    // The words are counted by the backend from the selected column of the given terms (see backend_src/term_tokens.py),
+    // so just the column name and the terms are sent
+    ipcMain.on('request-wordcloud', (event, runId, selectedColumnAndTerms, sizeX, sizeY, measurementUnit, createOrUpdate) => {
+        const plotArgs = [runId, 'wordcloud', selectedColumnAndTerms, sizeX, sizeY, measurementUnit]
 
-            if (code == 0) {
+        runBackend('plot', plotArgs).then((response) => {
+            if (response.code == 0) {
                 if (createOrUpdate == 'create')
-                    createPlotWindow(800, 600, 'wordcloud', selectedColumn)
+                    createPlotWindow(800, 600, 'wordcloud', runId, selectedColumnAndTerms)
                 else if (createOrUpdate == 'update')
                     // Send the update message just if plotWindow object is not null (.?)
                     globalThis.plotWindow?.webContents.send('plot-updated')
+
+                rememberPlot(event, createOrUpdate, { args: plotArgs })
             }
+
+            popupOnBackendFail(response)
+        })
+    })
+
+    // Request from a plot window to export the plot it shows with the given extension
+    // Just the preview (.png) is rendered with the plot, the other extensions are rendered on export
+    ipcMain.on('request-plot-export', (event, ext) => {
+        const plot = plotWindowPlots.get(event.sender.id)
+        if (plot === undefined)
+            return
+
+        // The plot is identified by its arguments, so the selected data file (if any) is written again
+        let plotArgs = plot.args
+        let tmpFile = null
+        if (plot.selectedData !== undefined) {
+            tmpFile = fileSync()
+            writeFileSync(tmpFile.name, plot.selectedData)
+            plotArgs = plotArgs.map((arg, i) => i == 2 ? tmpFile.name : arg)
+        }
+
+        runBackend('plot-export', [ext, ...plotArgs]).then((response) => {
+            tmpFile?.removeCallback()
+
+            if (response.code == 0)
+                event.sender.send('plot-exported', ext)
+
+            popupOnBackendFail(response)
         })
+    })
+
+    // Export of the enrichment plots of all the gene sets with a FDR q-val below the given one,
+    // in a .zip archive (one .png per gene set) or in a single paged .pdf file
+    ipcMain.on('request-enrichment-plots-export', (_event, runId, maxFDR, sizeX, sizeY, measurementUnit) => {
+        const outputPath = dialog.showSaveDialogSync({
+            defaultPath: join(HOME_DIR, 'enrichment_plots_' + currentDate + '.zip'),
+            filters: [
+                { name: 'PNG images archive', extensions: ['zip'] },
+                { name: 'PDF document', extensions: ['pdf'] }
+            ]
+        })
+
+        if (outputPath === undefined)
+            return
 
-        popupOnProcessFail(pythonProcess)
+        runBackend('enrichment-plots-export', [runId, outputPath, sizeX, sizeY, measurementUnit, `fdr=${maxFDR}`]).then((response) => {
+            if (response.code == 0)
+                dialog.showMessageBox({
+                    message: response.stdout.trim() + ' enrichment plots exported.\n' + response.stderr.trim(),
+                    type: 'info',
+                    title: 'Export completed'
+                })
+
+            popupOnBackendFail(response)
+        })
     })
 
     ipcMain.on('request-gene-set-info', (_event, selectedTerm) => {
@@ -396,35 +567,18 @@ const createTableWindow = (jsonRawData, analysisType) => {
                 title: 'Failure'
             })
         } else {
-            let pythonProcess = null
-
-            if (app.isPackaged)
-                pythonProcess = spawn(localPath('pythonBin', 'gene_set_info'), [selectedTerm, localPath('resource', 'msigdb.db')])
-            else
-                pythonProcess = spawn('python', [localPath('python', 'gene_set_info'), selectedTerm, localPath('resource', 'msigdb.db')])
+            runBackend('gene-set-info', [selectedTerm, localPath('resource', 'msigdb.db')]).then((response) => {
+                if (response.code == 0)
+                    createGeneSetInfoWindow(response.stdout)
 
-            let jsonContent = ''
-
-            pythonProcess.stdout.on('data', (data) => {
-                jsonContent += data
-            })
-
-            pythonProcess.on('exit', (code) => {
-                if (code == 0)
-                    createGeneSetInfoWindow(jsonContent)
+                popupOnBackendFail(response)
             })
-
-            popupOnProcessFail(pythonProcess)
         }
     })
-
-    tableWindow.maximize()
-
-    tableWindow.loadFile(localPath('web', 'table'))
 }
 
 // Function that creates and handles the plot window
-const createPlotWindow = (customWidth, customHeight, plotType, plotArg) => {
+const createPlotWindow = (customWidth, customHeight, plotType, runId, plotArg) => {
     globalThis.plotWindow = new BrowserWindow({
         width: customWidth,
         height: customHeight,
@@ -434,16 +588,23 @@ const createPlotWindow = (customWidth, customHeight, plotType, plotArg) => {
         }
     })
 
-    // Send plot data (type and args used to generate it) when the window has finished loading
+    // Send plot data (type, run and args used to generate it) when the window has finished loading
     plotWindow.webContents.on('did-finish-load', () => {
-        plotWindow.webContents.send('send-plot-data', plotType, plotArg, PLOT_PATH)
+        plotWindow.webContents.send('send-plot-data', plotType, runId, plotArg, PLOT_PATH)
     })
 
-    // Delete plot file when the window is closed
+    // Forget the plot of the window once it's closed
+    const webContentsId = plotWindow.webContents.id
+    plotWindow.on('closed', () => plotWindowPlots.delete(webContentsId))
+
+    // Delete plot file (and the IoU data export) when the window is closed
     plotWindow.on('close', _event => {
-        plotExtensions.forEach(ext => {
+        const plotFileExtensions = plotType == 'iou-plot' ? plotExtensions.concat(['.csv']) : plotExtensions
+
+        plotFileExtensions.forEach(ext => {
+            // The extensions never exported weren't rendered
             unlink(PLOT_PATH + ext, (err) => {
-                if (err)
+                if (err && err.code !== 'ENOENT')
                     error('Temporary plot file ' + PLOT_PATH + ' cannot be deleted.')
             })
         })
@@ -470,6 +631,60 @@ const createGeneSetInfoWindow = (geneSetInfo) => {
     geneSetInfoWindow.loadFile(localPath('web', 'gene_set_info'))
 }
 
+// Function that returns the stage timings recorded by the backend, skipping any partially written line
+const readProfileRecords = () => {
+    if (!existsSync(PROFILE_PATH))
+        return []
+
+    return readFileSync(PROFILE_PATH, 'utf8').split('\n').flatMap((line) => {
+        try {
+            return line.trim() === '' ? [] : [JSON.parse(line)]
+        } catch {
+            return []
+        }
+    })
+}
+
+// Function that enables or disables the recording of the backend stage timings
+const setProfiling = (enabled) => {
+    profilingEnabled = enabled
+
+    // A worker started later takes it from its environment
+    if (backendWorker !== null)
+        runBackend('set-profile', [enabled ? PROFILE_PATH : '']).then(popupOnBackendFail)
+}
+
+// Function that registers the handlers of the requests sent by the diagnostics window
+const registerDiagnosticsHandlers = () => {
+    ipcMain.on('request-diagnostics-records', (event) => {
+        event.sender.send('send-diagnostics-records', readProfileRecords(), profilingEnabled)
+    })
+
+    ipcMain.on('clear-diagnostics-records', (event) => {
+        if (existsSync(PROFILE_PATH))
+            writeFileSync(PROFILE_PATH, '')
+        event.sender.send('send-diagnostics-records', [], profilingEnabled)
+    })
+}
+
+// Function that creates the diagnostics window, showing the stage timings recorded by the backend
+const createDiagnosticsWindow = () => {
+    const diagnosticsWindow = new BrowserWindow({
+        width: 1000,
+        height: 700,
+        icon: localPath('icon', 'compass_1024px.png'),
+        webPreferences: {
+            preload: localPath('preload', 'diagnostics_preload')
+        }
+    })
+
+    diagnosticsWindow.webContents.on('did-finish-load', () => {
+        diagnosticsWindow.webContents.send('send-diagnostics-records', readProfileRecords(), profilingEnabled)
+    })
+
+    diagnosticsWindow.loadFile(localPath('web', 'diagnostics'))
+}
+
 // Function that creates a window to upload the MSigDB 
 const createUploadMsigdbWindow = () => {
     const uploadMsigdbWindow = new BrowserWindow({
@@ -527,6 +742,25 @@ const menuTemplate = [
                 licenseWindow.loadFile('NOTICE.md')
             }
         }]
+    },
+    {
+        label: 'Diagnostics',
+        submenu: [
+            {
+                label: 'Record stage timings',
+                type: 'checkbox',
+                checked: profilingEnabled,
+                click(menuItem) {
+                    setProfiling(menuItem.checked)
+                }
+            },
+            {
+                label: 'Show stage timings',
+                click() {
+                    createDiagnosticsWindow()
+                }
+            }
+        ]
     }
 ]
 Menu.setApplicationMenu(Menu.buildFromTemplate(menuTemplate))
@@ -537,6 +771,9 @@ if (require('electron-squirrel-startup'))
     app.quit()
 
 app.whenReady().then(() => {
+    registerTableHandlers()
+    registerDiagnosticsHandlers()
+
     // If the MSigDB hasn' been uploaded
     if (existsSync(localPath('resource', 'msigdb.db')))
         createMainWindow()
@@ -551,12 +788,11 @@ app.whenReady().then(() => {
 
 app.on('window-all-closed', () => {
     if (process.platform !== 'darwin') {
-        unlink(join(HOME_DIR, 'gseacompass_python_session.pkl'), (err) => {
-            if (err)
-                error('\n========================\nWarning: The file ' + join(HOME_DIR, 'gseacompass_python_session.pkl couldn\'t be deleted.') + ' \n========================\n')
-        })
-
         app.quit()
     }
 })
 
+app.on('will-quit', () => {
+    backendWorker?.kill()
+})
+
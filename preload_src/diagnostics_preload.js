@@ -0,0 +1,10 @@
+const { contextBridge, ipcRenderer } = require('electron')
+
+contextBridge.exposeInMainWorld('electronAPI', {
+    onReceivedRecords: (callback) => 
+        ipcRenderer.on('send-diagnostics-records', (_event, records, profilingEnabled) => callback(records, profilingEnabled)),
+    requestRecords: () => 
+        ipcRenderer.send('request-diagnostics-records'),
+    clearRecords: () => 
+        ipcRenderer.send('clear-diagnostics-records')
+})
@@ -1,8 +1,10 @@
 const { contextBridge, ipcRenderer, webUtils } = require('electron')
 
 contextBridge.exposeInMainWorld('electronAPI', {
-    sendDataGsea: (geneSetsPath, numPermutations, minGeneSet, maxGeneSet, expressionSetPath, phenotypeLabels, remapOption, chipPath) =>
-        ipcRenderer.send('send-data-gsea', webUtils.getPathForFile(geneSetsPath), numPermutations, minGeneSet, maxGeneSet, webUtils.getPathForFile(expressionSetPath), webUtils.getPathForFile(phenotypeLabels), remapOption, chipPath != null ? webUtils.getPathForFile(chipPath) : 'null'),
+    sendDataGsea: (geneSetsPath, numPermutations, minGeneSet, maxGeneSet, expressionSetPath, phenotypeLabels, remapOption, chipPath, numThreads, adaptive) =>
+        ipcRenderer.send('send-data-gsea', webUtils.getPathForFile(geneSetsPath), numPermutations, minGeneSet, maxGeneSet, webUtils.getPathForFile(expressionSetPath), webUtils.getPathForFile(phenotypeLabels), remapOption, chipPath != null ? webUtils.getPathForFile(chipPath) : 'null', numThreads, adaptive),
     showHelperPopup: (helpString) => 
-        ipcRenderer.send('show-helper-popup', helpString)
+        ipcRenderer.send('show-helper-popup', helpString),
+    onAnalysisEvent: (callback) => 
+        ipcRenderer.on('analysis-event', (_event, analysisEvent) => callback(analysisEvent))
 })
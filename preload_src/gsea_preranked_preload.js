@@ -1,8 +1,10 @@
 const { contextBridge, ipcRenderer, webUtils } = require('electron')
 
 contextBridge.exposeInMainWorld('electronAPI', {
-    sendDataPreranked: (geneSetsPath, numPermutations, minGeneSet, maxGeneSet, rankedListPath, remapOption, chipPath) =>
-        ipcRenderer.send('send-data-preranked', webUtils.getPathForFile(geneSetsPath), numPermutations, minGeneSet, maxGeneSet, webUtils.getPathForFile(rankedListPath), remapOption, chipPath != null ? webUtils.getPathForFile(chipPath) : null),
+    sendDataPreranked: (geneSetsPath, numPermutations, minGeneSet, maxGeneSet, rankedListPath, remapOption, chipPath, numThreads) =>
+        ipcRenderer.send('send-data-preranked', webUtils.getPathForFile(geneSetsPath), numPermutations, minGeneSet, maxGeneSet, webUtils.getPathForFile(rankedListPath), remapOption, chipPath != null ? webUtils.getPathForFile(chipPath) : null, numThreads),
     showHelperPopup: (helpString) => 
-        ipcRenderer.send('show-helper-popup', helpString)
+        ipcRenderer.send('show-helper-popup', helpString),
+    onAnalysisEvent: (callback) => 
+        ipcRenderer.on('analysis-event', (_event, analysisEvent) => callback(analysisEvent))
 })
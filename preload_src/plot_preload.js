@@ -2,10 +2,14 @@ const { contextBridge, ipcRenderer } = require('electron')
 
 contextBridge.exposeInMainWorld('electronAPI', {
     onReceviedData: (callback) =>
-        ipcRenderer.on('send-plot-data', (_event, plotType, plotArg, plotPath) => callback(plotType, plotArg, plotPath)),
+        ipcRenderer.on('send-plot-data', (_event, plotType, runId, plotArg, plotPath) => callback(plotType, runId, plotArg, plotPath)),
     onPlotUpdated: (callback) =>
         ipcRenderer.on('plot-updated', (_event) => callback()),
-    changePlotSize: (plotType, plotArg, sizeX, sizeY, measurementUnit) => {
-        ipcRenderer.send('request-' + plotType, plotArg, sizeX, sizeY, measurementUnit, 'update')
+    exportPlot: (ext) =>
+        ipcRenderer.send('request-plot-export', ext),
+    onPlotExported: (callback) =>
+        ipcRenderer.on('plot-exported', (_event, ext) => callback(ext)),
+    changePlotSize: (plotType, runId, plotArg, sizeX, sizeY, measurementUnit, order) => {
+        ipcRenderer.send('request-' + plotType, runId, plotArg, sizeX, sizeY, measurementUnit, 'update', order)
     }
 })
\ No newline at end of file
@@ -2,17 +2,23 @@ const { contextBridge, ipcRenderer } = require('electron')
 
 contextBridge.exposeInMainWorld('electronAPI', {
     onReceviedData: (callback) => 
-        ipcRenderer.on('send-analysis-data', (_event, jsonData, analysisType) => callback(jsonData, analysisType)),
-    requestEnrichmentPlot: (selectedTerms) => 
-        ipcRenderer.send('request-enrichment-plot', selectedTerms, 4, 5, 'in', 'create'),
-    requestDotplot: (selectedColumnAndTerms) => 
-        ipcRenderer.send('request-dotplot', selectedColumnAndTerms, 4, 7, 'in', 'create'),
-    requestHeatmap: (selectedRow) => 
-        ipcRenderer.send('request-heatmap', selectedRow, 14, 4, 'in', 'create'),
-    requestIOUPlot: (selectedTerms) => 
-        ipcRenderer.send('request-iou-plot', selectedTerms, 7, 7, 'in', 'create'),
-    requestWordCloud: (selectedColumn) => 
-        ipcRenderer.send('request-wordcloud', selectedColumn, 800, 500, 'px', 'create'),
+        ipcRenderer.on('send-analysis-data', (_event, analysisType, runId) => callback(analysisType, runId)),
+    onReceivedRows: (callback) => 
+        ipcRenderer.on('send-analysis-rows', (_event, rows) => callback(rows)),
+    requestEnrichmentPlot: (runId, selectedTerms) => 
+        ipcRenderer.send('request-enrichment-plot', runId, selectedTerms, 4, 5, 'in', 'create'),
+    requestDotplot: (runId, selectedColumnAndTerms) => 
+        ipcRenderer.send('request-dotplot', runId, selectedColumnAndTerms, 4, 7, 'in', 'create'),
+    requestHeatmap: (runId, selectedRow) => 
+        ipcRenderer.send('request-heatmap', runId, selectedRow, 14, 4, 'in', 'create'),
+    requestLeadingEdgeHeatmap: (runId, selectedTerms) => 
+        ipcRenderer.send('request-leading-edge-heatmap', runId, selectedTerms, 14, 4, 'in', 'create'),
+    requestIOUPlot: (runId, selectedTerms) => 
+        ipcRenderer.send('request-iou-plot', runId, selectedTerms, 7, 7, 'in', 'create'),
+    requestWordCloud: (runId, selectedColumnAndTerms) => 
+        ipcRenderer.send('request-wordcloud', runId, selectedColumnAndTerms, 800, 500, 'px', 'create'),
     requestGeneSetInfo: (selectedTerm) => 
-        ipcRenderer.send('request-gene-set-info', selectedTerm)
+        ipcRenderer.send('request-gene-set-info', selectedTerm),
+    exportEnrichmentPlots: (runId, maxFDR) => 
+        ipcRenderer.send('request-enrichment-plots-export', runId, maxFDR, 4, 5, 'in')
 })
@@ -0,0 +1,69 @@
+const statusObj = document.querySelector('#status')
+
+// Format a number of seconds or megabytes, or a dash if missing
+const formatNumber = (value, digits) => value === null || value === undefined ? '-' : value.toFixed(digits)
+
+// Records of the backend stages, most recent first
+const recordsTable = new DataTable('#recordsTable', {
+    data: [],
+    columns: [
+        { data: 'time', title: 'Time', render: (time) => new Date(time).toLocaleString() },
+        { data: 'command', title: 'Command' },
+        { data: 'stage', title: 'Stage' },
+        { data: 'seconds', title: 'Seconds', render: (seconds) => formatNumber(seconds, 3) },
+        { data: 'rows', title: 'Rows', render: (rows) => rows ?? '-' },
+        { data: 'peak_rss_mb', title: 'Peak memory (MB)', render: (peak) => formatNumber(peak, 1) },
+        { data: 'ok', title: 'Completed', render: (ok) => ok ? 'yes' : 'no' }
+    ],
+    order: [[0, 'desc']],
+    pageLength: 25
+})
+
+// Time and memory of each stage of each command over all its records, slowest first
+const summaryTable = new DataTable('#summaryTable', {
+    data: [],
+    columns: [
+        { data: 'command', title: 'Command' },
+        { data: 'stage', title: 'Stage' },
+        { data: 'count', title: 'Runs' },
+        { data: 'total', title: 'Total seconds', render: (seconds) => formatNumber(seconds, 3) },
+        { data: 'mean', title: 'Mean seconds', render: (seconds) => formatNumber(seconds, 3) },
+        { data: 'max', title: 'Max seconds', render: (seconds) => formatNumber(seconds, 3) },
+        { data: 'peak', title: 'Max peak memory (MB)', render: (peak) => formatNumber(peak, 1) }
+    ],
+    order: [[3, 'desc']],
+    pageLength: 10
+})
+
+// Group the given records by command and stage
+const summarize = (records) => {
+    const groups = new Map()
+
+    for (const record of records) {
+        const key = record.command + '\0' + record.stage
+        if (!groups.has(key))
+            groups.set(key, { command: record.command, stage: record.stage, count: 0, total: 0, max: 0, peak: null })
+
+        const group = groups.get(key)
+        group.count += 1
+        group.total += record.seconds
+        group.max = Math.max(group.max, record.seconds)
+        if (record.peak_rss_mb !== null && record.peak_rss_mb !== undefined)
+            group.peak = Math.max(group.peak ?? 0, record.peak_rss_mb)
+    }
+
+    return [...groups.values()].map((group) => ({ ...group, mean: group.total / group.count }))
+}
+
+window.electronAPI.onReceivedRecords((records, profilingEnabled) => {
+    statusObj.innerText = (profilingEnabled
+        ? 'The stage timings are being recorded.'
+        : 'The stage timings aren\'t being recorded, enable them from the Diagnostics menu.')
+        + ` ${records.length} stages recorded.`
+
+    recordsTable.clear().rows.add(records).draw()
+    summaryTable.clear().rows.add(summarize(records)).draw()
+})
+
+document.querySelector('#refresh').addEventListener('click', () => window.electronAPI.requestRecords())
+document.querySelector('#clear').addEventListener('click', () => window.electronAPI.clearRecords())
@@ -2,6 +2,8 @@ const geneSetsObj = document.querySelector('#gene_sets')
 const numPermutationsObj = document.querySelector('#num_permutations')
 const minGeneSetObj = document.querySelector('#min_gene_set')
 const maxGeneSetObj = document.querySelector('#max_gene_set')
+const numThreadsObj = document.querySelector('#num_threads')
+const adaptiveObj = document.querySelector('#adaptive')
 const expressionSetObj = document.querySelector('#expression_set')
 const phenotypeLabelsObj = document.querySelector('#phenotype_labels')
 const chipObj = document.querySelector('#chip')
@@ -12,12 +14,14 @@ submitBtn.addEventListener('click', (_event) => {
     const numPermutations = numPermutationsObj.value
     const minGeneSet = minGeneSetObj.value
     const maxGeneSet = maxGeneSetObj.value
+    const numThreads = numThreadsObj.value
+    const adaptive = adaptiveObj.checked
     const expressionSet = expressionSetObj.files[0]
     const phenotypeLabels = phenotypeLabelsObj.files[0]
     const remapOption = document.querySelector('[name="remap"]:checked').value
     const chipPath = chipObj.files[0]
 
-    window.electronAPI.sendDataGsea(geneSetsPath, numPermutations, minGeneSet, maxGeneSet, expressionSet, phenotypeLabels, remapOption, chipPath)
+    window.electronAPI.sendDataGsea(geneSetsPath, numPermutations, minGeneSet, maxGeneSet, expressionSet, phenotypeLabels, remapOption, chipPath, numThreads, adaptive)
 })
 
 const showHelper = (helpString) => window.electronAPI.showHelperPopup(helpString)
\ No newline at end of file
@@ -0,0 +1,26 @@
+const phaseObj = document.querySelector('#phase')
+const progressObj = document.querySelector('#progress')
+
+// Description of each analysis phase
+const phaseDescriptions = {
+    'reading-inputs': 'Reading the input files...',
+    'computing': 'Computing the analysis...',
+    'writing-results': 'Writing the results...'
+}
+
+// The loading page is shown by the analysis windows, whose preload exposes the analysis events
+window.electronAPI.onAnalysisEvent?.((analysisEvent) => {
+    if (analysisEvent.event === 'phase') {
+        phaseObj.innerText = phaseDescriptions[analysisEvent.phase] ?? ''
+    }
+    else if (analysisEvent.event === 'progress') {
+        progressObj.hidden = false
+        progressObj.max = analysisEvent.total
+        progressObj.value = analysisEvent.done
+        phaseObj.innerText = `Computing the analysis... ${Math.round(100 * analysisEvent.done / analysisEvent.total)}% of the permutations done`
+    }
+    else if (analysisEvent.event === 'summary') {
+        progressObj.hidden = true
+        phaseObj.innerText = `${analysisEvent.gene_sets} gene sets analysed, ${analysisEvent.significant} with FDR < 25%`
+    }
+})
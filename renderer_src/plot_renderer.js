@@ -8,19 +8,32 @@ const updateSizeButton = document.querySelector('#update-size-btn')
 const savePngButton = document.querySelector('#save-png-btn')
 const savePdfButton = document.querySelector('#save-pdf-btn')
 const saveSvgButton = document.querySelector('#save-svg-btn')
+const saveCsvButton = document.querySelector('#save-csv-btn')
 const savePngHiddenAnchor = document.querySelector('#save-png-hidden-anchor')
 const savePdfHiddenAnchor = document.querySelector('#save-pdf-hidden-anchor')
 const saveSvgHiddenAnchor = document.querySelector('#save-svg-hidden-anchor')
+const saveCsvHiddenAnchor = document.querySelector('#save-csv-hidden-anchor')
+const iouOrderCol = document.querySelector('#iou-order-col')
+const iouOrder = document.querySelector('#iou-order')
 
 // Set up save buttons
+// The plot is rendered just as .png, the other extensions are rendered when saved
+const exportAnchors = { '.pdf': savePdfHiddenAnchor, '.svg': saveSvgHiddenAnchor }
+
 savePngButton.addEventListener('click', () => {
     savePngHiddenAnchor.click()
 })
 savePdfButton.addEventListener('click', () => {
-    savePdfHiddenAnchor.click()
+    window.electronAPI.exportPlot('.pdf')
 })
 saveSvgButton.addEventListener('click', () => {
-    saveSvgHiddenAnchor.click()
+    window.electronAPI.exportPlot('.svg')
+})
+window.electronAPI.onPlotExported((ext) => {
+    exportAnchors[ext]?.click()
+})
+saveCsvButton.addEventListener('click', () => {
+    saveCsvHiddenAnchor.click()
 })
 
 // Create and set up Panzoom
@@ -40,7 +53,7 @@ zoomOutButton.addEventListener('click', () => {
 })
 
 // Behavior when plot data received
-window.electronAPI.onReceviedData((plotType, plotArg, plotPath) => {
+window.electronAPI.onReceviedData((plotType, runId, plotArg, plotPath) => {
     img.src = plotPath + '.png'
 
     savePngHiddenAnchor.href = plotPath + '.png'
@@ -51,18 +64,32 @@ window.electronAPI.onReceviedData((plotType, plotArg, plotPath) => {
     if (plotType == 'wordcloud')
         saveSvgButton.style.display = 'none'
 
+    // Show the data export and the gene sets order for the IoU plot
+    if (plotType == 'iou-plot') {
+        saveCsvHiddenAnchor.href = plotPath + '.csv'
+        saveCsvButton.style.display = ''
+        iouOrderCol.style.display = ''
+    }
+
+    // Needed to update the image after being re-generated
+    // otherwise, because of cache, the same would be shown
+    window.electronAPI.onPlotUpdated(() => {
+        const timestamp = new Date().getTime()
+        img.src = plotPath + '.png?t=' + timestamp
+    })
+
     // Update the plot size when update button clicked
     updateSizeButton.addEventListener('click', () => {
         // If the inputs are not empty
-        if (xSize.value != '' && ySize.value != '') {
-            window.electronAPI.changePlotSize(plotType, plotArg, xSize.value, ySize.value, measurementUnit.value)
+        if (xSize.value != '' && ySize.value != '')
+            window.electronAPI.changePlotSize(plotType, runId, plotArg, xSize.value, ySize.value, measurementUnit.value, iouOrder.value)
+    })
 
-            // Needed to update the image after being re-generated
-            // otherwise, because of cache, the same would be shown
-            window.electronAPI.onPlotUpdated(() => {
-                const timestamp = new Date().getTime()
-                img.src = plotPath + '.png?t=' + timestamp
-            })
-        }
+    // Re-generate the IoU plot when the gene sets order changes, keeping the size if given
+    iouOrder.addEventListener('change', () => {
+        if (xSize.value != '' && ySize.value != '')
+            window.electronAPI.changePlotSize(plotType, runId, plotArg, xSize.value, ySize.value, measurementUnit.value, iouOrder.value)
+        else
+            window.electronAPI.changePlotSize(plotType, runId, plotArg, 7, 7, 'in', iouOrder.value)
     })
 })
\ No newline at end of file
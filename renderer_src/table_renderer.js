@@ -14,18 +14,31 @@ let exportColSelector = (idx, _data, _node) => {
 let table = ''
 const tableTitle = document.querySelector('#table-title')
 
-window.electronAPI.onReceviedData((rawJsonData, analysisType) => {
-    jsonData = JSON.parse(rawJsonData)
+// Index of the table row of each term, used to update the provisional rows with the final ones
+const rowIndexes = new Map()
+
+// Add the received rows to the table, replacing the ones already present for the same term
+window.electronAPI.onReceivedRows((rows) => {
+    for (const row of rows) {
+        if (rowIndexes.has(row.Term))
+            table.row(rowIndexes.get(row.Term)).data(row)
+        else
+            rowIndexes.set(row.Term, table.row.add(row).index())
+    }
+
+    table.draw(false)
+})
 
+window.electronAPI.onReceviedData((analysisType, runId) => {
     // Set title above the table
     if (analysisType === 'gsea')
         tableTitle.innerText = 'GSEA results'
     else if (analysisType === 'gsea_preranked')
         tableTitle.innerText = 'GSEA preranked results'
 
-    // Initialise the table
+    // Initialise the table, the rows are added as soon as they are received
     table = new DataTable('#dataTable', {
-        data: jsonData,
+        data: [],
         columns: [
             { data: 'Select', title: '' },
             { data: 'Term', title: 'Term' },
@@ -38,6 +51,10 @@ window.electronAPI.onReceviedData((rawJsonData, analysisType) => {
             { data: 'Tag %', title: 'Tag %' },
             { data: 'Lead_genes', title: 'Lead_genes' }
         ],
+        // Show in italic the provisional rows, whose values are still being refined by the analysis
+        rowCallback: (row, data) => {
+            row.style.fontStyle = data.final === false ? 'italic' : ''
+        },
         columnDefs: [
             {
                 // Enable ellipsis truncation on first and last data columns (term and lead_genes)
@@ -90,7 +107,7 @@ window.electronAPI.onReceviedData((rawJsonData, analysisType) => {
                                         selectedTerms[i] = selectedRows[i].Term
 
                                     // Send the selected terms in JSON format
-                                    window.electronAPI.requestEnrichmentPlot(JSON.stringify(selectedTerms))
+                                    window.electronAPI.requestEnrichmentPlot(runId, JSON.stringify(selectedTerms))
                                 }
                             },
                             {
@@ -120,7 +137,7 @@ window.electronAPI.onReceviedData((rawJsonData, analysisType) => {
                                         selectedTerms[i] = rows[i].Term
 
                                     // Send the selected column title and selecter/visible rows terms in JSON format
-                                    window.electronAPI.requestDotplot(JSON.stringify([selectedColumn, selectedTerms]))
+                                    window.electronAPI.requestDotplot(runId, JSON.stringify([selectedColumn, selectedTerms]))
                                 }
                             },
                             {
@@ -128,11 +145,19 @@ window.electronAPI.onReceviedData((rawJsonData, analysisType) => {
                                 name: 'heatmap',
                                 enabled: false,
                                 action: () => {
-                                    // Fetch the selected row
-                                    const selectedRow = table.rows({ selected: true }).data()[0]
+                                    const selectedRows = table.rows({ selected: true }).data()
 
-                                    // Send the selected row in JSON format
-                                    window.electronAPI.requestHeatmap(JSON.stringify(selectedRow))
+                                    if (selectedRows.length === 1) {
+                                        // Send the selected row in JSON format
+                                        window.electronAPI.requestHeatmap(runId, JSON.stringify(selectedRows[0]))
+                                    } else {
+                                        // Heatmap of the union of the leading edges of the selected terms
+                                        const selectedTerms = []
+                                        for (let i = 0; i < selectedRows.length; i++)
+                                            selectedTerms[i] = selectedRows[i].Term
+
+                                        window.electronAPI.requestLeadingEdgeHeatmap(runId, JSON.stringify(selectedTerms))
+                                    }
                                 }
                             },
                             {
@@ -149,7 +174,7 @@ window.electronAPI.onReceviedData((rawJsonData, analysisType) => {
                                     for (let i = 0; i < numSelectedRows; i++)
                                         selectedTerms[i] = selectedRows[i].Term
 
-                                    window.electronAPI.requestIOUPlot(JSON.stringify(selectedTerms))
+                                    window.electronAPI.requestIOUPlot(runId, JSON.stringify(selectedTerms))
                                 }
                             },
                             {
@@ -167,19 +192,19 @@ window.electronAPI.onReceviedData((rawJsonData, analysisType) => {
                                     const visibleRows = table.rows({ search: 'applied' }).data()
 
                                     let rows = ''
-                                    const selectedStrings = []
+                                    const selectedTerms = []
 
                                     if (selectedRows.length === 0)
                                         rows = visibleRows
                                     else
                                         rows = selectedRows
 
-                                    // Put each chosen row field (that of the selected column) in an array
+                                    // Put each chosen row Term in an array, the words of the selected column
+                                    // are counted by the backend
                                     for (let i = 0; i < rows.length; i++)
-                                        selectedStrings[i] = rows[i][selectedColumnHeader]
-
+                                        selectedTerms[i] = rows[i].Term
 
-                                    window.electronAPI.requestWordCloud(JSON.stringify(selectedStrings))
+                                    window.electronAPI.requestWordCloud(runId, JSON.stringify([selectedColumnHeader, selectedTerms]))
                                 }
                             }
                         ]
@@ -222,6 +247,14 @@ window.electronAPI.onReceviedData((rawJsonData, analysisType) => {
                                     columns: exportColSelector,
                                     orthogonal: 'export'
                                 }
+                            },
+                            {
+                                // Enrichment plots of all the gene sets below the FDR q-val filter (25% if not set)
+                                text: 'Enrichment plots',
+                                action: () => {
+                                    const maxFDR = parseFloat(document.querySelector('#maxFDR').value)
+                                    window.electronAPI.exportEnrichmentPlots(runId, isNaN(maxFDR) ? 0.25 : maxFDR)
+                                }
                             }
                         ]
                     },
@@ -242,7 +275,7 @@ window.electronAPI.onReceviedData((rawJsonData, analysisType) => {
         table.button(['enrichmentPlot:name']).enable(numSelectedRows > 0 && numSelectedCols === 0)
         table.button(['dotplot:name']).enable(numSelectedCols === 1 && selectedColumns.titles()[0] !== "Term" && selectedColumns.titles()[0] !== "Lead_genes" 
             && selectedColumns.titles()[0] !== "Gene %" && selectedColumns.titles()[0] !== "Tag %")
-        table.button(['heatmap:name']).enable(numSelectedRows === 1 && analysisType === 'gsea')
+        table.button(['heatmap:name']).enable(numSelectedRows > 0 && numSelectedCols === 0 && analysisType === 'gsea')
         table.button(['iouPlot:name']).enable(numSelectedRows >= 2 && numSelectedCols === 0)
         table.button(['wordcloud:name']).enable(numSelectedCols === 1 && (selectedColumns.titles()[0] === "Term" || selectedColumns.titles()[0] === "Lead_genes"))
     })